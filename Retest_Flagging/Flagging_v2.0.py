@@ -11,211 +11,161 @@ Notes:
 Version Updates:
 v2.0 - Initial release - Built off flagging_script_official.py (9/26)
 v2.1 - dQ model and impingement module and config file implemented. (12/8)
+v2.2 - Retest formation months located through local lot index instead of monthly table probing
+v2.3 - Batch runner flags multiple lots concurrently and writes a per-lot status report
+v2.4 - Retest formation data streamed into typed column buffers, months joined once
+v2.5 - Initial cell data queried on MES and cold databases concurrently through the threaded query executor
+v2.6 - Per-stage instrumentation spans and JSON run report
+v2.7 - Meter offsets and validation verdicts cached on disk
+v2.8 - Summary and pchart rows upserted into a local summary store, dq_summary.csv exported once per batch
+v2.9 - Service mode (--service) flags lots as soon as retest formation completes
+v2.10 - dQdV curve registry per cell model, mixed-model lots judged in one pass (900X only for models without a curve)
+v2.11 - Settings and reference data read from config, loaded lazily once per process instead of in __main__
+v2.12 - Completeness check, cell IDs and formation data derived from one read of the lot's V1/V2 rows
+v2.13 - Every monthly table queried on the database that holds it (partition_router), tiers queried in parallel
 """
 import os
 import pandas as pd
 import numpy as np
 import time
-import tqdm
-import cx_Oracle
-import configparser
-import multiprocessing as mp
-
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-from offset import getOffsets
+import sys
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from functools import partial
+from retest_flagging.config import (get_db_info, get_mm_ref, get_dq_curves, volt_spec, ndv_spec, rshort_spec, dv_offset,
+                    dv_coefficient, model_number, DIRECTORY, MIRROR_DIRECTORY, LOT_INDEX, SUMMARY_STORE, LOT_TRACKER,
+                    BATCH_WORKERS, SERVICE_POLL, SCAN_OVERLAP)
+from offset import getOffsets, offsetCacheStats, clearSharedResults
 from impingement import get_impingement_cells
+from retest_flagging.cell_id import decode_yymm, decode_assembly_date, decode_model
+from retest_flagging.dq_curve import lookup_dqdv
+from retest_flagging.bulk_lookup import CELL_ID_JOIN, pool_cell_query
+from retest_flagging.db_pool import connection, read_sql
+from retest_flagging.instrumentation import start_trace, end_trace, span, write_run_report
+from retest_flagging.query_executor import run_queries
+from formation_mirror import mirror_ready, read_mirror
+from stream_fetch import pool_stream_query
+from retest_flagging.partition_router import month_tier
+from judgment import judge, DEFECT_RULES, DQ_RULES, PROCESS_NG_CODES, DQ_NG_CODES
+from lot_index import update_index, lookup_lot, probe_open_month
+from summary_store import upsert_lot, export_csv, import_csv
+from lot_tracker import get_watermark, set_watermark, queue_lots, pending_lots, record_results
 
 
 def get_retest_date(lot: str, db: dict) -> list[str]:
     """
     Input: lot number and database credentials
-    Function: determines retest formation date
+    Function: determines retest formation date from the local lot index (closed months) and the current month tables,
+              the index itself is refreshed once per batch by run_batch
     Output: formation table dates
     """
     print('get retest date')
-    retest_month_list = []
-    # look for retest formation month in MES tables
-    with cx_Oracle.connect(user=db['mes_user'], password=db['mes_pw'], dsn=db['mes_dsn']) as con:
-        for month in [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(0, 12)]:
-            v1_cell_count = pd.read_sql(f"""
-            SELECT COUNT(CELL_ID)
-            FROM GEIS.T_CELL_ENG_GC12_{month}
-            WHERE LOT_NO = '{lot}'
-            """, con)
-            v2_cell_count = pd.read_sql(f"""
-            SELECT COUNT(CELL_ID)
-            FROM GEIS.T_CELL_ENG_GC13_{month}
-            WHERE LOT_NO = '{lot}'
-            """, con)
-            if v1_cell_count.iloc[0, 0] != 0:
-                retest_month_list.append(month)
-            if v2_cell_count.iloc[0, 0] != 0:
-                retest_month_list.append(month)
-    if len(retest_month_list) == 0:
-        with cx_Oracle.connect(user=db['cold_user'], password=db['cold_pw'], dsn=db['cold_dsn']) as con:
-            for month in [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(12, 24)]:
-                v1_cell_count = pd.read_sql(f"""
-                SELECT COUNT(CELL_ID)
-                FROM GEIS.T_CELL_ENG_GC12_{month}
-                WHERE LOT_NO = '{lot}'
-                """, con)
-                v2_cell_count = pd.read_sql(f"""
-                SELECT COUNT(CELL_ID)
-                FROM GEIS.T_CELL_ENG_GC13_{month}
-                WHERE LOT_NO = '{lot}'
-                """, con)
-                if v1_cell_count.iloc[0, 0] != 0:
-                    retest_month_list.append(month)
-                if v2_cell_count.iloc[0, 0] != 0:
-                    retest_month_list.append(month)
+    retest_month_list = list(lookup_lot(lot, LOT_INDEX).YYMM) + probe_open_month(lot, db)
     retest_month_list = list(set(retest_month_list))
     print('retest month list', retest_month_list)
     return retest_month_list
 
 
-def check_retest_complete(lot: str, db: dict, cold_db: bool, yymm_list: list[str]) -> bool:
-    """
-    Input: lot number, database credentials, cold boolean indicator and table month list
-    Function: checks tray counts between v1 and v2
-    Output: boolean indicator if retest formation is complete
-    """
-    print('check retest complete')
-    user = db['mes_user']
-    pw = db['mes_pw']
-    dsn = db['mes_dsn']
-    if cold_db:  # can delete?
-        user = db['cold_user']
-        pw = db['cold_pw']
-        dsn = db['cold_dsn']
-    v1_tables = ' UNION ALL '.join([f'(SELECT CELL_ID, LOT_NO, TRAY_NO FROM GEIS.T_CELL_ENG_GC12_{yymm})'
-                                    for yymm in yymm_list])
-    v2_tables = ' UNION ALL '.join([f'(SELECT CELL_ID, LOT_NO, TRAY_NO FROM GEIS.T_CELL_ENG_GC13_{yymm})'
-                                    for yymm in yymm_list])
-    with cx_Oracle.connect(user=user, password=pw, dsn=dsn) as con:
-        v1_tray_count = pd.read_sql(f"""
-        SELECT COUNT(DISTINCT(TRAY_NO))
-        FROM ({v1_tables})
-        WHERE LOT_NO = '{lot}'
-        AND CELL_ID LIKE 'G%'
-        """, con)
-        v2_tray_count = pd.read_sql(f"""
-        SELECT COUNT(DISTINCT(TRAY_NO))
-        FROM ({v2_tables})
-        WHERE LOT_NO = '{lot}'
-        AND CELL_ID LIKE 'G%'
-        """, con)
-        print(v1_tray_count, v2_tray_count)
-    return abs(v1_tray_count.iloc[0, 0] - v2_tray_count.iloc[0, 0]) <= 1 and v1_tray_count.iloc[0, 0] > 0
+V1_DTYPES = {'RETEST_V1': np.float64, 'V1_MEASURE_DATE': 'datetime64[ns]'}
+V2_DTYPES = {'RETEST_V2': np.float64, 'V2_MEASURE_DATE': 'datetime64[ns]'}
 
 
-def get_retest_formation_data(lot: str, db: dict, cold_db: bool, yymm_list: list[str]) -> pd.DataFrame():
+def load_retest_lot(lot: str, db: dict, yymm_list: list[str]) -> (bool, pd.DataFrame(), pd.DataFrame()):
     """
-    Input: lot number, database credentials, cold database boolean, and table month list
-    Function: queries database for retest formation data
-    Output: retest formation data
-            index: [Default]
-            columns: [TRAY_NO, TRAY_POSITION, RETEST_V1, METER, V1_MEASURE_DATE, V1_MACHINE, CELL_MODEL, CELL_ID,
-                      RETEST_V2, V2_MEASURE_DATE, V2_MACHINE, LINE_NO, DEFECT_REASON_CD]
+    Input: lot number, database credentials and table month list
+    Function: reads the lot's V1 and V2 rows once per month table (each month on the database that holds it, all
+              months at the same time) and derives the retest completeness (tray counts between v1 and v2), the
+              lot's cell IDs and the merged retest formation data from them
+    Output: boolean indicator if retest formation is complete, cell IDs in the retest lot (V2 rows) and retest formation
+            data
+            cell IDs columns: [CELL_ID]
+            formation data columns: [TRAY_NO, TRAY_POSITION, RETEST_V1, METER, V1_MEASURE_DATE, V1_MACHINE,
+                                     CELL_MODEL, CELL_ID, RETEST_V2, V2_MEASURE_DATE, V2_MACHINE, LINE_NO,
+                                     DEFECT_REASON_CD]
     """
-    print('get retest formation data')
-    formation_data = pd.DataFrame()
-    user = db['mes_user']
-    pw = db['mes_pw']
-    dsn = db['mes_dsn']
-    if cold_db:
-        user = db['cold_user']
-        pw = db['cold_pw']
-        dsn = db['cold_dsn']
-    v1_data = pd.DataFrame()
-    v2_data = pd.DataFrame()
-    with cx_Oracle.connect(user=user, password=pw, dsn=dsn) as con:
-        for yymm in yymm_list:
-            # may not need tray no, tray position
-            v1_data = pd.concat([v1_data,pd.read_sql(f"""
-            SELECT CELL_ID, TRAY_NO, TRAY_POSITION, DATA_01 AS RETEST_V1, MOD(SUBSTR(TRAY_POSITION, 2, 2), 4) AS METER,
-            MEASURE_DATE AS V1_MEASURE_DATE, EQUIP_NO AS V1_MACHINE,(CASE
-            WHEN SUBSTR(CELL_ID, 16, 1) = '1' THEN 'BR'
-            WHEN SUBSTR(CELL_ID, 16, 1) = '2' THEN 'AR'
-            WHEN SUBSTR(CELL_ID, 16, 1) = '4' THEN 'DR'
-            WHEN SUBSTR(CELL_ID, 16, 1) = '5' THEN 'C2'
-            WHEN SUBSTR(CELL_ID, 16, 1) = '6' THEN 'L1'
-            WHEN SUBSTR(CELL_ID, 16, 1) = 'D' THEN 'LA'
-            END) AS CELL_MODEL
-            FROM GEIS.T_CELL_ENG_GC12_{yymm}
-            WHERE LOT_NO = '{lot}'
-            AND CELL_ID LIKE 'G%'
-            """, con)])
-            v2_data = pd.concat([v2_data, pd.read_sql(f"""
-            SELECT CELL_ID, DATA_02 AS RETEST_V2, MEASURE_DATE AS V2_MEASURE_DATE,
-            EQUIP_NO AS V2_MACHINE, LINE_NO, DEFECT_REASON_CD
-            FROM GEIS.T_CELL_ENG_GC13_{yymm}
-            WHERE LOT_NO = '{lot}'
-            AND CELL_ID LIKE 'G%'
-            """, con)])
-        dv_data = pd.merge(v1_data, v2_data, on='CELL_ID', how='inner')
-        formation_data = pd.concat([formation_data, dv_data], ignore_index=True)
+    print('load retest lot')
+    v1_parts = []
+    v2_parts = []
+    queries = []
+    for yymm in yymm_list:
+        if mirror_ready('GC12', yymm, MIRROR_DIRECTORY) and mirror_ready('GC13', yymm, MIRROR_DIRECTORY):
+            v1_month, v2_month = get_mirrored_formation_data(lot, yymm)
+            v1_parts.append(v1_month)
+            v2_parts.append(v2_month)
+            continue
+        queries.append((month_tier(yymm), (f"""
+        SELECT CELL_ID, TRAY_NO, TRAY_POSITION, DATA_01 AS RETEST_V1, MOD(SUBSTR(TRAY_POSITION, 2, 2), 4) AS METER,
+        MEASURE_DATE AS V1_MEASURE_DATE, EQUIP_NO AS V1_MACHINE
+        FROM GEIS.T_CELL_ENG_GC12_{yymm}
+        WHERE LOT_NO = :lot
+        AND CELL_ID LIKE 'G%'
+        """, V1_DTYPES, {'lot': lot})))
+        queries.append((month_tier(yymm), (f"""
+        SELECT CELL_ID, TRAY_NO AS V2_TRAY_NO, DATA_02 AS RETEST_V2, MEASURE_DATE AS V2_MEASURE_DATE,
+        EQUIP_NO AS V2_MACHINE, LINE_NO, DEFECT_REASON_CD
+        FROM GEIS.T_CELL_ENG_GC13_{yymm}
+        WHERE LOT_NO = :lot
+        AND CELL_ID LIKE 'G%'
+        """, V2_DTYPES, {'lot': lot})))
+    results = run_queries(partial(pool_stream_query, db=db), queries)
+    v1_parts += results[0::2]
+    v2_parts += results[1::2]
+    # months are joined once, not re-copied on every loop iteration
+    v1_data = pd.concat(v1_parts, ignore_index=True)
+    v2_data = pd.concat(v2_parts, ignore_index=True)
+    # completeness: tray counts between v1 and v2
+    v1_tray_count, v2_tray_count = v1_data.TRAY_NO.nunique(), v2_data.V2_TRAY_NO.nunique()
+    print(v1_tray_count, v2_tray_count)
+    retest_complete = abs(v1_tray_count - v2_tray_count) <= 1 and v1_tray_count > 0
+    cell_ids = v2_data[['CELL_ID']].reset_index(drop=True)
+    v2_data = v2_data.drop(columns='V2_TRAY_NO')
+    v1_data['CELL_MODEL'] = decode_model(v1_data.CELL_ID)
+    formation_data = pd.merge(v1_data, v2_data, on='CELL_ID', how='inner')
     formation_data = formation_data.sort_values(by='V2_MEASURE_DATE', ascending=False, ignore_index=True)
     formation_data = formation_data.drop_duplicates(subset='CELL_ID')
-    return formation_data
+    return retest_complete, cell_ids, formation_data
 
 
-def get_cell_ids(lot: str, db: dict, cold_db: bool, yymm_list: list[str]) -> pd.DataFrame():
+def get_mirrored_formation_data(lot: str, yymm: str) -> (pd.DataFrame(), pd.DataFrame()):
     """
-    Input: lot number, database credentials, cold database boolean, and table month list
-    Function: queries V2 tables for cell IDs in retest lot
-    Output: dataframe of cell IDs in the given retest lot
-            index: [Default]
-            columns: [CELL_ID]
+    Input: lot number and table month
+    Function: reads retest V1 & V2 formation data from the local formation mirror
+    Output: V1 and V2 retest formation data, same columns as the database queries in load_retest_lot
     """
-    print('get cell ids')
-    user = db['mes_user']
-    pw = db['mes_pw']
-    dsn = db['mes_dsn']
-    if cold_db:
-        user = db['cold_user']
-        pw = db['cold_pw']
-        dsn = db['cold_dsn']
-    v2_tables = ' UNION ALL '.join([f'(SELECT CELL_ID, LOT_NO FROM GEIS.T_CELL_ENG_GC13_{yymm})' for yymm in yymm_list])
-    with cx_Oracle.connect(user=user, password=pw, dsn=dsn) as con:
-        ids = pd.read_sql(f"""
-        SELECT CELL_ID
-        FROM ({v2_tables})
-        WHERE LOT_NO = '{lot}' AND CELL_ID LIKE 'G%'
-        """, con)
-    return ids
-
-
-def check_assembly_date(cell_list: pd.DataFrame()) -> (list, bool):
+    v1_data = read_mirror('GC12', [yymm], MIRROR_DIRECTORY,
+                          columns=['CELL_ID', 'TRAY_NO', 'TRAY_POSITION', 'DATA_01', 'MEASURE_DATE', 'EQUIP_NO'],
+                          filters=[('LOT_NO', '=', lot)])
+    v1_data = v1_data[v1_data.CELL_ID.str.startswith('G')]
+    v1_data = v1_data.rename(columns={'DATA_01': 'RETEST_V1', 'MEASURE_DATE': 'V1_MEASURE_DATE',
+                                      'EQUIP_NO': 'V1_MACHINE'})
+    v1_data.insert(4, 'METER', v1_data.TRAY_POSITION.str[1:3].astype(int) % 4)
+    v2_data = read_mirror('GC13', [yymm], MIRROR_DIRECTORY,
+                          columns=['CELL_ID', 'TRAY_NO', 'DATA_02', 'MEASURE_DATE', 'EQUIP_NO', 'LINE_NO',
+                                   'DEFECT_REASON_CD'],
+                          filters=[('LOT_NO', '=', lot)])
+    v2_data = v2_data[v2_data.CELL_ID.str.startswith('G')]
+    v2_data = v2_data.rename(columns={'TRAY_NO': 'V2_TRAY_NO', 'DATA_02': 'RETEST_V2',
+                                      'MEASURE_DATE': 'V2_MEASURE_DATE',
+                                      'EQUIP_NO': 'V2_MACHINE'})
+    return v1_data, v2_data
+
+
+def check_assembly_date(cell_list: pd.DataFrame()) -> list:
     """
     Input: cell list for a given retest lot
     Function: determine assembly year & month from cell ID characters
-    Output: list of assembly dates and boolean indicator if cold db is required
+    Output: list of assembly dates
     """
     print('check assembly date')
-    cell_list['yymm'] = cell_list.apply(lambda x: cell_id_dict[x.CELL_ID[4]] + cell_id_dict[x.CELL_ID[5]], axis=1)
-    month_check_list = []
-    for date in cell_list.yymm.unique():
-        # condition checks return True if assembly date is older than 12 months, False otherwise
-        con1 = date[:2] == str(datetime.now().year)[-2:]
-        con2 = (int(date[:2]) == int(str(datetime.now().year)[-2:]) - 1) and (int(date[-2:]) > datetime.now().month)
-        month_check_list.append(not(con1 or con2))
-    return cell_list.yymm.unique(), any(month_check_list)
-
-
-def cold_pool(query: str) -> pd.DataFrame():
-    return pd.read_sql(query, cx_Oracle.SessionPool(
-        'kwang', 'XV7A6GneRC2a', '10.133.200.174:1521/colddb.america.gds.panasonic.com', 1, 12, 1).acquire())
+    cell_list['yymm'] = decode_yymm(cell_list.CELL_ID)
+    return cell_list.yymm.dropna().unique()
 
 
-def mes_pool(query: str) -> pd.DataFrame():
-    return pd.read_sql(query, cx_Oracle.SessionPool(
-        'PENAENG', 'p6bru@aXE=am', '10.133.200.175/GEISDB.WORLD', 1, 12, 1).acquire())
-
-
-def get_initial_cell_data(lot: str, month_list: list, cold_db: bool, cell_list: pd.DataFrame()) -> pd.DataFrame():
+def get_initial_cell_data(lot: str, month_list: list, cell_list: pd.DataFrame()) -> pd.DataFrame():
     """
-    Input: lot number, assembly month list, cold database boolean, and retest lot cell list
+    Input: lot number, assembly month list, and retest lot cell list
     Function: Queries database for initial measure date
     Output: Retest cell IDs and their initial measure date
             index: [Default]
@@ -223,68 +173,38 @@ def get_initial_cell_data(lot: str, month_list: list, cold_db: bool, cell_list:
     """
     print('get initial cell data')
     print('cell list - unique/total', len(cell_list.CELL_ID.unique()), len(cell_list))
-    mes_queries = []
-    cold_queries = []
-    mes_data = pd.DataFrame()
-    cold_data = pd.DataFrame()
+    queries = []
+    mm_ref = get_mm_ref()
     month_list = [_ for _ in month_list if _ in mm_ref]
     for yymm in month_list:
-        usable_cells = cell_list[cell_list.yymm == yymm]
-        cell_tuples = [tuple(usable_cells.CELL_ID[i * 999:(i + 1) * 999]) for i in
-                       range(((len(usable_cells) // 999) + 1))]
-        mes_db = datetime(int('20' + yymm[0:2]), int(yymm[2:4]), 1) > (datetime.now() - relativedelta(months=11))
+        usable_cells = list(cell_list[cell_list.yymm == yymm].CELL_ID)
         for month in [yymm, mm_ref[min(mm_ref.index(yymm) + 1, len(mm_ref)-1)]]:
-            for cell_tuple in cell_tuples:
-                if len(cell_tuple) == 1:
-                    cell_tuple = f"('{cell_tuple[0]}')"
-                if mes_db:
-                    mes_queries.append(f"""
-                    SELECT CELL_ID, LOT_NO, (CASE
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 1 THEN (DATA_03 - DATA_08)*1000
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 2 THEN (DATA_03 - DATA_16)*1000
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 3 THEN (DATA_03 - DATA_24)*1000
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 0 THEN (DATA_03 - DATA_32)*1000
-                    ELSE NULL END) AS NORM_DV
-                    FROM GEIS.T_CELL_ENG_GC13_{month}
-                    WHERE CELL_ID IN {cell_tuple}
-                    """)
-                else:
-                    cold_queries.append(f"""
-                    SELECT CELL_ID, LOT_NO, (CASE
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 1 THEN (DATA_03 - DATA_08)*1000
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 2 THEN (DATA_03 - DATA_16)*1000
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 3 THEN (DATA_03 - DATA_24)*1000
-                    WHEN MOD(SUBSTR(TRAY_POSITION,2,2),4) = 0 THEN (DATA_03 - DATA_32)*1000
-                    ELSE NULL END) AS NORM_DV
-                    FROM GEIS.T_CELL_ENG_GC13_{month}
-                    WHERE CELL_ID IN {cell_tuple}
-                    """)
-    print('starting mes pools', len(mes_queries), datetime.now())
-    if len(mes_queries) != 0:
-        pool1 = mp.Pool(processes=12)
-        mes_data = pool1.map(mes_pool, mes_queries)
-        pool1.close()
-        pool1.join()
-        mes_data = pd.concat(mes_data, axis=0)
-    print('starting cold pools', len(cold_queries), datetime.now())
-    if len(cold_queries) != 0:
-        pool2 = mp.Pool(processes=12)
-        cold_data = pd.DataFrame()
-        for query in tqdm.tqdm(pool2.map(cold_pool, cold_queries), total=len(cold_queries)):
-            cold_data = pd.concat([cold_data, query])
-        print(cold_data)
-        pool2.close()
-        pool2.join()
-        print('complete cold pools', len(cold_queries), datetime.now())
-    data = pd.concat([mes_data, cold_data], ignore_index=True)
-    data = data[data.apply(lambda x: x.LOT_NO[6:8] != 'HZ', axis=1)]
+            # cell IDs are bound as one collection per query, see bulk_lookup
+            query = f"""
+            SELECT t.CELL_ID, t.LOT_NO, (CASE
+            WHEN MOD(SUBSTR(t.TRAY_POSITION,2,2),4) = 1 THEN (t.DATA_03 - t.DATA_08)*1000
+            WHEN MOD(SUBSTR(t.TRAY_POSITION,2,2),4) = 2 THEN (t.DATA_03 - t.DATA_16)*1000
+            WHEN MOD(SUBSTR(t.TRAY_POSITION,2,2),4) = 3 THEN (t.DATA_03 - t.DATA_24)*1000
+            WHEN MOD(SUBSTR(t.TRAY_POSITION,2,2),4) = 0 THEN (t.DATA_03 - t.DATA_32)*1000
+            ELSE NULL END) AS NORM_DV
+            FROM GEIS.T_CELL_ENG_GC13_{month} t
+            {CELL_ID_JOIN}
+            """
+            queries.append((month_tier(month), (query, usable_cells)))
+    print('starting queries', {tier: [q[0] for q in queries].count(tier) for tier in ['mes', 'cold']}, datetime.now())
+    results = run_queries(partial(pool_cell_query, db=get_db_info()), queries)
+    print('complete queries', len(queries), datetime.now())
+    if len(results) == 0:
+        return pd.DataFrame(columns=['CELL_ID', 'NORM_DV'])
+    data = pd.concat(results, ignore_index=True)
+    data = data[data.LOT_NO.str[6:8] != 'HZ']
     data = data[['CELL_ID', 'NORM_DV']]
     return data
 
 
-def compile_data(lot: str, db: dict, cold_db: bool, cell_data: pd.DataFrame()) -> pd.DataFrame():
+def compile_data(lot: str, db: dict, cell_data: pd.DataFrame()) -> pd.DataFrame():
     """
-    Input: retest lot cell list, lot number, cold_db boolean indicator, and queried cell data
+    Input: lot number, database credentials, and queried cell data
     Function: Calculate cell sitting time, assign voltage cutoff, assign dV cutoff, calculate meter offsets,
               calculate adjusted dV values, assign process NG codes, get impingement cells, and merge all data
     Output: Retest cell data
@@ -298,41 +218,35 @@ def compile_data(lot: str, db: dict, cold_db: bool, cell_data: pd.DataFrame()) -
     print('compile data')
     cell_data = cell_data.astype({'V1_MEASURE_DATE': 'datetime64[ns]',
                                   'V2_MEASURE_DATE': 'datetime64[ns]'})
+    dq_curves = get_dq_curves()
     cell_data['NORM_DV'] = cell_data.NORM_DV.fillna(-999.99)
     cell_data['VOLTAGE_CUTOFF'] = volt_spec
-    cell_data['INITIAL_MEASURE_DATE'] = cell_data.apply(lambda x: datetime(int('20' + cell_id_dict[x.CELL_ID[4]]),
-                                                                           int(cell_id_dict[x.CELL_ID[5]]),
-                                                                           int(cell_id_dict[x.CELL_ID[6]])), axis=1)
+    cell_data['INITIAL_MEASURE_DATE'] = decode_assembly_date(cell_data.CELL_ID)
     cell_data['SITTING_TIME'] = (cell_data.V1_MEASURE_DATE - cell_data.INITIAL_MEASURE_DATE).dt.total_seconds() / 86400
     cell_data['DV_CUTOFF'] = dv_coefficient * (1 / cell_data.SITTING_TIME) + dv_offset
-    offsets = getOffsets(cell_data)
+    with span('getOffsets'):
+        offsets = getOffsets(cell_data)
     cell_data = cell_data.merge(offsets, on=['V1_MACHINE', 'V2_MACHINE', 'METER'])
     cell_data['DT'] = (cell_data.V2_MEASURE_DATE - cell_data.V1_MEASURE_DATE) / pd.Timedelta(days=1)
     cell_data['DVDT'] = (cell_data.RETEST_V2 - cell_data.RETEST_V1 + cell_data.OFFSET) / cell_data.DT
 
-    cell_data['DEFECT_CODE'] = cell_data.apply(lambda x: '900W' if (x.DVDT > 0.00005 or x.DVDT < x.DV_CUTOFF
-                                                                    or x.CELL_MODEL != model_number
-                                                                    or x.SITTING_TIME == 0)
-                                               else '400V' if x.RETEST_V1 < x.VOLTAGE_CUTOFF
-                                               else '500W' if x.RETEST_V2 < x.VOLTAGE_CUTOFF
-                                               else 'N000', axis=1)
-    cell_data['PROCESS_NG'] = cell_data.apply(lambda x: x.DEFECT_CODE in ['900W', '400V', '500W'], axis=1)
-    # dQ Model
-    cell_data['DQDV'] = np.interp(x=cell_data.RETEST_V2, xp=dq_ref.Voltage, fp=dq_ref.dQdV, left=1e-9, right=1e-9)
+    spec = {'volt_spec': volt_spec, 'ndv_spec': ndv_spec, 'rshort_spec': rshort_spec, 'model_number': model_number,
+            'dq_models': dq_curves['MODELS']}
+    cell_data['DEFECT_CODE'] = judge(cell_data, DEFECT_RULES, spec)
+    cell_data['PROCESS_NG'] = cell_data.DEFECT_CODE.isin(PROCESS_NG_CODES)
+    # dQ Model - every cell is looked up on its own model's curve
+    cell_data['DQDV'] = lookup_dqdv(dq_curves, cell_data.CELL_MODEL, cell_data.RETEST_V2)
     cell_data['R_SHORT'] = (24000 * cell_data.RETEST_V2) / (-cell_data.DVDT * cell_data.DQDV)
-    cell_data['DQ_CODE'] = cell_data.apply(lambda x: '900Z' if (x.RETEST_V1 < volt_spec) | (x.RETEST_V2 < volt_spec)
-                                           else '900Y' if x.NORM_DV < ndv_spec
-                                           else '900X' if x.CELL_MODEL != model_number
-                                           else '900W' if x.R_SHORT < rshort_spec or x.DVDT > 0.00005
-                                           else 'N000', axis=1)
-    cell_data['DQ_NG'] = cell_data.apply(lambda x: x.DQ_CODE in ['900W', '900Y', '900X', '900U', '900Z'], axis=1)
-    impingement_cells = get_impingement_cells(db_info, cell_data[['CELL_ID']])
+    cell_data['DQ_CODE'] = judge(cell_data, DQ_RULES, spec)
+    cell_data['DQ_NG'] = cell_data.DQ_CODE.isin(DQ_NG_CODES)
+    with span('get_impingement_cells'):
+        impingement_cells = get_impingement_cells(db, cell_data[['CELL_ID']])
     impingement_cells['IMPINGEMENT_NG'] = True
     cell_data = cell_data.merge(impingement_cells, on='CELL_ID', how='left')
     return cell_data
 
 
-def generate_pchart(data: pd.DataFrame()):
+def generate_pchart(lot_number: str, data: pd.DataFrame(), start_time: datetime):
     summary = pd.DataFrame(data={
         'Missing Cell Data': len(data[data.SITTING_TIME == 0]),
         'Cell Age Min': data[data.SITTING_TIME > 0].SITTING_TIME.min(),
@@ -348,10 +262,7 @@ def generate_pchart(data: pd.DataFrame()):
         'dQ Model Yield': 100 * len(data[~data.DQ_NG]) / len(data)},
         index=[lot_number])
     summary.index.name = 'Lot'
-    if os.path.exists(rf'{DIRECTORY}\dq_summary.csv'):
-        summary = pd.concat([pd.read_csv(rf'{DIRECTORY}\dq_summary.csv', index_col='Lot'), summary])
-        summary = summary[~summary.index.duplicated(keep='last')]
-    summary.to_csv(rf'{DIRECTORY}\dq_summary.csv')
+    upsert_lot(SUMMARY_STORE, 'DQ_SUMMARY', lot_number, summary.reset_index())
     # dv_pchart = pd.DataFrame(data={
     #     'V1_LOT_NO': lot_number,
     #     'V1_LOT_CLASSIFICATION': 10,
@@ -407,18 +318,30 @@ def generate_pchart(data: pd.DataFrame()):
         'OCV_JUDGMENT': 13
         })
     # dv_pchart.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_dv_pchart.csv', index=False)
-    dq_pchart.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_dq_pchart.csv', index=False)
+    upsert_lot(SUMMARY_STORE, 'DQ_PCHART', lot_number, dq_pchart)
+    export_csv(SUMMARY_STORE, 'DQ_PCHART', rf'{DIRECTORY}\{lot_number}\{lot_number}_dq_pchart.csv', [lot_number])
     print(f'Script Start Time: {start_time}')
     print(f'Script Completion Time: {datetime.now()}')
 
 
-def scan_formation_complete(user: str, pw: str, dsn: str) -> pd.DataFrame():
-    with cx_Oracle.connect(user=user, password=pw, dsn=dsn) as con:
-        lot_data = pd.read_sql(f"""
+def scan_formation_complete(db: dict, since: datetime = None) -> pd.DataFrame():
+    """
+    Input: database credentials and MEASURE_DATE to scan from (None for all lots)
+    Function: compares V1 & V2 tray counts of the HZ lots formed in the last 30 days. With a start date only lots with V2
+              measurements after it are counted
+    Output: lot formation status
+            index: [Default]
+            columns: [LOT_NO, V1_TRAY_CT, V2_TRAY_CT, LAST_MEASURE_DATE, DONE]
+    """
+    recent = 'AND LOT_NO IN (SELECT DISTINCT LOT_NO FROM GEIS.V_CELL_ENG_GC13_EN WHERE MEASURE_DATE > :since)' \
+        if since is not None else ''
+    with connection(db, 'mes') as con:
+        lot_data = read_sql(f"""
         SELECT
             t1.LOT_NO,
             t1.V1_TRAY_CT,
-            t2.V2_TRAY_CT
+            t2.V2_TRAY_CT,
+            t2.LAST_MEASURE_DATE
         FROM (
             SELECT 
                 LOT_NO,
@@ -426,55 +349,184 @@ def scan_formation_complete(user: str, pw: str, dsn: str) -> pd.DataFrame():
             FROM GEIS.V_CELL_ENG_GC12_EN
             WHERE MEASURE_DATE > SYSDATE - 30
             AND LOT_NO LIKE '%HZ%'
+            {recent}
             GROUP BY LOT_NO
         ) t1
         INNER JOIN (
             SELECT
-                LOT_NO, COUNT(UNIQUE(TRAY_NO)) AS V2_TRAY_CT
+                LOT_NO, COUNT(UNIQUE(TRAY_NO)) AS V2_TRAY_CT, MAX(MEASURE_DATE) AS LAST_MEASURE_DATE
             FROM GEIS.V_CELL_ENG_GC13_EN
             WHERE MEASURE_DATE > SYSDATE - 30
             AND LOT_NO LIKE '%HZ%'
+            {recent}
             GROUP BY LOT_NO
         ) t2
         ON t1.LOT_NO = t2.LOT_NO
-        """, con)
+        """, con, params={'since': since} if since is not None else None)
         lot_data['DONE'] = lot_data.V1_TRAY_CT - lot_data.V2_TRAY_CT <= 1
         return lot_data
 
 
+def poll_formation_complete() -> list[str]:
+    """
+    Input: None
+    Function: scans for lots with new V2 measurements since the tracker high-water mark, queues newly completed lots
+              and moves the high-water mark forward
+    Output: newly queued lots
+    """
+    watermark = get_watermark(LOT_TRACKER)
+    since = watermark - timedelta(minutes=SCAN_OVERLAP) if watermark else datetime.now() - timedelta(days=30)
+    lot_data = scan_formation_complete(get_db_info(), since)
+    queued = queue_lots(LOT_TRACKER, list(lot_data[lot_data.DONE].LOT_NO))
+    if len(lot_data) != 0:
+        set_watermark(LOT_TRACKER, pd.Timestamp(lot_data.LAST_MEASURE_DATE.max()).to_pydatetime())
+    print(f'scanned {len(lot_data)} lots since {since}, queued {queued}', datetime.now())
+    return queued
+
+
+def run_service(poll_interval: int):
+    """
+    Input: seconds between formation scans
+    Function: runs until stopped, flagging lots as soon as their retest formation completes. Queued lots and the outcome
+              of every attempt are kept in the lot tracker, so a restarted service continues where it stopped
+    Output: None
+    """
+    print(f'flagging service started, polling every {poll_interval}s', datetime.now())
+    while True:
+        try:
+            poll_formation_complete()
+            lot_list = pending_lots(LOT_TRACKER)
+            if len(lot_list) != 0:
+                report = run_batch(lot_list, BATCH_WORKERS)
+                record_results(LOT_TRACKER, report)
+        except Exception:
+            # a failed poll (e.g. database unavailable) is retried on the next cycle
+            traceback.print_exc()
+        time.sleep(poll_interval)
+
+
+def flag_lot(lot_number: str) -> dict:
+    """
+    Input: retest lot number
+    Function: flags a single retest lot and saves its Z301 list, retest data and pchart. Every stage is recorded in the
+              lot's instrumentation trace
+    Output: lot status
+            keys: [LOT_NO, STATUS, MESSAGE, CELLS, DQ_Z301, START, END]
+    """
+    start_time = datetime.now()
+    status = {'LOT_NO': lot_number, 'STATUS': 'SKIPPED', 'MESSAGE': '', 'CELLS': 0, 'DQ_Z301': 0,
+              'START': start_time, 'END': None}
+    start_trace(lot_number)
+    try:
+        flag_lot_stages(lot_number, start_time, status)
+    except Exception:
+        status['STATUS'] = 'ERROR'
+        raise
+    finally:
+        end_trace(status['STATUS'])
+    return status
+
+
+def flag_lot_stages(lot_number: str, start_time: datetime, status: dict):
+    """
+    Input: retest lot number, start time and lot status
+    Function: runs the flagging stages of a single lot, updating the lot status in place
+    Output: None
+    """
+    db_info = get_db_info()
+    if os.path.isdir(rf'{DIRECTORY}\{lot_number}'):
+        print(f'{lot_number} already ran through flagging')
+    print(lot_number, start_time)
+    if not (lot_number[6:8] == 'HZ' and len(lot_number) == 9):
+        print('log error: invalid retest lot number entered')
+        status.update(MESSAGE='invalid retest lot number entered', END=datetime.now())
+        return
+    with span('get_retest_date'):
+        f_date = get_retest_date(lot_number, db_info)
+    if len(f_date) == 0:
+        print('log error: lot has not finished retest')
+        status.update(MESSAGE='lot has not finished retest', END=datetime.now())
+        return
+    # every formation month is read from the database that holds it, see partition_router
+    with span('load_retest_lot'):
+        retest_complete, cell_ids, retest_data = load_retest_lot(lot_number, db_info, f_date)
+    if not retest_complete:
+        print('log error: formation process not complete')
+        status.update(MESSAGE='formation process not complete', END=datetime.now())
+        return
+    as_date = check_assembly_date(cell_ids)
+    with span('get_initial_cell_data'):
+        initial_cell_data = get_initial_cell_data(lot_number, as_date, cell_ids)
+    retest_data = pd.merge(retest_data, initial_cell_data, on='CELL_ID', how='left')
+    with span('compile_data'):
+        retest_data = compile_data(lot_number, db_info, retest_data)
+    print(retest_data)
+    with span('output'):
+        retest_data['IMPINGEMENT_NG'] = retest_data.IMPINGEMENT_NG.fillna(False)
+        # dv_z301 = retest_data[retest_data.PROCESS_NG | retest_data.IMPINGEMENT_NG].CELL_ID
+        dq_z301 = retest_data[retest_data.DQ_NG | retest_data.IMPINGEMENT_NG].CELL_ID
+        # data saving
+        if not os.path.isdir(rf'{DIRECTORY}\{lot_number}'):
+            os.mkdir(rf'{DIRECTORY}\{lot_number}')
+        # dv_z301.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_dv_Z301_cells.csv', index=False, header=None)
+        dq_z301.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_dq_Z301_cells.csv', index=False, header=None)
+        retest_data.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_retest_data.csv', index=False)
+        generate_pchart(lot_number, retest_data, start_time)
+    status.update(STATUS='FLAGGED', CELLS=len(retest_data), DQ_Z301=len(dq_z301), END=datetime.now())
+
+
+def run_batch(lot_list: list[str], workers: int) -> pd.DataFrame():
+    """
+    Input: retest lot numbers and number of lots to flag at the same time
+    Function: flags retest lots concurrently, a failed lot is recorded and does not stop the other lots. The lot index
+              is refreshed once for the whole batch, offsets are shared between the batch's lots through offset.py and
+              the summary csv is exported from the summary store once at the end
+    Output: batch status report (also saved to the processing directory)
+            index: [LOT_NO]
+            columns: [STATUS, MESSAGE, CELLS, DQ_Z301, START, END]
+    """
+    lot_list = list(dict.fromkeys(lot_list))
+    print(f'flagging {len(lot_list)} lots with {workers} workers', datetime.now())
+    if not os.path.exists(SUMMARY_STORE) and os.path.exists(rf'{DIRECTORY}\dq_summary.csv'):
+        import_csv(SUMMARY_STORE, 'DQ_SUMMARY', rf'{DIRECTORY}\dq_summary.csv')
+    try:
+        update_index(get_db_info(), LOT_INDEX)
+    except Exception:  # indexed months and the open month are still found, the next batch indexes the rest
+        traceback.print_exc()
+        print('log error: lot index refresh failed, continuing with the existing index')
+    report = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(flag_lot, lot): lot for lot in lot_list}
+            for future in as_completed(futures):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    status = {'LOT_NO': futures[future], 'STATUS': 'ERROR', 'MESSAGE': repr(e), 'END': datetime.now()}
+                print(f"{status['LOT_NO']}: {status['STATUS']} {status['MESSAGE']}")
+                report.append(status)
+    finally:
+        clearSharedResults()  # offsets and test lots are only shared within one batch
+    report = pd.DataFrame(report, columns=['LOT_NO', 'STATUS', 'MESSAGE', 'CELLS', 'DQ_Z301', 'START', 'END'])
+    report = report.set_index('LOT_NO').loc[lot_list]
+    stamp = datetime.now().strftime('%y%m%d_%H%M%S')
+    report.to_csv(rf"{DIRECTORY}\batch_report_{stamp}.csv")
+    export_csv(SUMMARY_STORE, 'DQ_SUMMARY', rf'{DIRECTORY}\dq_summary.csv')
+    write_run_report(rf"{DIRECTORY}\run_report_{stamp}.json")
+    print(offsetCacheStats())
+    print(report)
+    return report
+
+
 if __name__ == '__main__':
     pd.set_option('display.width', 200, 'display.max_columns', 10)
-    config = configparser.ConfigParser()
-    config.read(r'C:\Users\KW38770\Documents\WangK\Scripts\gitlab\db_cfg.ini')
-    # you will have to input your own db access info
-    db_info = {'mes_user': config['MES_DB']['user'],
-               'mes_pw': config['MES_DB']['password'],
-               'mes_dsn': config['MES_DB']['dsn'],
-               'cold_user': config['COLD_DB']['user'],
-               'cold_pw': config['COLD_DB']['password'],
-               'cold_dsn': config['COLD_DB']['dsn']
-               }
-    cell_id_dict = {'1': '01', '2': '02', '3': '03', '4': '04', '5': '05', '6': '06', '7': '07', '8': '08', '9': '09',
-                    'A': '10', 'B': '11', 'C': '12', 'D': '13', 'E': '14', 'F': '15', 'G': '16', 'H': '17', 'J': '18',
-                    'K': '19', 'L': '20', 'M': '21', 'N': '22', 'P': '23', 'Q': '24', 'R': '25', 'S': '26', 'T': '27',
-                    'U': '28', 'V': '29', 'W': '30', 'X': '31', 'Y': '32', 'Z': '33'}
-    db_mon = 12*(datetime.now().year - datetime(2020, 8, 1).year) + (datetime.now().month - datetime(2020, 8, 1).month)
-    mm_ref = [(datetime(2020, 8, 1) + relativedelta(months=x)).strftime('%y%m') for x in range(db_mon)]
-    volt_spec = 2.5
-    ndv_spec = -0.5
-    rshort_spec = 89e3
-    dv_offset = -0.00009763
-    dv_coefficient = -0.00303104
-    dq_ref = pd.read_csv(rf'C:\Users\KW38770\Documents\WangK\Formation\Retest\21L dqdv\dq_curve.csv')
-    DIRECTORY = r'C:\Users\KW38770\Documents\WangK\Formation\Retest\Processing_v3'
-    model_number = 'L1'
-    results = []
     # test
-    # valid_lots = scan_formation_complete(db_info['mes_user'], db_info['mes_pw'], db_info['mes_dsn'])
+    # valid_lots = scan_formation_complete(db_info)
     # print(valid_lots)
     # exit()
     # end test
-    for lot_number in [
+    lot_list = [
         # '220806HZ1',
         '211106HZ1',
         # '211108HZ1', issue w/ Z data - they will rerun through retest
@@ -496,39 +548,8 @@ if __name__ == '__main__':
         # '220104HZ1', flagged, pchart uploaded - all extractions needed
         # '210211HZ2',  # can't create offset
 
-        ]:
-        if os.path.isdir(rf'{DIRECTORY}\{lot_number}'):
-            print(f'{lot_number} already ran through flagging')
-            # exit()
-        start_time = datetime.now()
-        print(lot_number, start_time)
-        if not (lot_number[6:8] == 'HZ' and len(lot_number) == 9):
-            print('log error: invalid retest lot number entered')
-            exit()
-        f_date = get_retest_date(lot_number, db_info)
-        if len(f_date) == 0:
-            print('log error: lot has not finished retest')
-            exit()
-        # check if formation data is older than 12 months -> cold db required
-        f_cold_db = any(date not in
-                        [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(12)] for date in f_date)
-        if not check_retest_complete(lot_number, db_info, f_cold_db, f_date):
-            print('log error: formation process not complete')
-            exit()
-        retest_data = get_retest_formation_data(lot_number, db_info, f_cold_db, f_date)
-        cell_ids = get_cell_ids(lot_number, db_info, f_cold_db, f_date)
-        as_date, as_cold_db = check_assembly_date(cell_ids)
-        initial_cell_data = get_initial_cell_data(lot_number, as_date, as_cold_db, cell_ids)
-        retest_data = pd.merge(retest_data, initial_cell_data, on='CELL_ID', how='left')
-        retest_data = compile_data(lot_number, db_info, as_cold_db, retest_data)
-        print(retest_data)
-        retest_data['IMPINGEMENT_NG'] = retest_data.IMPINGEMENT_NG.fillna(False)
-        # dv_z301 = retest_data[retest_data.PROCESS_NG | retest_data.IMPINGEMENT_NG].CELL_ID
-        dq_z301 = retest_data[retest_data.DQ_NG | retest_data.IMPINGEMENT_NG].CELL_ID
-        # data saving
-        if not os.path.isdir(rf'{DIRECTORY}\{lot_number}'):
-            os.mkdir(rf'{DIRECTORY}\{lot_number}')
-        # dv_z301.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_dv_Z301_cells.csv', index=False, header=None)
-        dq_z301.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_dq_Z301_cells.csv', index=False, header=None)
-        retest_data.to_csv(rf'{DIRECTORY}\{lot_number}\{lot_number}_retest_data.csv', index=False)
-        generate_pchart(retest_data)
+        ]
+    if '--service' in sys.argv:
+        run_service(SERVICE_POLL)
+    else:
+        run_batch(lot_list, BATCH_WORKERS)
@@ -0,0 +1,134 @@
+"""
+Flagging Benchmark
+This program runs the full Flagging_v2.0 pipeline for a list of lots against recorded database results and reports the
+wall time, queries and rows of every pipeline stage, so changes to the pipeline can be compared without the databases.
+
+Usage:
+python benchmark.py record 211106HZ1 [more lots]              runs against the databases and records every query
+python benchmark.py replay 211106HZ1 --runs 3 --latency 1.0    replays the recorded queries (latency 1.0 = recorded
+                                                               query time, 0 = instant)
+
+Notes:
+Every run starts from empty local stores (lot index, formation mirror, offset and assembly caches, summary store) in
+its own work directory, so the recording and the replays issue the same queries. Replay in the month the fixtures were
+recorded, queries built from the current date differ in a later month (see db_replay).
+update_index runs once per run before the lots and is reported as its own stage.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import time
+import shutil
+import argparse
+import traceback
+import importlib.util
+import pandas as pd
+from datetime import datetime
+
+import offset
+import impingement
+from retest_flagging import config, db_replay
+from retest_flagging.instrumentation import write_run_report
+
+BENCH_DIRECTORY = rf'{config.DIRECTORY}\benchmark'
+FIXTURE_DIRECTORY = rf'{BENCH_DIRECTORY}\fixtures'
+FLAGGING_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Flagging_v2.0.py')
+
+
+def load_flagging(work_directory: str):
+    """
+    Input: work directory of the run
+    Function: loads Flagging_v2.0.py as a module with every local store placed in the work directory
+    Output: flagging module
+    """
+    spec = importlib.util.spec_from_file_location('flagging', FLAGGING_SCRIPT)
+    flagging = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(flagging)
+    flagging.DIRECTORY = work_directory
+    flagging.LOT_INDEX = rf'{work_directory}\lot_index.db'
+    flagging.MIRROR_DIRECTORY = rf'{work_directory}\formation_mirror'
+    flagging.SUMMARY_STORE = rf'{work_directory}\summary.db'
+    flagging.LOT_TRACKER = rf'{work_directory}\lot_tracker.db'
+    # offset.py and impingement.py read their stores from config, point them at the work directory and forget offsets of earlier runs
+    offset.MIRROR_DIRECTORY = rf'{work_directory}\formation_mirror'
+    offset.OFFSET_CACHE = rf'{work_directory}\offset_cache.db'
+    impingement.ASSEMBLY_CACHE = rf'{work_directory}\assembly_cache.db'
+    offset.clearSharedResults()
+    return flagging
+
+
+def run_once(lot_list: list[str], run: int) -> pd.DataFrame():
+    """
+    Input: lot numbers and run number
+    Function: flags the lots one after another from empty local stores and collects their stage timings
+    Output: stage timings of the run
+            index: [Default]
+            columns: [RUN, LOT_NO, STATUS, STAGE, CALLS, WALL_TIME, QUERIES, ROWS, MIRROR_READS, MIRROR_ROWS, PEAK_MB]
+    """
+    work_directory = rf'{BENCH_DIRECTORY}\run_{run}'
+    if os.path.isdir(work_directory):
+        shutil.rmtree(work_directory)
+    os.makedirs(work_directory)
+    flagging = load_flagging(work_directory)
+    start = time.perf_counter()
+    flagging.update_index(config.get_db_info(), flagging.LOT_INDEX)
+    rows = [{'RUN': run, 'LOT_NO': None, 'STATUS': None, 'STAGE': 'update_index', 'CALLS': 1,
+             'WALL_TIME': round(time.perf_counter() - start, 3)}]
+    for lot in lot_list:
+        try:
+            flagging.flag_lot(lot)
+        except Exception:  # e.g. a query missing from the fixtures, the lot's trace is kept with status ERROR
+            traceback.print_exc()
+    for trace in write_run_report(rf'{work_directory}\run_report.json'):
+        rows.append({'RUN': run, 'LOT_NO': trace['LOT_NO'], 'STATUS': trace['STATUS'], 'STAGE': 'total',
+                     'CALLS': 1, 'WALL_TIME': trace['WALL_TIME']})
+        rows += [{'RUN': run, 'LOT_NO': trace['LOT_NO'], 'STATUS': trace['STATUS'], 'STAGE': stage, **record}
+                 for stage, record in trace['STAGES'].items()]
+    return pd.DataFrame(rows)
+
+
+def summarize(timings: pd.DataFrame()) -> pd.DataFrame():
+    """
+    Input: stage timings of every run
+    Function: summarizes the wall time of every stage over the runs (all lots of a run added up)
+    Output: stage summary
+            index: [STAGE]
+            columns: [CALLS, QUERIES, ROWS, MEDIAN, MIN, MAX]
+    """
+    per_run = timings.groupby(['STAGE', 'RUN'], sort=False)[['CALLS', 'WALL_TIME', 'QUERIES', 'ROWS']].sum()
+    summary = per_run.groupby('STAGE', sort=False).agg(CALLS=('CALLS', 'max'), QUERIES=('QUERIES', 'max'),
+                                                        ROWS=('ROWS', 'max'), MEDIAN=('WALL_TIME', 'median'),
+                                                        MIN=('WALL_TIME', 'min'), MAX=('WALL_TIME', 'max'))
+    return summary
+
+
+def run_benchmark(lot_list: list[str], mode: str, runs: int, latency: float) -> pd.DataFrame():
+    """
+    Input: lot numbers, 'record' or 'replay', number of runs and replay latency
+    Function: records the queries of one run or replays them several times and reports the per-stage timings
+    Output: stage summary (also saved to the benchmark directory with the raw timings)
+    """
+    db_replay.set_mode(mode, FIXTURE_DIRECTORY, latency)
+    if mode == 'record':
+        runs = 1
+    timings = pd.concat([run_once(lot_list, run) for run in range(runs)], ignore_index=True)
+    summary = summarize(timings)
+    stamp = datetime.now().strftime('%y%m%d_%H%M%S')
+    timings.to_csv(rf'{BENCH_DIRECTORY}\benchmark_{mode}_{stamp}_runs.csv', index=False)
+    summary.to_csv(rf'{BENCH_DIRECTORY}\benchmark_{mode}_{stamp}.csv')
+    print(f'{mode}: {len(lot_list)} lots, {runs} runs, latency {latency}')
+    print(summary)
+    return summary
+
+
+if __name__ == '__main__':
+    pd.set_option('display.width', 200, 'display.max_columns', 10)
+    parser = argparse.ArgumentParser(description='benchmark the flagging pipeline against recorded queries')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('lots', nargs='+')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    run_benchmark(args.lots, args.mode, args.runs, args.latency)
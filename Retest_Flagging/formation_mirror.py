@@ -0,0 +1,239 @@
+"""
+Formation Mirror Module
+This program keeps a local Parquet copy of the monthly GEIS.T_CELL_ENG_GC12_{yymm}/GC13_{yymm} formation tables,
+partitioned by table month and lot. Months are synced incrementally on MEASURE_DATE and frozen once the month is closed,
+after which they are never read from MES or the cold database again. Before a month is frozen its row count per LOT_NO
+is reconciled with the database, lots inserted late with an older MEASURE_DATE are re-pulled.
+
+Notes:
+Only the columns listed in MIRROR_COLUMNS are mirrored. Readers should only use months reported by mirror_ready(), open
+months may be missing recent measurements.
+Run this file directly (e.g. from a scheduled task) to sync the mirror.
+
+Version Updates:
+v1.0 - Initial release
+v1.1 - Closed months reconciled per lot before they are frozen, sync watermark bound as a query parameter
+"""
+
+import os
+import json
+import threading
+import pandas as pd
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from retest_flagging.db_pool import connection, read_sql
+from retest_flagging.instrumentation import record_query
+from retest_flagging.partition_router import month_tier
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # mirror is optional, readers fall back to the database
+    pa = None
+
+MIRROR_COLUMNS = {'GC12': ['CELL_ID', 'LOT_NO', 'TRAY_NO', 'TRAY_POSITION', 'EQUIP_NO', 'LINE_NO', 'MEASURE_DATE',
+                           'DATA_01'],
+                  'GC13': ['CELL_ID', 'LOT_NO', 'TRAY_NO', 'TRAY_POSITION', 'EQUIP_NO', 'LINE_NO', 'MEASURE_DATE',
+                           'DEFECT_REASON_CD', 'DATA_02', 'DATA_03', 'DATA_08', 'DATA_16', 'DATA_24', 'DATA_32']}
+SYNC_MONTHS = 24
+CHUNK_SIZE = 200000
+HIVE_NULL = '__HIVE_DEFAULT_PARTITION__'  # partition directory of rows without a LOT_NO
+_manifest_lock = threading.Lock()
+
+
+def read_manifest(root: str) -> dict:
+    """
+    Input: mirror directory
+    Function: reads the sync state of every mirrored table
+    Output: {'GC12_2210': {'synced_to': 'YYYY-MM-DD HH:MM:SS', 'frozen': bool}, ...}
+    """
+    path = os.path.join(root, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(root: str, table: str, state: dict):
+    """
+    Input: mirror directory, table key (e.g. GC12_2210) and its sync state
+    Function: updates the sync state of one mirrored table
+    Output: None
+    """
+    with _manifest_lock:
+        manifest = read_manifest(root)
+        manifest[table] = state
+        tmp_path = os.path.join(root, 'manifest.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(root, 'manifest.json'))
+
+
+def mirror_ready(process: str, yymm: str, root: str) -> bool:
+    """
+    Input: formation process (GC12 or GC13), table month and mirror directory
+    Function: checks if a monthly table is completely mirrored
+    Output: boolean indicator if the table can be read from the mirror
+    """
+    return pa is not None and read_manifest(root).get(f'{process}_{yymm}', {}).get('frozen', False)
+
+
+def sync_month(db: dict, process: str, yymm: str, root: str):
+    """
+    Input: database credentials, formation process (GC12 or GC13), table month and mirror directory
+    Function: appends measurements newer than the table's sync watermark and freezes closed months
+    Output: None
+    """
+    table = f'{process}_{yymm}'
+    state = read_manifest(root).get(table, {'synced_to': None, 'frozen': False})
+    if state['frozen']:
+        return
+    if state.get('pending'):
+        remove_pending(process, yymm, root, state['pending'])
+    sync_start = datetime.now()
+    stamp = sync_start.strftime('%y%m%d%H%M%S')
+    write_manifest(root, table, {**state, 'pending': stamp})
+    where, params = ('WHERE MEASURE_DATE > :synced_to',
+                     {'synced_to': datetime.strptime(state['synced_to'], '%Y-%m-%d %H:%M:%S')}) \
+        if state['synced_to'] else ('', None)
+    print(f'syncing {table} from {state["synced_to"]}', sync_start)
+    synced_to = state['synced_to']
+    row_count = 0
+    with connection(db, month_tier(yymm)) as con:
+        for i, chunk in enumerate(pd.read_sql(f"""
+        SELECT {', '.join(MIRROR_COLUMNS[process])}
+        FROM GEIS.T_CELL_ENG_{process}_{yymm}
+        {where}
+        """, con, params=params, chunksize=CHUNK_SIZE)):
+            if len(chunk) == 0:
+                continue
+            write_chunk(chunk, process, yymm, root, f'part-{stamp}-{i}')
+            synced_to = max(synced_to or '', chunk.MEASURE_DATE.max().strftime('%Y-%m-%d %H:%M:%S'))
+            row_count += len(chunk)
+        # a month is complete once it has been synced after the month ended and every lot matches the database
+        closed = yymm < sync_start.strftime('%y%m')
+        if closed:
+            row_count += reconcile_month(con, process, yymm, root, stamp)
+    write_manifest(root, table, {'synced_to': synced_to, 'frozen': closed})
+    print(f'synced {table}: {row_count} rows, frozen={closed}', datetime.now())
+
+
+def write_chunk(chunk: pd.DataFrame(), process: str, yymm: str, root: str, prefix: str):
+    """
+    Input: formation rows, formation process (GC12 or GC13), table month, mirror directory and file name prefix
+    Function: appends the rows to the month's lot partitions
+    Output: None
+    """
+    chunk['YYMM'] = yymm
+    # one partition per lot, a chunk can hold more lots than the pyarrow default of 1024
+    ds.write_dataset(pa.Table.from_pandas(chunk, preserve_index=False),
+                     os.path.join(root, process),
+                     format='parquet',
+                     partitioning=['YYMM', 'LOT_NO'],
+                     partitioning_flavor='hive',
+                     basename_template=f'{prefix}-{{i}}.parquet',
+                     max_partitions=max(1024, chunk.LOT_NO.nunique(dropna=False)),
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def reconcile_month(con, process: str, yymm: str, root: str, stamp: str) -> int:
+    """
+    Input: database connection, formation process (GC12 or GC13), table month, mirror directory and sync stamp
+    Function: compares the row count of every LOT_NO in the database table with the mirror and re-pulls the lots that
+              differ (e.g. rows inserted after the sync watermark passed their MEASURE_DATE)
+    Output: number of re-pulled rows
+    """
+    db_counts = read_sql(f"""
+    SELECT NVL(LOT_NO, '{HIVE_NULL}') AS LOT_NO, COUNT(*) AS ROW_COUNT
+    FROM GEIS.T_CELL_ENG_{process}_{yymm}
+    GROUP BY LOT_NO
+    """, con).set_index('LOT_NO').ROW_COUNT
+    # mirrored row counts are read from the parquet footers of every lot partition
+    path = os.path.join(root, process, f'YYMM={yymm}')
+    lot_dirs = os.listdir(path) if os.path.isdir(path) else []
+    mirror_counts = {}
+    for lot_dir in lot_dirs:
+        files = os.listdir(os.path.join(path, lot_dir))
+        mirror_counts[lot_dir[len('LOT_NO='):]] = sum(pq.read_metadata(os.path.join(path, lot_dir, file)).num_rows
+                                                      for file in files)
+    mirror_counts = pd.Series(mirror_counts, dtype='int64')
+    counts = pd.concat([db_counts.rename('DB'), mirror_counts.rename('MIRROR')], axis=1).fillna(0)
+    lot_list = list(counts[counts.DB != counts.MIRROR].index)
+    row_count = 0
+    for j, lot in enumerate(lot_list):
+        lot_dir = os.path.join(path, f'LOT_NO={lot}')
+        if os.path.isdir(lot_dir):
+            for file in os.listdir(lot_dir):
+                os.remove(os.path.join(lot_dir, file))
+        where, params = ('WHERE LOT_NO IS NULL', None) if lot == HIVE_NULL else ('WHERE LOT_NO = :lot', {'lot': lot})
+        lot_data = read_sql(f"""
+        SELECT {', '.join(MIRROR_COLUMNS[process])}
+        FROM GEIS.T_CELL_ENG_{process}_{yymm}
+        {where}
+        """, con, params=params)
+        if len(lot_data) > 0:
+            write_chunk(lot_data, process, yymm, root, f'part-{stamp}-r{j}')
+        row_count += len(lot_data)
+    print(f'reconciled {process}_{yymm}: {len(lot_list)} lots re-pulled, {row_count} rows')
+    return row_count
+
+
+def remove_pending(process: str, yymm: str, root: str, stamp: str):
+    """
+    Input: formation process (GC12 or GC13), table month, mirror directory and stamp of an interrupted sync
+    Function: deletes the files written by a sync that did not finish so they are not appended twice
+    Output: None
+    """
+    month_path = os.path.join(root, process, f'YYMM={yymm}')
+    if not os.path.isdir(month_path):
+        return
+    for lot_dir in os.listdir(month_path):
+        for file in os.listdir(os.path.join(month_path, lot_dir)):
+            if file.startswith(f'part-{stamp}-'):
+                os.remove(os.path.join(month_path, lot_dir, file))
+
+
+def sync_mirror(db: dict, root: str, months: int = SYNC_MONTHS):
+    """
+    Input: database credentials, mirror directory and number of months to keep in sync
+    Function: syncs the GC12/GC13 tables of the most recent months
+    Output: None
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required to sync the formation mirror')
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    for yymm in [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(months - 1, -1, -1)]:
+        for process in ['GC12', 'GC13']:
+            sync_month(db, process, yymm, root)
+
+
+def read_mirror(process: str, yymm_list: list[str], root: str, columns: list[str] = None,
+                filters: list[tuple] = None) -> pd.DataFrame():
+    """
+    Input: formation process (GC12 or GC13), table month list, mirror directory, columns to read and row filters in
+           pyarrow form, e.g. [('LOT_NO', '=', lot), ('MEASURE_DATE', '>=', start)]
+    Function: reads mirrored formation data, filters on LOT_NO prune whole partitions and other filters are pushed
+              down to the parquet row groups
+    Output: mirrored formation data
+            index: [Default]
+            columns: [columns]
+    """
+    data = []
+    for yymm in yymm_list:
+        path = os.path.join(root, process, f'YYMM={yymm}')
+        if not os.path.isdir(path):
+            continue
+        # partition keys are read as plain strings, dictionary keys cannot hold the partition of rows without a LOT_NO
+        table = pq.read_table(path, columns=columns, filters=filters, partitioning=ds.partitioning(flavor='hive'))
+        data.append(table.to_pandas())
+        record_query(table.num_rows, source='mirror')
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns if columns else MIRROR_COLUMNS[process])
+    return pd.concat(data, ignore_index=True)
+
+
+if __name__ == '__main__':
+    from retest_flagging.config import get_db_info, MIRROR_DIRECTORY
+    sync_mirror(get_db_info(), MIRROR_DIRECTORY)
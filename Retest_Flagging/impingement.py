@@ -10,59 +10,77 @@ Notes:
 
 Version Updates:
 v1.0 -
+v1.1 - Separator and JRD tables joined server-side per chunk of cells, chunks of all months fetched concurrently
+v1.2 - Assembly attributes read from the local assembly cache, only cache misses are queried
 
 """
 
 import pandas as pd
-import cx_Oracle
+from functools import partial
+from retest_flagging.bulk_lookup import CELL_ID_JOIN, pool_cell_query
+from retest_flagging.assembly_cache import cached_assembly_data
+from retest_flagging.config import ASSEMBLY_CACHE
+from retest_flagging.cell_id import decode_yymm
+from retest_flagging.partition_router import month_tier
+from retest_flagging.query_executor import run_queries
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+
+SEPARATOR_TYPES = {'G': 'S4', 'M': 'S5', 'Q': 'S6', 'P': 'S7'}
+ASSEMBLY_CHUNK = 5000  # cells per statement, chunks run concurrently on the tier's pooled sessions
+# separator (GAWW00) and JRD (GAWA38) rows of the bound cells, a cell found in only one table keeps NULL for the other
+ASSEMBLY_QUERY = """
+SELECT NVL(s.CELL_ID, j.CELL_ID) AS CELL_ID, s.SEPARATOR, j.AVG_JRD
+FROM (SELECT t.CELL_ID, t.S1_LOT_NO AS SEPARATOR FROM GEIS.T_CELL_ENG_GAWW00_{yymm} t {cell_id_join}) s
+FULL OUTER JOIN (SELECT t.CELL_ID, t.DATA_01 AS AVG_JRD FROM GEIS.T_CELL_ENG_GAWA38_{yymm} t {cell_id_join}) j
+ON j.CELL_ID = s.CELL_ID
+"""
+
+
+def decode_separator(separator_lots: pd.Series) -> pd.Series:
+    """
+    Input: separator lot numbers (S1_LOT_NO)
+    Function: decodes the separator type from the third character of the lot number for the whole column at once
+    Output: separator type per cell ('Other' for unknown codes, NaN if the lot number is missing)
+    """
+    separator = separator_lots.str[2].map(SEPARATOR_TYPES)
+    return separator.where(separator.notna() | separator_lots.isna(), 'Other')
+
+
+def fetch_assembly_data(db_info: dict, cell_list: pd.DataFrame()) -> pd.DataFrame():
+    """
+    Input: database configuration settings and list of cell ids
+    Function: query database for jrd & separator data. Both tables are joined server-side in one statement per chunk
+              of ASSEMBLY_CHUNK cells, every month on the database that holds it and all chunks at the same time
+    Output: assembly cell data of the cells found in the database
+            index: [Default]
+            column: [CELL_ID, SEPARATOR, AVG_JRD]
+    """
+    cell_list = cell_list.assign(yymm=decode_yymm(cell_list.CELL_ID))
+    queries = []
+    for yymm in cell_list.yymm.dropna().unique():
+        usable_cells = list(dict.fromkeys(cell_list[cell_list.yymm == yymm].CELL_ID))
+        print(f'assembly data {yymm}: {len(usable_cells)} cells', datetime.now())
+        query = ASSEMBLY_QUERY.format(yymm=yymm, cell_id_join=CELL_ID_JOIN)
+        for i in range(0, len(usable_cells), ASSEMBLY_CHUNK):
+            queries.append((month_tier(yymm), (query, usable_cells[i:i + ASSEMBLY_CHUNK])))
+    results = run_queries(partial(pool_cell_query, db=db_info), queries)
+    # chunks hold disjoint cells and are joined once
+    assembly_data = pd.concat(results, ignore_index=True) if results else \
+        pd.DataFrame(columns=['CELL_ID', 'SEPARATOR', 'AVG_JRD'])
+    assembly_data['SEPARATOR'] = decode_separator(assembly_data.SEPARATOR)
+    return assembly_data
 
 
 def get_assembly_data(db_info: dict, cell_list: pd.DataFrame()) -> pd.DataFrame():
     """
-    Input: database configuration settings, list of assembly year & month, and list of cell ids
-    Function: query database for jrd & separator data
+    Input: database configuration settings and list of cell ids
+    Function: reads jrd & separator data from the assembly cache, cells not cached yet are queried from the database
     Output: assembly cell data
             index: [Default]
-            column: [CELL_ID, SEPARATOR, AVG_JRD]
+            column: [CELL_ID, yymm, SEPARATOR, AVG_JRD]
     """
-    separator_dict = {'G': 'S4', 'M': 'S5', 'Q': 'S6', 'P': 'S7'}
-    cell_id_dict = {'1': '01', '2': '02', '3': '03', '4': '04', '5': '05', '6': '06', '7': '07', '8': '08', '9': '09',
-                    'A': '10', 'B': '11', 'C': '12', 'D': '13', 'E': '14', 'F': '15', 'G': '16', 'H': '17', 'J': '18',
-                    'K': '19', 'L': '20', 'M': '21', 'N': '22', 'P': '23', 'Q': '24', 'R': '25', 'S': '26', 'T': '27',
-                    'U': '28', 'V': '29', 'W': '30', 'X': '31', 'Y': '32', 'Z': '33'}
-    cell_list['yymm'] = cell_list.apply(lambda x: cell_id_dict[x.CELL_ID[4]] + cell_id_dict[x.CELL_ID[5]], axis=1)
-    assembly_data = pd.DataFrame()
-    for yymm in cell_list.yymm.unique():
-        usable_cells = cell_list[cell_list.yymm == yymm]
-        cell_tuples = [tuple(usable_cells.CELL_ID[i * 999:(i + 1) * 999]) for i in range(((len(usable_cells) // 999) + 1))]
-        cold_db = datetime(int('20' + yymm[0:2]), int(yymm[2:4]), 1) < (datetime.now() - relativedelta(months=11))
-        user = db_info['mes_user']
-        pw = db_info['mes_pw']
-        dsn = db_info['mes_dsn']
-        if cold_db:
-            user = db_info['cold_user']
-            pw = db_info['cold_pw']
-            dsn = db_info['cold_dsn']
-        with cx_Oracle.connect(user=user, password=pw, dsn=dsn) as con:
-            for i, cell_tuple in enumerate(cell_tuples):
-                if len(cell_tuple) == 1:
-                    cell_tuple = f"('{cell_tuple[0]}')"
-                print(f'{i}/{len(cell_tuples)} ({i*100/len(cell_tuples):.2f}%)', datetime.now())  # remove
-                separator_data = pd.read_sql(f"""
-                SELECT CELL_ID, S1_LOT_NO AS SEPARATOR
-                FROM GEIS.T_CELL_ENG_GAWW00_{yymm}
-                WHERE CELL_ID IN {cell_tuple}
-                """, con)
-                jrd_data = pd.read_sql(f"""
-                SELECT CELL_ID, DATA_01 AS AVG_JRD FROM GEIS.T_CELL_ENG_GAWA38_{yymm}
-                WHERE CELL_ID IN {cell_tuple}
-                """, con)
-                separator_data.SEPARATOR = separator_data.SEPARATOR.apply(lambda x: separator_dict[x[2]]
-                                                                          if x[2] in separator_dict.keys() else 'Other')
-                cell_data = pd.merge(separator_data, jrd_data, on='CELL_ID', how='outer')
-                assembly_data = pd.concat([assembly_data, cell_data], ignore_index=True)
+    cell_list['yymm'] = decode_yymm(cell_list.CELL_ID)
+    assembly_data = cached_assembly_data(ASSEMBLY_CACHE, cell_list.CELL_ID, partial(fetch_assembly_data, db_info))
     # capture missing data rows with left join on original cell list
     assembly_data = pd.merge(cell_list, assembly_data, on='CELL_ID', how='left')
     return assembly_data
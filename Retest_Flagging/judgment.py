@@ -0,0 +1,45 @@
+"""
+Judgment Module
+This program assigns dV model (DEFECT_CODE) and dQ model (DQ_CODE) judgment codes to retest cells. Every code is one
+row of an ordered rule table; rules are evaluated as vectorized conditions over the whole lot and the first matching
+rule sets the code, the same precedence as the original per-row if/else chain.
+
+Notes:
+New codes should be added to the rule tables as whole-column conditions, not as per-row functions.
+Parity with the original row-wise logic is checked by tests/test_judgment.py.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import numpy as np
+import pandas as pd
+
+OK_CODE = 'N000'
+# (code, condition) - evaluated in order, first match wins. conditions take the lot data and the spec settings
+DEFECT_RULES = [
+    ('900W', lambda d, spec: (d.DVDT > 0.00005) | (d.DVDT < d.DV_CUTOFF) | (d.CELL_MODEL != spec['model_number'])
+                             | (d.SITTING_TIME == 0)),
+    ('400V', lambda d, spec: d.RETEST_V1 < d.VOLTAGE_CUTOFF),
+    ('500W', lambda d, spec: d.RETEST_V2 < d.VOLTAGE_CUTOFF),
+]
+DQ_RULES = [
+    ('900Z', lambda d, spec: (d.RETEST_V1 < spec['volt_spec']) | (d.RETEST_V2 < spec['volt_spec'])),
+    ('900Y', lambda d, spec: d.NORM_DV < spec['ndv_spec']),
+    ('900X', lambda d, spec: ~d.CELL_MODEL.isin(spec['dq_models'])),  # no dQdV curve for the model
+    ('900W', lambda d, spec: (d.R_SHORT < spec['rshort_spec']) | (d.DVDT > 0.00005)),
+]
+PROCESS_NG_CODES = ['900W', '400V', '500W']
+DQ_NG_CODES = ['900W', '900Y', '900X', '900U', '900Z']
+
+
+def judge(data: pd.DataFrame(), rules: list, spec: dict) -> np.ndarray:
+    """
+    Input: retest cell data, ordered rule table and spec settings
+    Function: evaluates every rule over the whole lot, first matching rule per cell sets the code
+    Output: judgment code per cell
+    """
+    conditions = [np.asarray(condition(data, spec), dtype=bool) for code, condition in rules]
+    codes = [code for code, condition in rules]
+    return np.select(conditions, codes, default=OK_CODE).astype(object)
+
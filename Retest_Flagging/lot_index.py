@@ -0,0 +1,128 @@
+"""
+Lot Index Module
+This program maintains a local lot -> formation table index so retest lots can be located without probing every
+monthly GC12/GC13 table. Closed months are indexed once from LOT_NO and never probed again; only months newer than the
+index watermark are read from the database.
+
+Notes:
+The current (open) month is never written to the index since lots are still being added to it. It is checked per lot.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import sqlite3
+import pandas as pd
+import cx_Oracle
+from retest_flagging.db_pool import connection, read_sql
+from retest_flagging.partition_router import month_tier, split_months
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+INDEX_MONTHS = 24  # months covered by the initial index build (12 MES + 12 cold)
+
+
+def open_index(path: str) -> sqlite3.Connection:
+    """
+    Input: local index file path
+    Function: opens (and creates if needed) the lot index store
+    Output: sqlite connection
+    """
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    con = sqlite3.connect(path)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS LOT_INDEX (
+        LOT_NO TEXT NOT NULL,
+        YYMM TEXT NOT NULL,
+        PROCESS TEXT NOT NULL,
+        PRIMARY KEY (LOT_NO, YYMM, PROCESS))
+    """)
+    con.execute('CREATE TABLE IF NOT EXISTS INDEX_META (KEY TEXT PRIMARY KEY, VALUE TEXT)')
+    return con
+
+
+def get_watermark(con: sqlite3.Connection) -> str:
+    """
+    Input: lot index connection
+    Function: reads the most recent closed month that has been fully indexed
+    Output: watermark table month (yymm) or None if the index is empty
+    """
+    row = con.execute("SELECT VALUE FROM INDEX_META WHERE KEY = 'WATERMARK'").fetchone()
+    return row[0] if row else None
+
+
+def index_month(con: sqlite3.Connection, db_con: cx_Oracle.Connection, yymm: str):
+    """
+    Input: lot index connection, database connection and table month
+    Function: records every LOT_NO found in the GC12/GC13 tables of a closed month
+    Output: None
+    """
+    con.execute('DELETE FROM LOT_INDEX WHERE YYMM = ?', (yymm,))
+    for process in ['GC12', 'GC13']:
+        lots = read_sql(f"""
+        SELECT DISTINCT LOT_NO
+        FROM GEIS.T_CELL_ENG_{process}_{yymm}
+        WHERE LOT_NO IS NOT NULL
+        """, db_con)
+        con.executemany('INSERT OR IGNORE INTO LOT_INDEX VALUES (?, ?, ?)',
+                        [(lot, yymm, process) for lot in lots.LOT_NO])
+    con.execute("INSERT OR REPLACE INTO INDEX_META VALUES ('WATERMARK', ?)", (yymm,))
+    con.commit()
+
+
+def update_index(db: dict, path: str):
+    """
+    Input: database credentials and local index file path
+    Function: indexes closed months newer than the index watermark
+    Output: None
+    """
+    con = open_index(path)
+    watermark = get_watermark(con)
+    closed_months = [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(INDEX_MONTHS, 0, -1)]
+    new_months = [yymm for yymm in closed_months if watermark is None or yymm > watermark]
+    tiers = split_months(new_months)
+    for tier in ['cold', 'mes']:  # oldest months first so the watermark only moves forward
+        tier_months = tiers.get(tier, [])
+        if len(tier_months) == 0:
+            continue
+        print(f'indexing {tier} months', tier_months)
+        with connection(db, tier) as db_con:
+            for yymm in tier_months:
+                index_month(con, db_con, yymm)
+    con.close()
+
+
+def lookup_lot(lot: str, path: str) -> pd.DataFrame():
+    """
+    Input: lot number and local index file path
+    Function: reads the indexed formation tables that contain the given lot
+    Output: indexed lot tables
+            index: [Default]
+            columns: [YYMM, PROCESS, DB]
+    """
+    con = open_index(path)
+    tables = pd.read_sql('SELECT YYMM, PROCESS FROM LOT_INDEX WHERE LOT_NO = ?', con, params=(lot,))
+    con.close()
+    tables['DB'] = tables.YYMM.apply(month_tier)
+    return tables
+
+
+def probe_open_month(lot: str, db: dict) -> list[str]:
+    """
+    Input: lot number and database credentials
+    Function: checks the current month GC12/GC13 tables for the given lot
+    Output: current table month if the lot is present, empty list otherwise
+    """
+    yymm = datetime.now().strftime('%y%m')
+    with connection(db, 'mes') as con:
+        for process in ['GC12', 'GC13']:
+            cell_count = read_sql(f"""
+            SELECT COUNT(CELL_ID)
+            FROM GEIS.T_CELL_ENG_{process}_{yymm}
+            WHERE LOT_NO = :lot
+            """, con, params={'lot': lot})
+            if cell_count.iloc[0, 0] != 0:
+                return [yymm]
+    return []
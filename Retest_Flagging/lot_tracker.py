@@ -0,0 +1,137 @@
+"""
+Lot Tracker Module
+This program durably tracks the retest lots found by the flagging service. Lots whose retest formation is complete are
+queued once, the outcome of every flagging attempt is recorded, and the MEASURE_DATE high-water mark of the formation
+scan is kept so every poll only looks at new measurements.
+
+Notes:
+Lots that were skipped or failed are retried after RETRY_AFTER minutes, at most MAX_ATTEMPTS times. Flagged lots are
+never queued again.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import sqlite3
+import pandas as pd
+from datetime import datetime, timedelta
+
+MAX_ATTEMPTS = 5
+RETRY_AFTER = 60  # minutes
+
+
+def open_tracker(path: str) -> sqlite3.Connection:
+    """
+    Input: local tracker file path
+    Function: opens (and creates if needed) the lot tracker store
+    Output: sqlite connection
+    """
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    con = sqlite3.connect(path, timeout=30)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS LOTS (
+        LOT_NO TEXT PRIMARY KEY,
+        STATUS TEXT NOT NULL,
+        ATTEMPTS INTEGER NOT NULL,
+        MESSAGE TEXT,
+        QUEUED TEXT NOT NULL,
+        UPDATED TEXT)
+    """)
+    con.execute('CREATE TABLE IF NOT EXISTS TRACKER_META (KEY TEXT PRIMARY KEY, VALUE TEXT)')
+    return con
+
+
+def get_watermark(path: str) -> datetime:
+    """
+    Input: local tracker file path
+    Function: reads the latest formation MEASURE_DATE already scanned
+    Output: high-water mark (None before the first scan)
+    """
+    con = open_tracker(path)
+    row = con.execute("SELECT VALUE FROM TRACKER_META WHERE KEY = 'WATERMARK'").fetchone()
+    con.close()
+    return datetime.fromisoformat(row[0]) if row else None
+
+
+def set_watermark(path: str, watermark: datetime):
+    """
+    Input: local tracker file path and latest formation MEASURE_DATE scanned
+    Function: moves the high-water mark forward (never backwards)
+    Output: None
+    """
+    current = get_watermark(path)
+    if current is not None and current >= watermark:
+        return
+    con = open_tracker(path)
+    with con:
+        con.execute("INSERT OR REPLACE INTO TRACKER_META VALUES ('WATERMARK', ?)", (watermark.isoformat(),))
+    con.close()
+
+
+def queue_lots(path: str, lots: list[str]) -> list[str]:
+    """
+    Input: local tracker file path and lots with complete retest formation
+    Function: queues lots that have not been seen before
+    Output: newly queued lots
+    """
+    con = open_tracker(path)
+    now = datetime.now().isoformat()
+    queued = []
+    with con:
+        for lot in lots:
+            cursor = con.execute("INSERT OR IGNORE INTO LOTS VALUES (?, 'QUEUED', 0, NULL, ?, NULL)", (lot, now))
+            if cursor.rowcount:
+                queued.append(lot)
+    con.close()
+    return queued
+
+
+def pending_lots(path: str) -> list[str]:
+    """
+    Input: local tracker file path
+    Function: finds queued lots and lots due for another attempt
+    Output: lots to flag, oldest first
+    """
+    retry_before = (datetime.now() - timedelta(minutes=RETRY_AFTER)).isoformat()
+    con = open_tracker(path)
+    lots = [row[0] for row in con.execute("""
+    SELECT LOT_NO FROM LOTS
+    WHERE STATUS <> 'FLAGGED' AND ATTEMPTS < ? AND (UPDATED IS NULL OR UPDATED < ?)
+    ORDER BY QUEUED
+    """, (MAX_ATTEMPTS, retry_before))]
+    con.close()
+    return lots
+
+
+def record_results(path: str, report: pd.DataFrame()):
+    """
+    Input: local tracker file path and batch status report (index LOT_NO, columns STATUS and MESSAGE)
+    Function: records the outcome of a flagging attempt for every lot in the report
+    Output: None
+    """
+    con = open_tracker(path)
+    now = datetime.now().isoformat()
+    with con:
+        for lot, row in report.iterrows():
+            con.execute("""
+            INSERT INTO LOTS VALUES (?, ?, 1, ?, ?, ?)
+            ON CONFLICT(LOT_NO) DO UPDATE SET STATUS = excluded.STATUS, ATTEMPTS = ATTEMPTS + 1,
+            MESSAGE = excluded.MESSAGE, UPDATED = excluded.UPDATED
+            """, (lot, row.STATUS, row.MESSAGE, now, now))
+    con.close()
+
+
+def read_tracker(path: str) -> pd.DataFrame():
+    """
+    Input: local tracker file path
+    Function: reads the state of every tracked lot
+    Output: tracked lots
+            index: [Default]
+            columns: [LOT_NO, STATUS, ATTEMPTS, MESSAGE, QUEUED, UPDATED]
+    """
+    con = open_tracker(path)
+    lots = pd.read_sql('SELECT * FROM LOTS ORDER BY QUEUED', con)
+    con.close()
+    return lots
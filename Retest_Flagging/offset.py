@@ -5,12 +5,39 @@ Created on Wed Jul 15 11:32:51 2020
 #!/usr/bin/env python
 # coding: utf-8
 
+import ast
+import threading
+import contextvars
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import datetime as dt
-import cx_Oracle
+from concurrent.futures import Future, ThreadPoolExecutor
+from retest_flagging.config import get_db_info, MIRROR_DIRECTORY, OFFSET_CACHE
+from retest_flagging.db_pool import connection, read_sql, pool_query
+from retest_flagging.partition_router import query_tier, run_partitioned
+from formation_mirror import mirror_ready, read_mirror
+from offset_cache import line_key, is_settled, get_offset, get_daily_trays, put_offset, get_verdict, put_verdict, cache_stats
+
+
+# projected columns of the monthly tables read for MP and offset data, see compactTypes() for the dtypes they are stored in
+MP_V1_COLUMNS = 'SELECT CELL_ID, LOT_NO, TRAY_NO, TRAY_POSITION, EQUIP_NO, MEASURE_DATE, DATA_01 FROM GEIS.T_CELL_ENG_GC12_{}'
+MP_V2_COLUMNS = 'SELECT CELL_ID, EQUIP_NO, MEASURE_DATE, DATA_02 FROM GEIS.T_CELL_ENG_GC13_{}'
+OFFSET_V1_COLUMNS = 'SELECT CELL_ID, LOT_NO, TRAY_NO, TRAY_POSITION, EQUIP_NO, LINE_NO, MEASURE_DATE, DATA_01 FROM GEIS.T_CELL_ENG_GC12_{}'
+OFFSET_V2_COLUMNS = 'SELECT CELL_ID, EQUIP_NO, LINE_NO, DATA_02 FROM GEIS.T_CELL_ENG_GC13_{}'
+CATEGORY_COLUMNS = ['V1_MACHINE', 'V2_MACHINE', 'TRAY_NO', 'LOT_NO', 'LINE_NO', 'V1_LINE', 'V2_LINE']
+FLOAT32_COLUMNS = ['MED_TRAY_METER_DV', 'DV'] # dV is calculated by the server, float32 keeps ~1e-11 V at dV ~1e-4 V
+MP_LOT_CODES = ['G1', 'G2', 'G3', 'G4', 'G5', 'G6', 'G7', 'G8', 'G9', 'GA', 'GB', 'GC', 'GD']
+# results shared between lots flagged in the same batch, see sharedResult() and clearSharedResults()
+_shared_results = {}
+_shared_lock = threading.Lock()
+# set to True to save the cell data and offset of every validate() call for debugging
+CAPTURE_DEBUG = False
+# candidate offset windows evaluated at the same time by getOffsets, 1 tries them one after another
+SPECULATIVE_WINDOWS = 4
+# windows of all lots querying at the same time, leaves db_pool.POOL_MAX - query_executor.TIER_LIMITS['mes'] sessions
+SPECULATIVE_TOTAL = 4
+_window_executor = ThreadPoolExecutor(max_workers = SPECULATIVE_TOTAL, thread_name_prefix = 'offset_window')
+CAPTURE_DIRECTORY = r'C:\Users\KW38770\Documents\WangK\Formation'
 
 
 ## Calculate Meter Offsets for that data
@@ -39,8 +66,8 @@ def tryOffsets(day1, _first_month, _second_month, lines):
                 MOD(SUBSTR(t1.TRAY_POSITION,2,2),4) AS METER,
                 t1.TRAY_NO,
                 t1.LOT_NO
-            FROM (SELECT * FROM GEIS.T_CELL_ENG_GC12_{} UNION ALL SELECT * FROM GEIS.T_CELL_ENG_GC12_{}) t1
-                INNER JOIN (SELECT * FROM GEIS.T_CELL_ENG_GC13_{} UNION ALL SELECT * FROM GEIS.T_CELL_ENG_GC13_{}) t2
+            FROM ({} UNION ALL {}) t1
+                INNER JOIN ({} UNION ALL {}) t2
                 ON (t2.CELL_ID = t1.CELL_ID)
             WHERE t1.MEASURE_DATE BETWEEN TO_DATE('{}','YYYY-MM-DD') AND TO_DATE('{}','YYYY-MM-DD')
                 AND t1.LINE_NO IN {}
@@ -49,31 +76,48 @@ def tryOffsets(day1, _first_month, _second_month, lines):
                 AND SUBSTR(t1.LOT_NO,7,3) NOT IN ('GD9')
             GROUP BY t1.TRAY_NO, t1.EQUIP_NO, t2.EQUIP_NO, MOD(SUBSTR(t1.TRAY_POSITION,2,2),4), t1.LOT_NO
             HAVING MEDIAN(t2.DATA_02 - t1.DATA_01) BETWEEN -.5 AND .5
-            """.format(_first_month, _second_month, _first_month, _second_month, _start_day, _end_day, lines,  lines)
+            """.format(OFFSET_V1_COLUMNS.format(_first_month), OFFSET_V1_COLUMNS.format(_second_month),
+                       OFFSET_V2_COLUMNS.format(_first_month), OFFSET_V2_COLUMNS.format(_second_month), _start_day, _end_day, lines,  lines)
 
 
 
     #Grab MP Data into df offset_data for processing
 
-    con = cx_Oracle.connect(user='PENAENG', password='p6bru@aXE=am', dsn='10.133.200.175/GEISDB.WORLD')
-    if _first_month not in [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(12)]:
-        con = cx_Oracle.connect(user='kwang', password='XV7A6GneRC2a', dsn='10.133.200.174:1521/colddb.america.gds.panasonic.com')
+    tier = query_tier([_first_month, _second_month])
+
+    if mirrorReady([_first_month, _second_month]):
+        offset_data = getMirrorOffsetData(_start_day, _end_day, [_first_month, _second_month], parseSqlList(lines))
+    else:
+        print('MES Connection Established at {}'.format(str(datetime.now().time())[:-5]))
+        with connection(get_db_info(), tier) as con:
+            offset_data = read_sql(sql, con)
+        print('MES Connection Ended at {}'.format(str(datetime.now().time())[:-5]))
+    offset_data = compactTypes(offset_data)
+
+    return calculateOffsets(offset_data, day1)
+
 
-    print('MES Connection Established at {}'.format(str(datetime.now().time())[:-5]))
-    offset_data = pd.read_sql_query(sql, con)
-    con.close()
-    print('MES Connection Ended at {}'.format(str(datetime.now().time())[:-5]))
 
+def calculateOffsets(offset_data, day1):
+    """Turns the per tray/meter median dV of the MP data into meter offsets
+
+    Parameters:
+    offset_data (pandas DataFrame): Columns ['MED_TRAY_METER_DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO'] as returned by the tryOffsets query
+    day1 (datetime): The end day of the 2 day time period for offset calculation, only used for logging
+
+    Returns:
+    Pandas Dataframe: Columns ['V1_MACHINE', 'V2_MACHINE', 'METER', 'OFFSET'], empty in the case of any errors
+    """
     try:
 
         #Process Offset from MP data
-        tray_medians = offset_data[['MED_TRAY_METER_DV', 'TRAY_NO']].groupby('TRAY_NO').median().reset_index().rename(columns={'MED_TRAY_METER_DV' : 'MED_TRAY_DV'})
+        tray_medians = offset_data[['MED_TRAY_METER_DV', 'TRAY_NO']].groupby('TRAY_NO', observed = True).median().reset_index().rename(columns={'MED_TRAY_METER_DV' : 'MED_TRAY_DV'})
         print('tray medians', tray_medians)
         offset_data = offset_data.merge(tray_medians, on='TRAY_NO')
 
         offset_data['METER_DIFF'] = offset_data['MED_TRAY_DV'] - offset_data['MED_TRAY_METER_DV']
         print('offset data', offset_data)
-        offsets = offset_data.groupby(['METER', 'V1_MACHINE', 'V2_MACHINE']).mean()['METER_DIFF'].rename('OFFSET')
+        offsets = offset_data.groupby(['METER', 'V1_MACHINE', 'V2_MACHINE'], observed = True)['METER_DIFF'].mean().rename('OFFSET')
         offsets = offsets.to_frame().reset_index()
 
     except:
@@ -85,6 +129,82 @@ def tryOffsets(day1, _first_month, _second_month, lines):
 
 
 
+def getDailyOffsetData(day1):
+    """Creates the per tray/meter median dV of every line pair for one 2 day window with a single query, used by the
+    daily offset job. A line set's rows are exactly the rows the tryOffsets query returns for it, so calculateOffsets
+    gives the same offset for them (a machine belongs to one line, grouping by the lines does not split a tray/meter)
+
+    Parameters:
+    day1 (datetime): The end day of the 2 day time period for offset calculation
+
+    Returns:
+    Pandas Dataframe: Columns ['MED_TRAY_METER_DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO', 'V1_LINE', 'V2_LINE']
+    """
+    _end_day = str(day1)[0:10]
+    _start_day = str(day1 - pd.Timedelta(days = 2))[0:10]
+    _first_month, _second_month = getMonths(day1)
+    sql = """SELECT MEDIAN(t2.DATA_02 - t1.DATA_01) AS MED_TRAY_METER_DV,
+                t1.EQUIP_NO AS V1_MACHINE,
+                t2.EQUIP_NO AS V2_MACHINE,
+                MOD(SUBSTR(t1.TRAY_POSITION,2,2),4) AS METER,
+                t1.TRAY_NO,
+                t1.LOT_NO,
+                t1.LINE_NO AS V1_LINE,
+                t2.LINE_NO AS V2_LINE
+            FROM ({} UNION ALL {}) t1
+                INNER JOIN ({} UNION ALL {}) t2
+                ON (t2.CELL_ID = t1.CELL_ID)
+            WHERE t1.MEASURE_DATE BETWEEN TO_DATE('{}','YYYY-MM-DD') AND TO_DATE('{}','YYYY-MM-DD')
+                AND SUBSTR(t1.LOT_NO,7,2) IN ('G1', 'G2', 'G3', 'G4', 'G5', 'G6', 'G7', 'G8', 'G9', 'GA', 'GB', 'GC', 'GD')
+                AND SUBSTR(t1.LOT_NO,7,3) NOT IN ('GD9')
+            GROUP BY t1.TRAY_NO, t1.EQUIP_NO, t2.EQUIP_NO, MOD(SUBSTR(t1.TRAY_POSITION,2,2),4), t1.LOT_NO, t1.LINE_NO, t2.LINE_NO
+            HAVING MEDIAN(t2.DATA_02 - t1.DATA_01) BETWEEN -.5 AND .5
+            """.format(OFFSET_V1_COLUMNS.format(_first_month), OFFSET_V1_COLUMNS.format(_second_month),
+                       OFFSET_V2_COLUMNS.format(_first_month), OFFSET_V2_COLUMNS.format(_second_month), _start_day, _end_day)
+
+    tier = query_tier([_first_month, _second_month])
+
+    if mirrorReady([_first_month, _second_month]):
+        return getMirrorOffsetData(_start_day, _end_day, [_first_month, _second_month], None)
+    with connection(get_db_info(), tier) as con:
+        return read_sql(sql, con)
+
+
+
+def getMirrorOffsetData(_start_day, _end_day, _months, _lines):
+    """Computes the per tray/meter median dV of tryOffsets from the local formation mirror instead of the database
+
+    Parameters:
+    _start_day (str): 'YYYY-MM-DD' start of the V1 measurement window
+    _end_day (str): 'YYYY-MM-DD' end of the V1 measurement window
+    _months (list): the table codes of the mirrored months to read
+    _lines (list): the lines to include (V1 and V2 line), None for all lines
+
+    Returns:
+    Pandas Dataframe: same columns as the tryOffsets query and the V1/V2 lines ['MED_TRAY_METER_DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO', 'V1_LINE', 'V2_LINE']
+    """
+    v1_filters = [('MEASURE_DATE', '>=', pd.Timestamp(_start_day)), ('MEASURE_DATE', '<=', pd.Timestamp(_end_day))]
+    v2_filters = None
+    if _lines is not None:
+        v1_filters.append(('LINE_NO', 'in', _lines))
+        v2_filters = [('LINE_NO', 'in', _lines)]
+    v1_data = read_mirror('GC12', _months, MIRROR_DIRECTORY,
+                          columns = ['CELL_ID', 'LOT_NO', 'TRAY_NO', 'TRAY_POSITION', 'EQUIP_NO', 'LINE_NO', 'DATA_01'],
+                          filters = v1_filters)
+    v1_data = v1_data.loc[v1_data['LOT_NO'].str[6:8].isin(MP_LOT_CODES) & (v1_data['LOT_NO'].str[6:9] != 'GD9')]
+    v2_data = read_mirror('GC13', _months, MIRROR_DIRECTORY, columns = ['CELL_ID', 'EQUIP_NO', 'LINE_NO', 'DATA_02'],
+                          filters = v2_filters)
+    offset_data = v1_data.merge(v2_data, on = 'CELL_ID', suffixes = ('_V1', '_V2'))
+    offset_data['DV'] = offset_data['DATA_02'] - offset_data['DATA_01']
+    offset_data['METER'] = offset_data['TRAY_POSITION'].str[1:3].astype(int) % 4
+    offset_data = offset_data.groupby(['TRAY_NO', 'EQUIP_NO_V1', 'EQUIP_NO_V2', 'METER', 'LOT_NO', 'LINE_NO_V1', 'LINE_NO_V2'])['DV'].median().reset_index()
+    offset_data = offset_data.rename(columns = {'DV' : 'MED_TRAY_METER_DV', 'EQUIP_NO_V1' : 'V1_MACHINE', 'EQUIP_NO_V2' : 'V2_MACHINE',
+                                                'LINE_NO_V1' : 'V1_LINE', 'LINE_NO_V2' : 'V2_LINE'})
+    offset_data = offset_data.loc[offset_data['MED_TRAY_METER_DV'].between(-.5, .5)]
+    return offset_data[['MED_TRAY_METER_DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO', 'V1_LINE', 'V2_LINE']]
+
+
+
 def getOffsets(cell_data):
     """Creates a validated offset from the best availible data.
 
@@ -103,42 +223,108 @@ def getOffsets(cell_data):
     """
     lines = str(tuple(cell_data['LINE_NO'].unique())).replace(',)', ')')
 
-
     #First Attempts to create an offset from 2 days of data before the median V1 measurement
+    #if the default method doesn't result in effective offsets, using data between v1 and v2 is attempted
+    #after that offsets are recalculated from past data going back one day at a time.
     day1 = cell_data['V1_MEASURE_DATE'].mean()
-    month1, month2 = getMonths(day1)
-    offset = tryOffsets(day1, month1, month2, lines)
-    if validate(offset, cell_data):
-        return offset
+    candidates = [day1, day1 + pd.Timedelta(days = 3)]
+    candidates += [candidates[1] - pd.Timedelta(days = i) for i in range(1, 13)]
 
-    #if the default method doesn't result in effective offsets, using data between v1 and v2 is attempted
+    if SPECULATIVE_WINDOWS > 1:
+        offset = speculativeOffsets(candidates, cell_data, lines)
+        if offset is not None:
+            return offset
     else:
-        day1 = day1 + pd.Timedelta(days = 3)
-        month1, month2 = getMonths(day1)
-        offset = tryOffsets(day1, month1, month2, lines)
+        for day in candidates:
+            offset, valid = tryCandidate(day, cell_data, lines)
+            if valid:
+                return offset
+    #beyond 13 days back from the day1 value at the start of this loop, there is no guarentee that offset is more accurate than V1-V1, so an error is raised
+    raise NameError('No Valid Offset Could be created. This meter may have been recently been there may not be any recent mass production data on this line')
+
+
+
+def tryCandidate(day1, cell_data, lines):
+    """Creates and validates the offset of one candidate window
+
+    Parameters:
+    day1 (datetime): The end day of the 2 day time period for offset calculation
+    cell_data (pandas DataFrame): The Cell Data for which offsets are being created (see getOffsets)
+    lines (str): a list of necessary lines in str(tuple) format
+
+    Returns:
+    Pandas DataFrame: the offset of the window (see tryOffsets)
+    Bool: If the offset passed validation
+    """
+    month1, month2 = getMonths(day1)
+    offset = sharedTryOffsets(day1, month1, month2, lines)
+    return offset, validate(offset, cell_data, day1)
 
-        if validate(offset, cell_data):
-            return offset
 
-        #if
-        else:
-            for i in range(1,13):#this loop attempts to recalculate offsets from past data going back one day at a time.
-                day1 = day1 - pd.Timedelta(days = 1)
-                month1, month2 = getMonths(day1)
-                offset = tryOffsets(day1, month1, month2, lines)
-                if validate(offset, cell_data):
-                    return offset
-            #beyond 13 days back from the day1 value at the start of this loop, there is no guarentee that offset is more accurate than V1-V1, so an error is raised
-            raise NameError('No Valid Offset Could be created. This meter may have been recently been there may not be any recent mass production data on this line')
 
+def speculativeOffsets(candidates, cell_data, lines):
+    """Evaluates up to SPECULATIVE_WINDOWS candidate windows ahead while keeping their priority order. A window's
+    result is only used once every window before it has failed. The windows of all lots share SPECULATIVE_TOTAL
+    threads, so at most that many pooled sessions are used for offset windows, and once a valid offset is found the
+    windows still queued are cancelled and windows that have not started their query skip it.
+
+    Parameters:
+    candidates (list): candidate window end days in priority order
+    cell_data (pandas DataFrame): The Cell Data for which offsets are being created (see getOffsets)
+    lines (str): a list of necessary lines in str(tuple) format
+
+    Returns:
+    Pandas DataFrame: the highest priority valid offset, None if no window is valid
+    """
+    cancelled = threading.Event()
+    futures = []
+    def submit(day):
+        # each window runs in a copy of the caller's context so instrumentation follows the lot
+        futures.append(_window_executor.submit(contextvars.copy_context().run, speculativeCandidate, day, cell_data, lines, cancelled))
+    try:
+        for day in candidates[:SPECULATIVE_WINDOWS]:
+            submit(day)
+        for i, day in enumerate(candidates):
+            offset, valid = futures[i].result()
+            if valid:
+                print('Valid offset found for ' + str(day)[0:10])
+                return offset
+            if i + SPECULATIVE_WINDOWS < len(candidates):
+                submit(candidates[i + SPECULATIVE_WINDOWS])
+        return None
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+
+
+def speculativeCandidate(day1, cell_data, lines, cancelled):
+    """tryCandidate for a speculative window, skipped if the lot no longer needs it
+
+    Parameters:
+    day1 (datetime): The end day of the 2 day time period for offset calculation
+    cell_data (pandas DataFrame): The Cell Data for which offsets are being created (see getOffsets)
+    lines (str): a list of necessary lines in str(tuple) format
+    cancelled (threading.Event): set once the lot has its offset
+
+    Returns:
+    Pandas DataFrame: the offset of the window (see tryOffsets), None if skipped
+    Bool: If the offset passed validation
+    """
+    if cancelled.is_set():
+        return None, False
+    return tryCandidate(day1, cell_data, lines)
 
 
-def validate(offset, cell_data):
+
+def validate(offset, cell_data, day1 = None):
     """Runs checks to confirm that a given offset will reduce the variation due to meters when applied to cell_data
 
         Parameters:
         offset (pandas DataFrmae): conatins potential offsets to be checked; Columnns must include ['V1_MACHINE', 'V2_MACHINE', 'METER', 'OFFSET']
         cell_data (pandas DataFrame): contains cell_data which offsets must be confirmed to be effective with; Columns must include ['LINE_NO', 'V2_MEASURE_DATE', 'V1_MACHINE', 'V2_MACHINE', 'METER']
+        day1 (datetime): the end day of the offset window, if given the meter variability verdict is read from / stored in the offset cache
 
         Returns:
         Bool: If given DataFrame 'offset' will be effective in reducing variation due to meter bias when applied to the DataFrame 'cell_data'
@@ -158,35 +344,33 @@ def validate(offset, cell_data):
     print('Two Checks Passed')
 
     ##CELL_DATA PROCESSING
-    v1_machines = str(tuple(cell_data['V1_MACHINE'].unique())).replace(',)', ')')
-    v2_machines = str(tuple(cell_data['V2_MACHINE'].unique())).replace(',)', ')')
     lines = ["'" + d + "'" for d in cell_data['LINE_NO'].unique()]#This for loop creates an array of sql readable lines from the pandas line_no series in cell_data
     day2 = cell_data['V2_MEASURE_DATE'].mean()
 
-    # test code
-    cell_data.to_csv(rf'C:\Users\KW38770\Documents\WangK\Formation\test_cell_data.csv')
-    offset.to_csv(rf'C:\Users\KW38770\Documents\WangK\Formation\test_offset_data.csv')
-    # end test code
+    if CAPTURE_DEBUG:
+        captureDebugData(offset, cell_data)
     ##CORRECT METERS CHECK
-    for v1_machine in cell_data['V1_MACHINE'].unique():
-        for v2_machine in cell_data.loc[cell_data['V1_MACHINE'] == v1_machine, 'V2_MACHINE'].unique():
-            for meter in cell_data.loc[(cell_data['V1_MACHINE'] == v1_machine) & (cell_data['V2_MACHINE'] == v2_machine), 'METER'].unique():
-
-                if (offset.loc[(offset['V1_MACHINE'] == v1_machine) & (offset['V2_MACHINE'] == v2_machine) & (offset['METER'] == meter)].size <= 0):
-                    print('v1 machine', v1_machine, 'v2 machine', v2_machine, 'meter', meter)
-                    return False
+    ## anti-join of the meter combinations in cell_data against the offset table, every combination needs an offset
+    meters = cell_data[['V1_MACHINE', 'V2_MACHINE', 'METER']].drop_duplicates()
+    coverage = meters.merge(offset[['V1_MACHINE', 'V2_MACHINE', 'METER']].drop_duplicates(), how = 'left', indicator = True)
+    missing = coverage.loc[coverage['_merge'] == 'left_only']
+    if len(missing) > 0:
+        print('missing offsets', missing[['V1_MACHINE', 'V2_MACHINE', 'METER']].to_dict('records'))
+        return False
     print('Three Checks Passed')
 
     ##METER VARIABILITY CHECK
-    test_data = getTestLots(day2, lines)
-    # print(test_data)
-    test_data = test_data.merge(offset, on = ['V1_MACHINE', 'V2_MACHINE', 'METER'])
-    test_data['O_dVdt'] = (test_data['DV'] + test_data['OFFSET'])/(test_data['dT'])
-    test_data = test_data.groupby(['METER', 'TRAY_NO', 'LOT_NO', 'V1_MACHINE', 'V2_MACHINE']).median().reset_index()
-    test_data = test_data.drop(columns = ['V1_MACHINE', 'V2_MACHINE'])
-    raw_variability = test_data.groupby('TRAY_NO').std().median()['R_dVdT']
-    variability = test_data.groupby('TRAY_NO').std().median()['O_dVdt']
-    if variability >= raw_variability:
+    ## the verdict only depends on the offset window, the test lots day and the lines so it is cached with the offset
+    if day1 is None:
+        passed = variabilityCheck(offset, day2, lines)
+    else:
+        end_day, test_day, key = str(day1)[0:10], str(day2)[0:10], line_key(cell_data['LINE_NO'].unique())
+        passed = get_verdict(OFFSET_CACHE, end_day, key, test_day)
+        if passed is None:
+            passed = variabilityCheck(offset, day2, lines)
+            if is_settled(day1) and is_settled(day2):
+                put_verdict(OFFSET_CACHE, end_day, key, test_day, passed)
+    if not passed:
         return False
 
     print('All Offset Validation Checks Passed')
@@ -195,65 +379,116 @@ def validate(offset, cell_data):
 
 
 
+def captureDebugData(offset, cell_data):
+    """Saves the inputs of a validate() call, only used when CAPTURE_DEBUG is set
+
+        Parameters:
+        offset (pandas DataFrame): potential offsets being validated
+        cell_data (pandas DataFrame): cell data the offsets are validated against
+    """
+    cell_data.to_csv(rf'{CAPTURE_DIRECTORY}\test_cell_data.csv')
+    offset.to_csv(rf'{CAPTURE_DIRECTORY}\test_offset_data.csv')
+
+
+
+def variabilityCheck(offset, day2, lines):
+    """Checks if the offset reduces the tray variability of dVdt on recent mass production lots
+
+        Parameters:
+        offset (pandas DataFrame): potential offsets; Columns must include ['V1_MACHINE', 'V2_MACHINE', 'METER', 'OFFSET']
+        day2 (pandas datetime): the day from which test lots are searched
+        lines (list): sql readable lines
+
+        Returns:
+        Bool: True if the offset adjusted dVdt varies less than the raw dVdt
+    """
+    test_data = sharedTestLots(day2, lines)
+    # print(test_data)
+    test_data = test_data.merge(offset, on = ['V1_MACHINE', 'V2_MACHINE', 'METER'])
+    test_data['O_dVdt'] = (test_data['DV'] + test_data['OFFSET'])/(test_data['dT'])
+    test_data = test_data.groupby(['METER', 'TRAY_NO', 'LOT_NO', 'V1_MACHINE', 'V2_MACHINE'], observed = True)[['R_dVdT', 'O_dVdt']].median().reset_index()
+    tray_variability = test_data.groupby('TRAY_NO', observed = True)[['R_dVdT', 'O_dVdt']].std().median()
+    raw_variability = tray_variability['R_dVdT']
+    variability = tray_variability['O_dVdt']
+    return bool(variability < raw_variability)
+
+
+
 def getTestLots(day2, lines):
     """Identifies the most recently completed mass production data which is relevant to the given machine information
 
         Parameters:
         day2 (pandas datetime): the day at which the function starts searching for relevant MP lots (searches backwards from here)
-        v1_machines (str): a string representation of the list of all relevant v1 machines
-        v2_machines (str): a string representation of the list of all relevant v2 machines
-        lines (str): a string representation of the list of all lines that must be included in testLots
+        lines (list): sql readable lines that must be included in testLots
 
         Returns:
         pandas DataFrame: cell data for each cell in the chosen mass production lot(s)
 
-
+        Notes:
+        The MP lots of every line in the 22 days before day2 are read with one query per database tier. For each line the
+        2 day windows are then walked backwards from day2 and the first window with more than one lot is chosen. The lots
+        of the chosen windows are ranked by their median MEASURE_DATE in the window with one more query and the MP data of
+        the most recent lot of every line is fetched in a single batch.
     """
-    cell_data = pd.DataFrame()
-    #this loop ensures that 1 lot is pulled from each line in lines
-    for line in lines:
-        #This loop looks through the 22 days before param day2 for a time period with valid lots to return
-        for day in reversed(pd.date_range(day2 - pd.Timedelta(days = 20), day2)):
-
-
-            ##### THIS FIRST QUERY CREATES A LIST OF THE TWO MOST RECENT LOTS IN REGARDS TO THE V2 DATE
-            month1, month2 = getMonths(day)
-            start_day = str(day - pd.Timedelta(days = 2))[0:10]
-            end_day = str(day)[0:10]
-            sql = """SELECT t1.LOT_NO, MEDIAN(t1.MEASURE_DATE) AS MEASURE_DATE
-                    FROM (SELECT * FROM GEIS.T_CELL_ENG_GC13_{} UNION ALL SELECT * FROM GEIS.T_CELL_ENG_GC13_{}) t1
-                    WHERE t1.LINE_NO = {}
-                    AND t1.MEASURE_DATE BETWEEN TO_DATE('{}','YYYY-MM-DD') AND TO_DATE('{}','YYYY-MM-DD')
-                    AND t1.LOT_NO NOT LIKE '%Z%'
-                    AND t1.LOT_NO NOT LIKE '%GD9%'
-                    GROUP BY t1.LOT_NO
-            """.format(month1,month2,line,start_day,end_day)
-            con = cx_Oracle.connect(user='PENAENG', password='p6bru@aXE=am', dsn='10.133.200.175/GEISDB.WORLD')
-            if month1 not in [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(12)]:
-                con = cx_Oracle.connect(user='kwang', password='XV7A6GneRC2a', dsn='10.133.200.174:1521/colddb.america.gds.panasonic.com')
-            print('MES Connection Established at {}'.format(str(datetime.now().time())[:-5]))
-            potential_lots = pd.read_sql_query(sql, con)
-            con.close()
-            print('MES Connection Ended at {}'.format(str(datetime.now().time())[:-5]))
-
+    end_day = pd.Timestamp(str(day2)[0:10])
+    start_day = end_day - pd.Timedelta(days = 22)
+    months = sorted({str(day)[2:4] + str(day)[5:7] for day in pd.date_range(start_day, end_day)})
+    sql = """SELECT t1.LINE_NO, t1.LOT_NO, TRUNC(t1.MEASURE_DATE) AS MEASURE_DAY
+            FROM ({}) t1
+            WHERE t1.LINE_NO IN ({})
+            AND t1.MEASURE_DATE BETWEEN TO_DATE('{}','YYYY-MM-DD') AND TO_DATE('{}','YYYY-MM-DD')
+            AND t1.LOT_NO NOT LIKE '%Z%'
+            AND t1.LOT_NO NOT LIKE '%GD9%'
+            GROUP BY t1.LINE_NO, t1.LOT_NO, TRUNC(t1.MEASURE_DATE)
+    """
+    def tierQuery(tier, tier_months):
+        tables = ' UNION ALL '.join(['SELECT LINE_NO, LOT_NO, MEASURE_DATE FROM GEIS.T_CELL_ENG_GC13_{}'.format(month) for month in tier_months])
+        return [sql.format(tables, ', '.join(lines), str(start_day)[0:10], str(end_day)[0:10])]
+    print('MES Connection Established at {}'.format(str(datetime.now().time())[:-5]))
+    potential_lots = run_partitioned(lambda query, tier: pool_query(query, get_db_info(), tier), tierQuery, months)
+    print('MES Connection Ended at {}'.format(str(datetime.now().time())[:-5]))
 
+    #this loop finds the window to take 1 lot from for each line in lines
+    windows = {}
+    for line in lines:
+        line_lots = potential_lots.loc[potential_lots['LINE_NO'] == line.strip("'")]
+        #This loop looks through the 21 days before param day2 for a time period with valid lots to return
+        for day in reversed(pd.date_range(end_day - pd.Timedelta(days = 20), end_day)):
+            window = line_lots.loc[(line_lots['MEASURE_DAY'] >= day - pd.Timedelta(days = 2)) & (line_lots['MEASURE_DAY'] < day)]
             #If there is not a significant number of mass production lots in the given time period, move to the next time period
-            if potential_lots.size < 3:#size < 3 means there must be more than 1 lot because each row in this DataFrame as size 2
+            if window['LOT_NO'].nunique() < 2:
                 continue
-
-            #If there IS a significant amount of MP data, grab that data
-            potential_lots.sort_values(by = 'MEASURE_DATE', ascending = False)
-            lots = str(tuple(potential_lots['LOT_NO'][0:1])).replace(',)', ')')
-            temp_data = getMPData(lots, month1, month2)
-
-            #Once we have the data for the lot we want within a line, add that data to the final DataFrame of data and move to the next line
-            print (temp_data)
-            print('Adding data for ' + lots + ' to cell_data')
-            cell_data = pd.concat([temp_data, cell_data])
-            print(cell_data)
+            windows[line] = day
             break # this skips to the next lines, so the iteration doesn't continue for 20 days if a lot is found.
         print(line + ' is done.')
 
+    test_lots = []
+    if len(windows) != 0:
+        #the most recent lot of each window is the one with the latest median MEASURE_DATE within the window
+        sql = """SELECT t1.LINE_NO, t1.LOT_NO, MEDIAN(t1.MEASURE_DATE) AS MEASURE_DATE
+                FROM ({}) t1
+                WHERE ({})
+                AND t1.LOT_NO NOT LIKE '%Z%'
+                AND t1.LOT_NO NOT LIKE '%GD9%'
+                GROUP BY t1.LINE_NO, t1.LOT_NO
+        """
+        conditions = ' OR '.join(["(t1.LINE_NO = {} AND t1.MEASURE_DATE BETWEEN TO_DATE('{}','YYYY-MM-DD') AND TO_DATE('{}','YYYY-MM-DD'))"
+                                  .format(line, str(day - pd.Timedelta(days = 2))[0:10], str(day)[0:10]) for line, day in windows.items()])
+        window_months = sorted({str(day)[2:4] + str(day)[5:7] for window_day in windows.values()
+                                for day in pd.date_range(window_day - pd.Timedelta(days = 2), window_day)})
+        tables = ' UNION ALL '.join(['SELECT LINE_NO, LOT_NO, MEASURE_DATE FROM GEIS.T_CELL_ENG_GC13_{}'.format(month) for month in window_months])
+        lot_medians = pool_query(sql.format(tables, conditions), get_db_info(), query_tier(window_months))
+        for line in windows:
+            line_lots = lot_medians.loc[lot_medians['LINE_NO'] == line.strip("'")]
+            lot = line_lots.sort_values(by = 'MEASURE_DATE', ascending = False)['LOT_NO'].iloc[0]
+            print('Adding data for ' + lot + ' to cell_data')
+            test_lots.append(lot)
+
+    #the MP data of a window is read from the window's month and the month before it, as getMPData does for one window
+    mp_months = sorted({month for window_day in windows.values() for month in getMonths(window_day)})
+    cell_data = getMPDataBatch(test_lots, mp_months)
+    print(cell_data)
+
     try:
         if len(lines) != len(cell_data['LOT_NO'].unique()) :
             raise NameError("Insufficient Test Lots Found -- This shouldn't happen because what lots did you base the offsets on")
@@ -263,6 +498,7 @@ def getTestLots(day2, lines):
         raise
 
 
+
 # 'YYYY-MM-DD'
 
 def getMonths(day1):
@@ -297,10 +533,26 @@ def getMPData(_lot_list, _start_month, _end_month):
         _end_month (str): the table code for the second table to include in grabbing lot data
 
         Returns:
-        pandas DataFrame: cell data for each cell in lots in _lot_list; Columns = ['V1_MEASURE_DATE', 'V2_MEASURE_DATE', 'DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO', 'dT', 'R_dVdT']
+        pandas DataFrame: see getMPDataBatch
+    """
+    return getMPDataBatch(parseSqlList(_lot_list), [_start_month, _end_month])
+
+
+
+def getMPDataBatch(_lots, _months):
+    """ Queries MES for basic information about the cells of several lots at once with a single query
+
+        Parameters:
+        _lots (list): the lots for which to grab cell data
+        _months (list): the table codes of the tables to include in grabbing lot data
+
+        Returns:
+        pandas DataFrame: cell data for each cell in lots in _lots; Columns = ['V1_MEASURE_DATE', 'V2_MEASURE_DATE', 'DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO', 'dT', 'R_dVdT']
 
 
     """
+    if len(_lots) == 0:
+        return pd.DataFrame()
 
     #Create Query to grab MP Data
     sql = """SELECT
@@ -312,22 +564,26 @@ def getMPData(_lot_list, _start_month, _end_month):
                 MOD(SUBSTR(t1.TRAY_POSITION,2,2),4) AS METER,
                 t1.TRAY_NO,
                 t1.LOT_NO
-    FROM (SELECT * FROM GEIS.T_CELL_ENG_GC12_{} UNION ALL SELECT * FROM GEIS.T_CELL_ENG_GC12_{}) t1
-        INNER JOIN (SELECT * FROM GEIS.T_CELL_ENG_GC13_{} UNION ALL SELECT * FROM GEIS.T_CELL_ENG_GC13_{}) t2
+    FROM ({}) t1
+        INNER JOIN ({}) t2
         ON (t2.CELL_ID = t1.CELL_ID)
-    WHERE t1.LOT_NO IN {}
-    """.format(_start_month, _end_month, _start_month, _end_month, _lot_list)
+    WHERE t1.LOT_NO IN ({})
+    """
+    lot_list = ', '.join(["'" + lot + "'" for lot in _lots])
 
 
 
     #Grab MP Data into df cell_data
-    con = cx_Oracle.connect(user='PENAENG', password='p6bru@aXE=am', dsn='10.133.200.175/GEISDB.WORLD')
-    if _start_month not in [(datetime.now() - relativedelta(months=x)).strftime('%y%m') for x in range(12)]:
-        con = cx_Oracle.connect(user='kwang', password='XV7A6GneRC2a', dsn='10.133.200.174:1521/colddb.america.gds.panasonic.com')
-    print('MES Connection Established at {}'.format(str(datetime.now().time())[:-5]))
-    cell_data = pd.read_sql_query(sql, con)
-    con.close()
-    print('MES Connection Ended at {}'.format(str(datetime.now().time())[:-5]))
+    if mirrorReady(_months):
+        cell_data = getMirrorMPData(list(_lots), list(_months))
+    else:
+        #V1 and V2 of a cell can be in different months, so the join runs as one statement on the tier of the newest month
+        v1_tables = ' UNION ALL '.join([MP_V1_COLUMNS.format(month) for month in _months])
+        v2_tables = ' UNION ALL '.join([MP_V2_COLUMNS.format(month) for month in _months])
+        print('MES Connection Established at {}'.format(str(datetime.now().time())[:-5]))
+        cell_data = pool_query(sql.format(v1_tables, v2_tables, lot_list), get_db_info(), query_tier(list(_months)))
+        print('MES Connection Ended at {}'.format(str(datetime.now().time())[:-5]))
+    cell_data = compactTypes(cell_data)
 
 
 
@@ -342,3 +598,169 @@ def getMPData(_lot_list, _start_month, _end_month):
 
 
     return cell_data
+
+
+
+def getMirrorMPData(_lots, _months):
+    """ Reads the getMPData cell data from the local formation mirror instead of the database
+
+        Parameters:
+        _lots (list): the lots for which to grab cell data
+        _months (list): the table codes of the mirrored months to read
+
+        Returns:
+        pandas DataFrame: same columns as the getMPData query ['V1_MEASURE_DATE', 'V2_MEASURE_DATE', 'DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO']
+    """
+    v1_data = read_mirror('GC12', _months, MIRROR_DIRECTORY,
+                          columns = ['CELL_ID', 'LOT_NO', 'TRAY_NO', 'TRAY_POSITION', 'EQUIP_NO', 'MEASURE_DATE', 'DATA_01'],
+                          filters = [('LOT_NO', 'in', _lots)])
+    v2_data = read_mirror('GC13', _months, MIRROR_DIRECTORY, columns = ['CELL_ID', 'EQUIP_NO', 'MEASURE_DATE', 'DATA_02'],
+                          filters = [('CELL_ID', 'in', list(v1_data['CELL_ID']))])
+    cell_data = v1_data.merge(v2_data, on = 'CELL_ID', suffixes = ('_V1', '_V2'))
+    cell_data['DV'] = cell_data['DATA_02'] - cell_data['DATA_01']
+    cell_data['METER'] = cell_data['TRAY_POSITION'].str[1:3].astype(int) % 4
+    cell_data = cell_data.rename(columns = {'MEASURE_DATE_V1' : 'V1_MEASURE_DATE', 'MEASURE_DATE_V2' : 'V2_MEASURE_DATE',
+                                            'EQUIP_NO_V1' : 'V1_MACHINE', 'EQUIP_NO_V2' : 'V2_MACHINE'})
+    return cell_data[['V1_MEASURE_DATE', 'V2_MEASURE_DATE', 'DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO']]
+
+
+
+def compactTypes(data):
+    """ Stores MP and offset data in compact dtypes: categorical machine/tray/lot/line codes, float32 server calculated
+        dV and int8 meters. Raw voltages are left as float64
+
+        Parameters:
+        data (pandas DataFrame): MP or offset data
+
+        Returns:
+        pandas DataFrame: data with compact dtypes (group by the categorical columns with observed = True)
+    """
+    dtypes = {column : 'category' for column in CATEGORY_COLUMNS if column in data.columns}
+    dtypes.update({column : np.float32 for column in FLOAT32_COLUMNS if column in data.columns})
+    if 'METER' in data.columns and data['METER'].notna().all():
+        dtypes['METER'] = np.int8
+    return data.astype(dtypes)
+
+
+
+def mirrorReady(_months):
+    """ Checks if the GC12 & GC13 tables of every given month are available in the local formation mirror
+
+        Parameters:
+        _months (list): table codes
+
+        Returns:
+        bool: True if all tables can be read from the mirror
+    """
+    return all(mirror_ready(process, month, MIRROR_DIRECTORY) for process in ['GC12', 'GC13'] for month in _months)
+
+
+
+def parseSqlList(sql_list):
+    """ Converts a sql list string such as "('L1', 'L2')" or "('L1')" back into a python list
+
+        Parameters:
+        sql_list (str): sql list string
+
+        Returns:
+        list: the values in the sql list
+    """
+    values = ast.literal_eval(sql_list)
+    return [values] if isinstance(values, str) else list(values)
+
+
+
+def sharedResult(key, fxn, *args):
+    """ Runs fxn(*args) once per key per batch. Lots flagged at the same time that need the same result wait for the
+        first lot's call instead of repeating the database work.
+
+        Parameters:
+        key (tuple): identifies the result
+        fxn (function): function that creates the result
+        *args: arguments passed to fxn
+
+        Returns:
+        a copy of the shared result
+    """
+    with _shared_lock:
+        future = _shared_results.get(key)
+        owner = future is None
+        if owner:
+            future = _shared_results[key] = Future()
+    if owner:
+        try:
+            future.set_result(fxn(*args))
+        except Exception as e:
+            with _shared_lock:
+                del _shared_results[key] # failures are not shared, the next caller retries
+            future.set_exception(e)
+    return future.result().copy()
+
+
+
+def clearSharedResults():
+    """ Forgets the results shared between lots. Called at the end of every batch so a long running process does not
+        keep every window and reuses offsets or test lots of windows that have not settled yet; later batches read
+        settled windows from the offset cache instead
+
+        Returns:
+        None
+    """
+    with _shared_lock:
+        _shared_results.clear()
+
+
+
+def sharedTryOffsets(day1, _first_month, _second_month, lines):
+    """ tryOffsets shared between lots; the offset query only depends on the day of day1 and the lines
+
+        Returns:
+        Pandas Dataframe: see tryOffsets
+    """
+    key = line_key(parseSqlList(lines))
+    return sharedResult(('offset', str(day1)[0:10], key), cachedTryOffsets, day1, _first_month, _second_month, lines)
+
+
+
+def cachedTryOffsets(day1, _first_month, _second_month, lines):
+    """ tryOffsets backed by the on-disk offset cache. Settled windows are stored whether or not they gave an offset,
+        so repeat and neighbouring lots resolve them without any database work. Windows of a line set that has not been
+        tried yet are calculated from the tray/meter medians the daily offset job stored for the day
+
+        Returns:
+        Pandas Dataframe: see tryOffsets
+    """
+    end_day, key = str(day1)[0:10], line_key(parseSqlList(lines))
+    offset = get_offset(OFFSET_CACHE, end_day, key)
+    if offset is not None:
+        print('Offset cache hit for ' + end_day + ' ' + key)
+        return offset
+    tray_data = get_daily_trays(OFFSET_CACHE, end_day, parseSqlList(lines))
+    if tray_data is not None:
+        print('Daily offset data hit for ' + end_day + ' ' + key)
+        offset = calculateOffsets(compactTypes(tray_data), day1)
+    else:
+        offset = tryOffsets(day1, _first_month, _second_month, lines)
+    if is_settled(day1):
+        put_offset(OFFSET_CACHE, end_day, key, offset)
+    return offset
+
+
+
+def offsetCacheStats():
+    """ Reads the hit/miss counts of the offset cache
+
+        Returns:
+        pandas DataFrame: see offset_cache.cache_stats
+    """
+    return cache_stats(OFFSET_CACHE)
+
+
+
+def sharedTestLots(day2, lines):
+    """ getTestLots shared between lots; the test lot search only depends on the day of day2 and the lines
+
+        Returns:
+        pandas DataFrame: see getTestLots
+    """
+    return sharedResult(('test_lots', str(day2)[0:10], tuple(lines)), getTestLots, day2, lines)
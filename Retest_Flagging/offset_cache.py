@@ -0,0 +1,253 @@
+"""
+Offset Cache Module
+This program keeps meter offsets on disk so getOffsets does not repeat the GC12/GC13 offset query for windows that have
+already been tried. Offsets are stored by (window end day, line set), including windows known to give no usable offset,
+together with the meter variability verdicts of validate(). Every lookup is counted as a hit or miss.
+The daily offset job (offset_job.py) stores the per tray/meter median dV of every V1/V2 line pair for every day, the
+offset of a line set is then calculated from the rows of its lines, the same rows the on-demand offset query reads.
+
+Notes:
+Only settled windows are stored: a window ending less than SETTLE_DAYS ago may still be missing V2 measurements, so it
+is recomputed until it has settled.
+An empty offset in the cache is a known-invalid window, a missing entry is a miss.
+
+Version Updates:
+v1.0 - Initial release
+v1.1 - Daily job stores tray/meter medians per line pair instead of per line offsets, line set offsets no longer hold
+       duplicate keys and include cells whose V1 and V2 ran on different lines of the set
+"""
+
+import os
+import sqlite3
+import threading
+import pandas as pd
+from datetime import datetime
+
+SETTLE_DAYS = 10
+OFFSET_COLUMNS = ['V1_MACHINE', 'V2_MACHINE', 'METER', 'OFFSET']
+TRAY_COLUMNS = ['MED_TRAY_METER_DV', 'V1_MACHINE', 'V2_MACHINE', 'METER', 'TRAY_NO', 'LOT_NO', 'V1_LINE', 'V2_LINE']
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def open_cache(path: str) -> sqlite3.Connection:
+    """
+    Input: local cache file path
+    Function: opens (and creates if needed) the offset cache store
+    Output: sqlite connection
+    """
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    con = sqlite3.connect(path, timeout=30)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS OFFSET_WINDOWS (
+        END_DAY TEXT NOT NULL,
+        LINES TEXT NOT NULL,
+        VALID INTEGER NOT NULL,
+        CREATED TEXT NOT NULL,
+        PRIMARY KEY (END_DAY, LINES))
+    """)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS OFFSETS (
+        END_DAY TEXT NOT NULL,
+        LINES TEXT NOT NULL,
+        V1_MACHINE TEXT NOT NULL,
+        V2_MACHINE TEXT NOT NULL,
+        METER INTEGER NOT NULL,
+        OFFSET REAL NOT NULL)
+    """)
+    con.execute('CREATE INDEX IF NOT EXISTS OFFSETS_WINDOW ON OFFSETS (END_DAY, LINES)')
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS VERDICTS (
+        END_DAY TEXT NOT NULL,
+        LINES TEXT NOT NULL,
+        TEST_DAY TEXT NOT NULL,
+        PASSED INTEGER NOT NULL,
+        PRIMARY KEY (END_DAY, LINES, TEST_DAY))
+    """)
+    con.execute('CREATE TABLE IF NOT EXISTS CACHE_STATS (KIND TEXT PRIMARY KEY, HITS INTEGER, MISSES INTEGER)')
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS DAILY_TRAYS (
+        END_DAY TEXT NOT NULL,
+        MED_TRAY_METER_DV REAL NOT NULL,
+        V1_MACHINE TEXT NOT NULL,
+        V2_MACHINE TEXT NOT NULL,
+        METER INTEGER NOT NULL,
+        TRAY_NO TEXT NOT NULL,
+        LOT_NO TEXT NOT NULL,
+        V1_LINE TEXT NOT NULL,
+        V2_LINE TEXT NOT NULL)
+    """)
+    con.execute('CREATE INDEX IF NOT EXISTS DAILY_TRAYS_DAY ON DAILY_TRAYS (END_DAY)')
+    con.execute('CREATE TABLE IF NOT EXISTS DAILY_DAYS (END_DAY TEXT PRIMARY KEY, ROW_COUNT INTEGER, CREATED TEXT)')
+    return con
+
+
+def line_key(lines: list) -> str:
+    """
+    Input: formation lines
+    Function: builds an order independent key for a line set
+    Output: line set key, e.g. 'L1,L2'
+    """
+    return ','.join(sorted(set(lines)))
+
+
+def is_settled(day) -> bool:
+    """
+    Input: window end day
+    Function: checks if the window is old enough for its data to be complete
+    Output: boolean indicator if results for the window can be stored
+    """
+    return (datetime.now() - pd.Timestamp(day)).days >= SETTLE_DAYS
+
+
+def record_stat(con: sqlite3.Connection, kind: str, hit: bool):
+    """
+    Input: offset cache connection, lookup kind ('offset', 'daily' or 'verdict') and hit indicator
+    Function: counts a cache lookup for this run and in the persistent totals
+    Output: None
+    """
+    with _stats_lock:
+        hits, misses = _stats.get(kind, (0, 0))
+        _stats[kind] = (hits + hit, misses + (not hit))
+    con.execute('INSERT OR IGNORE INTO CACHE_STATS VALUES (?, 0, 0)', (kind,))
+    con.execute(f"UPDATE CACHE_STATS SET {'HITS = HITS' if hit else 'MISSES = MISSES'} + 1 WHERE KIND = ?", (kind,))
+    con.commit()
+
+
+def get_offset(path: str, end_day: str, lines: str) -> pd.DataFrame():
+    """
+    Input: local cache file path, window end day ('YYYY-MM-DD') and line set key
+    Function: reads a cached offset window
+    Output: cached offsets (empty if the window is known to be invalid), None on a cache miss
+            index: [Default]
+            columns: [V1_MACHINE, V2_MACHINE, METER, OFFSET]
+    """
+    con = open_cache(path)
+    window = con.execute('SELECT VALID FROM OFFSET_WINDOWS WHERE END_DAY = ? AND LINES = ?',
+                         (end_day, lines)).fetchone()
+    record_stat(con, 'offset', window is not None)
+    if window is None:
+        con.close()
+        return None
+    offset = pd.read_sql(f"SELECT {', '.join(OFFSET_COLUMNS)} FROM OFFSETS WHERE END_DAY = ? AND LINES = ?", con,
+                         params=(end_day, lines))
+    con.close()
+    return offset
+
+
+def put_offset(path: str, end_day: str, lines: str, offset: pd.DataFrame()):
+    """
+    Input: local cache file path, window end day ('YYYY-MM-DD'), line set key and offsets of the window
+    Function: stores the offsets of a window, an empty offset marks the window as invalid
+    Output: None
+    """
+    con = open_cache(path)
+    with con:
+        con.execute('DELETE FROM OFFSETS WHERE END_DAY = ? AND LINES = ?', (end_day, lines))
+        con.execute('INSERT OR REPLACE INTO OFFSET_WINDOWS VALUES (?, ?, ?, ?)',
+                    (end_day, lines, int(len(offset) > 0), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        con.executemany('INSERT INTO OFFSETS VALUES (?, ?, ?, ?, ?, ?)',
+                        [(end_day, lines, str(v1), str(v2), int(meter), float(value))
+                         for v1, v2, meter, value in offset[OFFSET_COLUMNS].itertuples(index=False)])
+    con.close()
+
+
+def get_daily_trays(path: str, end_day: str, lines: list) -> pd.DataFrame():
+    """
+    Input: local cache file path, window end day ('YYYY-MM-DD') and formation lines
+    Function: reads the tray/meter medians the daily offset job stored for the day, keeping cells whose V1 and V2 lines
+              are both in the line set (the rows the on-demand offset query returns for the line set)
+    Output: tray/meter medians of the line set, None if the job has not computed the day
+            index: [Default]
+            columns: [MED_TRAY_METER_DV, V1_MACHINE, V2_MACHINE, METER, TRAY_NO, LOT_NO, V1_LINE, V2_LINE]
+    """
+    lines = sorted(set(lines))
+    in_lines = ', '.join('?' * len(lines))
+    con = open_cache(path)
+    done = con.execute('SELECT 1 FROM DAILY_DAYS WHERE END_DAY = ?', (end_day,)).fetchone() is not None
+    record_stat(con, 'daily', done)
+    if not done:
+        con.close()
+        return None
+    tray_data = pd.read_sql(f"""
+    SELECT {', '.join(TRAY_COLUMNS)}
+    FROM DAILY_TRAYS
+    WHERE END_DAY = ? AND V1_LINE IN ({in_lines}) AND V2_LINE IN ({in_lines})
+    """, con, params=(end_day, *lines, *lines))
+    con.close()
+    return tray_data
+
+
+def get_job_days(path: str) -> list[str]:
+    """
+    Input: local cache file path
+    Function: reads the window end days already computed by the daily offset job
+    Output: window end days ('YYYY-MM-DD')
+    """
+    con = open_cache(path)
+    days = [row[0] for row in con.execute('SELECT END_DAY FROM DAILY_DAYS')]
+    con.close()
+    return days
+
+
+def put_job_day(path: str, end_day: str, tray_data: pd.DataFrame()):
+    """
+    Input: local cache file path, window end day ('YYYY-MM-DD') and tray/meter medians of every line pair
+    Function: stores the tray/meter medians of one day and marks the day as done
+    Output: None
+    """
+    con = open_cache(path)
+    with con:
+        con.execute('DELETE FROM DAILY_TRAYS WHERE END_DAY = ?', (end_day,))
+        con.executemany(f'INSERT INTO DAILY_TRAYS VALUES (?, {", ".join("?" * len(TRAY_COLUMNS))})',
+                        [(end_day, float(dv), str(v1), str(v2), int(meter), str(tray), str(lot), str(v1_line),
+                          str(v2_line))
+                         for dv, v1, v2, meter, tray, lot, v1_line, v2_line
+                         in tray_data[TRAY_COLUMNS].itertuples(index=False)])
+        con.execute('INSERT OR REPLACE INTO DAILY_DAYS VALUES (?, ?, ?)',
+                    (end_day, len(tray_data), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    con.close()
+
+
+def get_verdict(path: str, end_day: str, lines: str, test_day: str) -> bool:
+    """
+    Input: local cache file path, offset window end day, line set key and test lot day ('YYYY-MM-DD')
+    Function: reads a cached meter variability verdict
+    Output: boolean verdict, None on a cache miss
+    """
+    con = open_cache(path)
+    verdict = con.execute('SELECT PASSED FROM VERDICTS WHERE END_DAY = ? AND LINES = ? AND TEST_DAY = ?',
+                          (end_day, lines, test_day)).fetchone()
+    record_stat(con, 'verdict', verdict is not None)
+    con.close()
+    return None if verdict is None else bool(verdict[0])
+
+
+def put_verdict(path: str, end_day: str, lines: str, test_day: str, passed: bool):
+    """
+    Input: local cache file path, offset window end day, line set key, test lot day and verdict
+    Function: stores a meter variability verdict
+    Output: None
+    """
+    con = open_cache(path)
+    with con:
+        con.execute('INSERT OR REPLACE INTO VERDICTS VALUES (?, ?, ?, ?)', (end_day, lines, test_day, int(passed)))
+    con.close()
+
+
+def cache_stats(path: str) -> pd.DataFrame():
+    """
+    Input: local cache file path
+    Function: reads the cache hit/miss counts of this run and of all runs
+    Output: cache statistics
+            index: [KIND]
+            columns: [RUN_HITS, RUN_MISSES, TOTAL_HITS, TOTAL_MISSES]
+    """
+    con = open_cache(path)
+    totals = pd.read_sql('SELECT KIND, HITS AS TOTAL_HITS, MISSES AS TOTAL_MISSES FROM CACHE_STATS', con,
+                         index_col='KIND')
+    con.close()
+    with _stats_lock:
+        run = pd.DataFrame.from_dict(_stats, orient='index', columns=['RUN_HITS', 'RUN_MISSES'])
+    return run.join(totals, how='outer').fillna(0).astype(int)
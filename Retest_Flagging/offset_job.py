@@ -0,0 +1,85 @@
+"""
+Offset Job Module
+This program precomputes meter offset data once a day so flagging runs look offsets up instead of deriving them on
+demand. For every settled day it runs the tryOffsets query for all lines at once and stores the per tray/meter median
+dV of every V1/V2 line pair of the 2 day window ending on that day in the offset cache. The offset of any line set is
+calculated from these rows with the same calculation as tryOffsets.
+
+Usage:
+python offset_job.py                            computes the days that are missing from the offset cache
+python offset_job.py --check 2022-11-20 L1 L2   compares the on-demand offset of a line set with the offset calculated
+                                                from the stored day
+
+Notes:
+Days younger than offset_cache.SETTLE_DAYS are skipped until their V2 data is complete, flagging derives those windows
+on demand.
+
+Version Updates:
+v1.0 - Initial release
+v1.1 - Tray/meter medians stored per line pair instead of per line offsets, --check compares a day with tryOffsets
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from offset import getDailyOffsetData, tryOffsets, calculateOffsets, compactTypes, getMonths
+from offset_cache import SETTLE_DAYS, get_job_days, put_job_day, get_daily_trays
+
+JOB_DAYS = 45  # days kept in the offset table, getOffsets searches up to ~2 weeks before a lot's V1 date
+OFFSET_KEYS = ['V1_MACHINE', 'V2_MACHINE', 'METER']
+
+
+def run_offset_job(path: str, days: int = JOB_DAYS):
+    """
+    Input: local offset cache file path and number of days to keep computed
+    Function: stores the tray/meter medians of every settled window end day that has not been computed yet
+    Output: None
+    """
+    done = set(get_job_days(path))
+    last_day = pd.Timestamp(datetime.now().date()) - pd.Timedelta(days=SETTLE_DAYS)
+    for day in pd.date_range(last_day - pd.Timedelta(days=days - 1), last_day):
+        end_day = str(day)[0:10]
+        if end_day in done:
+            continue
+        start = datetime.now()
+        tray_data = getDailyOffsetData(day)
+        put_job_day(path, end_day, tray_data)
+        print(f'offset data {end_day}: {len(tray_data)} tray/meter rows', datetime.now() - start)
+
+
+def check_day(path: str, end_day: str, lines: list[str]) -> pd.DataFrame():
+    """
+    Input: local offset cache file path, window end day ('YYYY-MM-DD') computed by the job and formation lines
+    Function: calculates the line set's offset on demand with tryOffsets and from the stored day and compares them
+    Output: offsets of both calculations per key (DIFF is NaN for keys found by only one of them)
+            index: [Default]
+            columns: [V1_MACHINE, V2_MACHINE, METER, ON_DEMAND, DAILY, DIFF]
+    """
+    day1 = pd.Timestamp(end_day)
+    tray_data = get_daily_trays(path, end_day, lines)
+    if tray_data is None:
+        raise ValueError(f'{end_day} has not been computed by the offset job')
+    daily = calculateOffsets(compactTypes(tray_data), day1)
+    on_demand = tryOffsets(day1, *getMonths(day1), str(tuple(lines)).replace(',)', ')'))
+    comparison = pd.merge(on_demand.astype({'V1_MACHINE': str, 'V2_MACHINE': str, 'METER': int}),
+                          daily.astype({'V1_MACHINE': str, 'V2_MACHINE': str, 'METER': int}),
+                          on=OFFSET_KEYS, how='outer', suffixes=('_ON_DEMAND', '_DAILY'))
+    comparison = comparison.rename(columns={'OFFSET_ON_DEMAND': 'ON_DEMAND', 'OFFSET_DAILY': 'DAILY'})
+    comparison['DIFF'] = comparison.DAILY - comparison.ON_DEMAND
+    matched = comparison.DIFF.notna() & np.isclose(comparison.DAILY, comparison.ON_DEMAND, rtol=0, atol=1e-9)
+    print(f'{end_day} {lines}: {len(on_demand)} on demand keys, {len(daily)} daily keys, '
+          f'{len(comparison) - matched.sum()} keys differ, max diff {comparison.DIFF.abs().max()}')
+    return comparison
+
+
+if __name__ == '__main__':
+    from retest_flagging.config import OFFSET_CACHE
+    parser = argparse.ArgumentParser(description='precompute meter offset data for every settled day')
+    parser.add_argument('--check', nargs='+', metavar=('END_DAY', 'LINE'),
+                        help='compare the on-demand offset of the lines with the stored day')
+    args = parser.parse_args()
+    if args.check:
+        print(check_day(OFFSET_CACHE, args.check[0], args.check[1:]))
+    else:
+        run_offset_job(OFFSET_CACHE)
@@ -0,0 +1,5 @@
+"""
+Retest Flagging Shared Modules
+Configuration, database access (session pools, query executor, partition router, replay), cell ID decoding, dQ/dV
+curves and local caches used by the flagging scripts in Retest_Flagging and by impingement/impingement.py.
+"""
@@ -0,0 +1,102 @@
+"""
+Assembly Cache Module
+This program keeps the separator type and average JRD of every looked up cell in a local SQLite file. Assembly
+attributes never change once a cell is built, so cells are only queried from the database the first time they are
+seen and re-flagging a lot (or building its chargeback table) needs no assembly queries.
+
+Notes:
+Cells with a missing separator or JRD (including cells found in neither table) are stored too, but expire after
+INCOMPLETE_DAYS so late assembly uploads are picked up. Complete entries never expire.
+Lookups go through a temporary table so any number of cells can be read with one statement.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import sqlite3
+import pandas as pd
+from datetime import datetime, timedelta
+
+INCOMPLETE_DAYS = 7
+ASSEMBLY_COLUMNS = ['CELL_ID', 'SEPARATOR', 'AVG_JRD']
+
+
+def open_cache(path: str) -> sqlite3.Connection:
+    """
+    Input: local cache file path
+    Function: opens (and creates if needed) the assembly cache store
+    Output: sqlite connection
+    """
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    con = sqlite3.connect(path, timeout=30)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS ASSEMBLY (
+        CELL_ID TEXT PRIMARY KEY,
+        SEPARATOR TEXT,
+        AVG_JRD REAL,
+        FETCHED TEXT NOT NULL)
+    """)
+    return con
+
+
+def get_cells(path: str, cell_ids: list) -> pd.DataFrame():
+    """
+    Input: local cache file path and cell IDs
+    Function: reads the cached assembly attributes of the cells, expired incomplete entries are left out
+    Output: cached cells (cells missing from the result are cache misses)
+            index: [Default]
+            columns: [CELL_ID, SEPARATOR, AVG_JRD]
+    """
+    expired = (datetime.now() - timedelta(days=INCOMPLETE_DAYS)).isoformat()
+    con = open_cache(path)
+    con.execute('CREATE TEMP TABLE LOOKUP (CELL_ID TEXT PRIMARY KEY)')
+    con.executemany('INSERT OR IGNORE INTO LOOKUP VALUES (?)', [(cell_id,) for cell_id in cell_ids])
+    cells = pd.read_sql("""
+    SELECT a.CELL_ID, a.SEPARATOR, a.AVG_JRD
+    FROM LOOKUP l INNER JOIN ASSEMBLY a ON a.CELL_ID = l.CELL_ID
+    WHERE (a.SEPARATOR IS NOT NULL AND a.AVG_JRD IS NOT NULL) OR a.FETCHED >= ?
+    """, con, params=(expired,))
+    con.close()
+    return cells
+
+
+def put_cells(path: str, cells: pd.DataFrame()):
+    """
+    Input: local cache file path and assembly attributes (columns CELL_ID, SEPARATOR, AVG_JRD)
+    Function: stores the assembly attributes of the cells, replacing older entries
+    Output: None
+    """
+    cells = cells[ASSEMBLY_COLUMNS].astype(object)
+    cells = cells.where(cells.notna(), None)
+    now = datetime.now().isoformat()
+    con = open_cache(path)
+    with con:
+        con.executemany('INSERT OR REPLACE INTO ASSEMBLY VALUES (?, ?, ?, ?)',
+                        [(cell_id, separator, None if jrd is None else float(jrd), now)
+                         for cell_id, separator, jrd in cells.itertuples(index=False)])
+    con.close()
+
+
+def cached_assembly_data(path: str, cell_ids: list, fetch) -> pd.DataFrame():
+    """
+    Input: local cache file path, cell IDs and function fetching cache misses from the database (called as
+           fetch(cell_list) with a CELL_ID column, returns columns CELL_ID, SEPARATOR, AVG_JRD)
+    Function: reads the cells from the cache and fetches and stores only the misses
+    Output: assembly attributes of the cells (one row per cell)
+            index: [Default]
+            columns: [CELL_ID, SEPARATOR, AVG_JRD]
+    """
+    cell_ids = list(dict.fromkeys(cell_ids))
+    cached = get_cells(path, cell_ids)
+    missing = pd.DataFrame({'CELL_ID': list(set(cell_ids) - set(cached.CELL_ID))})
+    print(f'assembly cache: {len(cached)} hits, {len(missing)} misses')
+    if len(missing) == 0:
+        return cached
+    fetched = fetch(missing)[ASSEMBLY_COLUMNS].drop_duplicates(subset='CELL_ID')
+    # cells found in neither table are stored as incomplete entries as well
+    fetched = missing.merge(fetched, on='CELL_ID', how='left')
+    fetched['AVG_JRD'] = pd.to_numeric(fetched.AVG_JRD)
+    put_cells(path, fetched)
+    return pd.concat([cached, fetched], ignore_index=True)
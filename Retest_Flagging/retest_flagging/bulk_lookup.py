@@ -0,0 +1,61 @@
+"""
+Bulk Lookup Module
+This program looks up cell data for large cell ID lists by binding the IDs as one Oracle collection and joining it
+server-side, instead of rendering 999-element IN (...) lists into the sql text. Every batch runs the same statement
+text, so it is parsed once and reused from the shared pool.
+
+Notes:
+Queries join the bound list through CELL_ID_JOIN, e.g.
+    SELECT t.CELL_ID, t.DATA_01 FROM GEIS.T_CELL_ENG_GC13_2210 t {CELL_ID_JOIN}
+SYS.ODCIVARCHAR2LIST holds at most 32767 values, larger lists are split into batches of that size.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import pandas as pd
+import cx_Oracle
+from retest_flagging.db_pool import connection, read_sql
+from retest_flagging.db_replay import replay_active
+
+ID_LIST_TYPE = 'SYS.ODCIVARCHAR2LIST'
+ID_LIST_MAX = 32767
+CELL_ID_JOIN = 'INNER JOIN (SELECT /*+ CARDINALITY(ids 10000) */ COLUMN_VALUE AS ID FROM TABLE(:cell_ids) ids) ids ' \
+               'ON ids.ID = t.CELL_ID'
+
+
+def bind_id_list(con: cx_Oracle.Connection, ids: list) -> cx_Oracle.Object:
+    """
+    Input: database connection and list of IDs
+    Function: builds an Oracle collection that can be bound to a query
+    Output: SYS.ODCIVARCHAR2LIST collection (plain list while replaying recorded queries)
+    """
+    if replay_active():
+        return list(ids)
+    return con.gettype(ID_LIST_TYPE).newobject(list(ids))
+
+
+def read_sql_cells(query: str, con: cx_Oracle.Connection, cell_ids: list, params: dict = None) -> pd.DataFrame():
+    """
+    Input: sql query joining :cell_ids (see CELL_ID_JOIN), database connection, cell IDs and other bind parameters
+    Function: runs the query for every cell ID with one statement per ID_LIST_MAX cells
+    Output: query results for all cells
+    """
+    cell_ids = list(dict.fromkeys(cell_ids))  # duplicate IDs would duplicate joined rows
+    data = [read_sql(query, con, params={**(params or {}),
+                                            'cell_ids': bind_id_list(con, cell_ids[i:i + ID_LIST_MAX])})
+            for i in range(0, len(cell_ids), ID_LIST_MAX)]
+    if len(data) == 0:
+        return read_sql(query, con, params={**(params or {}), 'cell_ids': bind_id_list(con, [])})
+    return pd.concat(data, ignore_index=True)
+
+
+def pool_cell_query(job: tuple, db: dict, tier: str) -> pd.DataFrame():
+    """
+    Input: (sql query, cell IDs), database credentials and database tier ('mes' or 'cold')
+    Function: runs read_sql_cells on a pooled session
+    Output: query results
+    """
+    query, cell_ids = job
+    with connection(db, tier) as con:
+        return read_sql_cells(query, con, cell_ids)
@@ -0,0 +1,79 @@
+"""
+Cell ID Module
+This program decodes assembly information from cell IDs for a whole column at once. Characters 5-7 of the cell ID hold
+the assembly year, month and day and character 16 holds the cell model. Decoding is done with lookup tables indexed by
+the raw bytes of the IDs instead of per-row dictionary lookups.
+
+Notes:
+Characters that are not part of the code map decode to None (yymm, model) or NaT (assembly date).
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import numpy as np
+import pandas as pd
+
+cell_id_dict = {'1': '01', '2': '02', '3': '03', '4': '04', '5': '05', '6': '06', '7': '07', '8': '08', '9': '09',
+                'A': '10', 'B': '11', 'C': '12', 'D': '13', 'E': '14', 'F': '15', 'G': '16', 'H': '17', 'J': '18',
+                'K': '19', 'L': '20', 'M': '21', 'N': '22', 'P': '23', 'Q': '24', 'R': '25', 'S': '26', 'T': '27',
+                'U': '28', 'V': '29', 'W': '30', 'X': '31', 'Y': '32', 'Z': '33'}
+model_dict = {'1': 'BR', '2': 'AR', '4': 'DR', '5': 'C2', '6': 'L1', 'D': 'LA'}
+CELL_ID_LENGTH = 16
+YEAR_POS, MONTH_POS, DAY_POS, MODEL_POS = 4, 5, 6, 15  # 0-based character positions
+
+# byte value -> decoded number (-1 if not a code character)
+_NUMBER_LUT = np.full(256, -1, dtype=np.int16)
+for _char, _number in cell_id_dict.items():
+    _NUMBER_LUT[ord(_char)] = int(_number)
+# byte value -> model name (None if not a model character)
+_MODEL_LUT = np.full(256, None, dtype=object)
+for _char, _model in model_dict.items():
+    _MODEL_LUT[ord(_char)] = _model
+
+
+def _to_bytes(cell_ids: pd.Series) -> np.ndarray:
+    """
+    Input: cell IDs
+    Function: converts cell IDs into a fixed-width byte matrix
+    Output: uint8 array, one row per cell and one column per character
+    """
+    raw = np.asarray(cell_ids.fillna(''), dtype=f'S{CELL_ID_LENGTH}')
+    return raw.view(np.uint8).reshape(len(raw), CELL_ID_LENGTH)
+
+
+def decode_yymm(cell_ids: pd.Series) -> pd.Series:
+    """
+    Input: cell IDs
+    Function: decodes the assembly year & month
+    Output: assembly yymm per cell (same index as the input)
+    """
+    raw = _to_bytes(cell_ids)
+    year = _NUMBER_LUT[raw[:, YEAR_POS]]
+    month = _NUMBER_LUT[raw[:, MONTH_POS]]
+    code = np.where((year < 0) | (month < 0), -1, year.astype(np.int32) * 100 + month)
+    labels = {c: f'{c:04d}' if c >= 0 else None for c in np.unique(code)}
+    return pd.Series(code, index=cell_ids.index).map(labels)
+
+
+def decode_assembly_date(cell_ids: pd.Series) -> pd.Series:
+    """
+    Input: cell IDs
+    Function: decodes the full assembly date
+    Output: assembly date per cell (same index as the input)
+    """
+    raw = _to_bytes(cell_ids)
+    parts = _NUMBER_LUT[raw[:, [YEAR_POS, MONTH_POS, DAY_POS]]].astype(np.float64)
+    parts[(parts < 0).any(axis=1)] = np.nan
+    dates = pd.DataFrame({'year': 2000 + parts[:, 0], 'month': parts[:, 1], 'day': parts[:, 2]})
+    return pd.Series(pd.to_datetime(dates, errors='coerce').values, index=cell_ids.index)
+
+
+def decode_model(cell_ids: pd.Series) -> pd.Series:
+    """
+    Input: cell IDs
+    Function: decodes the cell model from character 16
+    Output: cell model per cell (same index as the input)
+    """
+    raw = _to_bytes(cell_ids)
+    return pd.Series(_MODEL_LUT[raw[:, MODEL_POS]], index=cell_ids.index)
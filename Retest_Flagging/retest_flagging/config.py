@@ -0,0 +1,98 @@
+"""
+Configuration Module
+This program holds the settings shared by the retest flagging scripts. Spec constants and file locations are plain
+values, reference data (database credentials, table months, dQdV curves) is loaded by the get_* functions the first
+time it is needed and cached for the rest of the process, so importing config does no file reads.
+
+Notes:
+get_mm_ref is cached per current month, a long running service picks up new table months.
+Credentials are read from DB_CONFIG, db_info is used when that file does not exist.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import configparser
+from datetime import datetime
+from functools import lru_cache
+from dateutil.relativedelta import relativedelta
+from retest_flagging.dq_curve import load_curves
+
+db_info = {'mes_user': 'PENAENG',
+           'mes_pw': 'p6bru@aXE=am',
+           'mes_dsn': '10.133.200.175/GEISDB.WORLD',
+           'cold_user': 'kwang',
+           'cold_pw': 'XV7A6GneRC2a',
+           'cold_dsn': '10.133.200.174:1521/colddb.america.gds.panasonic.com'
+           }
+DB_CONFIG = r'C:\Users\KW38770\Documents\WangK\Scripts\gitlab\db_cfg.ini'
+FIRST_MONTH = datetime(2020, 8, 1)  # first formation table month
+volt_spec = 2.5
+ndv_spec = -0.5
+rshort_spec = 89e3
+dv_offset = -0.00009763
+dv_coefficient = -0.00303104
+model_number = 'L1'
+DQ_CURVE_FILES = {'L1': r'C:\Users\KW38770\Documents\WangK\Formation\Retest\21L dqdv\dq_curve.csv'}
+DIRECTORY = r'C:\Users\KW38770\Documents\WangK\Formation\Retest\Processing_v3'
+MIRROR_DIRECTORY = rf'{DIRECTORY}\formation_mirror'
+OFFSET_CACHE = rf'{DIRECTORY}\offset_cache.db'
+ASSEMBLY_CACHE = rf'{DIRECTORY}\assembly_cache.db'
+LOT_INDEX = rf'{DIRECTORY}\lot_index.db'
+SUMMARY_STORE = rf'{DIRECTORY}\summary.db'
+LOT_TRACKER = rf'{DIRECTORY}\lot_tracker.db'
+BATCH_WORKERS = 4
+SERVICE_POLL = 300  # seconds
+SCAN_OVERLAP = 60  # minutes rescanned before the high-water mark for late inserts
+
+
+@lru_cache(maxsize=None)
+def get_db_info() -> dict:
+    """
+    Input: None
+    Function: reads the MES and cold database credentials once per process
+    Output: database configuration settings
+    """
+    if not os.path.exists(DB_CONFIG):
+        return db_info
+    parser = configparser.ConfigParser()
+    parser.read(DB_CONFIG)
+    return {'mes_user': parser['MES_DB']['user'],
+            'mes_pw': parser['MES_DB']['password'],
+            'mes_dsn': parser['MES_DB']['dsn'],
+            'cold_user': parser['COLD_DB']['user'],
+            'cold_pw': parser['COLD_DB']['password'],
+            'cold_dsn': parser['COLD_DB']['dsn']
+            }
+
+
+@lru_cache(maxsize=None)
+def _mm_ref(current_month: str) -> tuple:
+    """
+    Input: current month (yymm)
+    Function: lists the formation table months from FIRST_MONTH up to (excluding) the current month
+    Output: table months (yymm)
+    """
+    now = datetime.strptime(current_month, '%y%m')
+    db_mon = 12 * (now.year - FIRST_MONTH.year) + (now.month - FIRST_MONTH.month)
+    return tuple((FIRST_MONTH + relativedelta(months=x)).strftime('%y%m') for x in range(db_mon))
+
+
+def get_mm_ref() -> tuple:
+    """
+    Input: None
+    Function: lists the formation table months, computed once per month
+    Output: table months (yymm)
+    """
+    return _mm_ref(datetime.now().strftime('%y%m'))
+
+
+@lru_cache(maxsize=None)
+def get_dq_curves() -> dict:
+    """
+    Input: None
+    Function: reads the dQdV curve of every model in DQ_CURVE_FILES once per process
+    Output: curve registry (see dq_curve.load_curves)
+    """
+    return load_curves(DQ_CURVE_FILES)
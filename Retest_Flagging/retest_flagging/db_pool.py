@@ -0,0 +1,153 @@
+"""
+Database Pool Module
+This program manages one Oracle session pool per database (MES and cold) for the whole process. Data access functions
+borrow a session with connection(db, tier) and return it to the pool when done, instead of opening a new connection
+for every query.
+
+Notes:
+Pools are created on first use and closed at interpreter exit. Sessions idle for longer than PING_INTERVAL seconds are
+pinged on acquire so dead sessions are replaced instead of handed out.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import atexit
+import threading
+import pandas as pd
+import cx_Oracle
+from contextlib import contextmanager
+from retest_flagging.instrumentation import record_query
+from retest_flagging.db_replay import fetch, replay_active, ReplayConnection
+
+POOL_MIN = 1
+POOL_MAX = 12
+POOL_INCREMENT = 1
+PING_INTERVAL = 60  # seconds
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(db: dict, tier: str) -> cx_Oracle.SessionPool:
+    """
+    Input: database credentials and database tier ('mes' or 'cold')
+    Function: returns the process-wide session pool for the tier, creating it on first use
+    Output: session pool
+    """
+    key = (db[f'{tier}_user'], db[f'{tier}_dsn'])
+    with _pool_lock:
+        if key not in _pools:
+            print(f'creating {tier} session pool ({POOL_MIN}-{POOL_MAX})')
+            _pools[key] = cx_Oracle.SessionPool(user=db[f'{tier}_user'],
+                                                password=db[f'{tier}_pw'],
+                                                dsn=db[f'{tier}_dsn'],
+                                                min=POOL_MIN,
+                                                max=POOL_MAX,
+                                                increment=POOL_INCREMENT,
+                                                threaded=True,
+                                                getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT,
+                                                ping_interval=PING_INTERVAL)
+        return _pools[key]
+
+
+@contextmanager
+def connection(db: dict, tier: str) -> cx_Oracle.Connection:
+    """
+    Input: database credentials and database tier ('mes' or 'cold')
+    Function: borrows a session from the tier pool and releases it on exit
+    Output: database connection
+    """
+    if replay_active():  # queries are served from recorded fixtures, see db_replay
+        yield ReplayConnection()
+        return
+    pool = get_pool(db, tier)
+    con = pool.acquire()
+    healthy = True
+    try:
+        yield con
+    except Exception:
+        healthy = is_alive(con)
+        raise
+    finally:
+        # a dead session is dropped instead of being handed out again
+        if healthy:
+            pool.release(con)
+        else:
+            pool.drop(con)
+
+
+def is_alive(con: cx_Oracle.Connection) -> bool:
+    """
+    Input: database connection
+    Function: pings the session
+    Output: boolean indicator if the session is usable
+    """
+    try:
+        con.ping()
+        return True
+    except cx_Oracle.Error:
+        return False
+
+
+def read_sql(query: str, con, **kwargs) -> pd.DataFrame():
+    """
+    Input: sql query, database connection and pd.read_sql keyword arguments
+    Function: runs the query with pd.read_sql (or records / replays it, see db_replay) and counts it in the current
+              instrumentation span
+    Output: query results
+    """
+    data = fetch(query, kwargs.get('params'), lambda: pd.read_sql(query, con, **kwargs))
+    record_query(len(data))
+    return data
+
+
+def pool_query(query: str, db: dict, tier: str) -> pd.DataFrame():
+    """
+    Input: sql query, database credentials and database tier ('mes' or 'cold')
+    Function: runs a single query on a pooled session
+    Output: query results
+    """
+    with connection(db, tier) as con:
+        return read_sql(query, con)
+
+
+def check_pools() -> dict:
+    """
+    Input: None
+    Function: pings one session of every open pool
+    Output: pool health by dsn
+    """
+    health = {}
+    with _pool_lock:
+        pools = dict(_pools)
+    for (user, dsn), pool in pools.items():
+        try:
+            con = pool.acquire()
+        except cx_Oracle.Error as e:
+            health[dsn] = {'ok': False, 'error': str(e)}
+            continue
+        alive = is_alive(con)
+        if alive:
+            pool.release(con)
+        else:
+            pool.drop(con)
+        health[dsn] = {'ok': alive, 'open': pool.opened, 'busy': pool.busy}
+    return health
+
+
+def close_pools():
+    """
+    Input: None
+    Function: closes every open pool and its sessions
+    Output: None
+    """
+    with _pool_lock:
+        for pool in _pools.values():
+            try:
+                pool.close(force=True)
+            except cx_Oracle.Error:
+                pass
+        _pools.clear()
+
+
+atexit.register(close_pools)
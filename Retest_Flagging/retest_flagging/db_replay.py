@@ -0,0 +1,117 @@
+"""
+Database Replay Module
+This program records the result of every database query of a run into local fixture files and replays them later
+without MES or cold database access, so the flagging pipeline can be benchmarked and regression tested offline.
+Replayed queries can be slowed down to a multiple of their recorded time to imitate the database.
+
+Notes:
+All reads go through db_pool.read_sql or stream_fetch.stream_sql, which call fetch(). In replay mode db_pool.connection
+hands out a ReplayConnection instead of a pooled session and bulk_lookup binds cell ID lists as plain lists.
+Fixtures are keyed by the query text (whitespace normalized) and its bind parameters. Queries built from the current
+date (table months, tiers) only match fixtures recorded in the same month.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+from datetime import datetime
+
+_mode = None
+_directory = None
+_latency = 0.0
+_index_lock = threading.Lock()
+
+
+class ReplayConnection:
+    """
+    Stand-in for a database session while replaying, queries never reach it
+    """
+    def cursor(self):
+        raise RuntimeError('replayed queries must go through db_replay.fetch')
+
+
+def set_mode(mode: str, directory: str = None, latency: float = 0.0):
+    """
+    Input: 'record', 'replay' or None (live database), fixture directory and replay latency as a multiple of the
+           recorded query time (0 replays instantly)
+    Function: switches how every database read of the process is served
+    Output: None
+    """
+    global _mode, _directory, _latency
+    if mode not in (None, 'record', 'replay'):
+        raise ValueError(f'unknown database mode {mode}')
+    if mode is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _mode, _directory, _latency = mode, directory, latency
+    print(f'database mode: {mode or "live"}', directory or '')
+
+
+def replay_active() -> bool:
+    """
+    Input: None
+    Function: checks if database reads are served from fixtures
+    Output: boolean indicator if replay mode is on
+    """
+    return _mode == 'replay'
+
+
+def canonical(value):
+    """
+    Input: bind parameter value
+    Function: converts a bind value into a stable json value (collections become sorted lists)
+    Output: json serializable value
+    """
+    if hasattr(value, 'aslist'):  # cx_Oracle collection
+        value = value.aslist()
+    if isinstance(value, (list, tuple, set)):
+        return sorted(str(v) for v in value)
+    if isinstance(value, dict):
+        return {k: canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value if isinstance(value, (int, float, str)) or value is None else str(value)
+
+
+def query_key(query: str, params) -> str:
+    """
+    Input: sql query and bind parameters
+    Function: builds the fixture key of a query
+    Output: sha1 hex digest
+    """
+    text = ' '.join(query.split()) + json.dumps(canonical(params) if params is not None else None)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def fetch(query: str, params, run) -> pd.DataFrame():
+    """
+    Input: sql query, bind parameters and function that runs the query against the database
+    Function: runs the query (live), runs and saves it (record) or loads the saved result (replay)
+    Output: query results
+    """
+    if _mode is None:
+        return run()
+    key = query_key(query, params)
+    path = os.path.join(_directory, f'{key}.pkl')
+    if _mode == 'record':
+        start = time.perf_counter()
+        data = run()
+        elapsed = time.perf_counter() - start
+        pd.to_pickle({'query': query, 'params': canonical(params) if params is not None else None,
+                      'elapsed': elapsed, 'data': data}, path)
+        with _index_lock:
+            with open(os.path.join(_directory, 'index.jsonl'), 'a') as f:
+                f.write(json.dumps({'key': key, 'rows': len(data), 'elapsed': round(elapsed, 3),
+                                    'query': ' '.join(query.split())[:200]}) + '\n')
+        return data
+    if not os.path.exists(path):
+        raise KeyError(f'no recorded result for query {key}: {" ".join(query.split())[:200]}')
+    fixture = pd.read_pickle(path)
+    if _latency:
+        time.sleep(fixture['elapsed'] * _latency)
+    return fixture['data'].copy()
@@ -0,0 +1,99 @@
+"""
+dQdV Curve Module
+This program keeps the dQdV reference curve of every cell model. Each curve gets a uniform voltage grid (bucket table)
+that stores which curve segment every grid step starts in, so the dQdV of a voltage is found by computing its grid
+position instead of searching the curve's voltages. All curves are stored back to back in one array, which lets lots
+with several cell models be looked up in a single vectorized pass.
+
+Notes:
+The result is identical to np.interp on the original curve: a voltage is moved from the segment of its grid step to
+the following segments while it lies past their end, at most MAX_STEPS times (the most curve points in one grid step).
+Voltages outside a model's curve get OUT_OF_RANGE (the np.interp left/right value used before), cells of a model
+without a curve (or without a voltage) get NaN and are coded 900X by the dQ model rules.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import numpy as np
+import pandas as pd
+
+GRID_STEP = 0.001  # V
+OUT_OF_RANGE = 1e-9
+
+
+def bucket_curve(voltage: np.ndarray, step: float = GRID_STEP) -> (np.ndarray, int):
+    """
+    Input: increasing curve voltages and grid step
+    Function: finds the curve segment every grid step of the curve's voltage range starts in
+    Output: segment index per grid step and most curve points within one grid step
+    """
+    edges = voltage[0] + step * np.arange(int(np.ceil((voltage[-1] - voltage[0]) / step)) + 1)
+    buckets = np.clip(np.searchsorted(voltage, edges, side='right') - 1, 0, len(voltage) - 2)
+    max_steps = int(np.diff(np.append(buckets, len(voltage) - 2)).max(initial=0)) + 1
+    return buckets, max_steps
+
+
+def load_curves(curve_files: dict) -> dict:
+    """
+    Input: dQdV curve csv file per cell model
+    Function: reads every model's curve and builds its bucket table into one lookup registry
+    Output: curve registry
+            keys: [MODELS, START, END, BUCKET_START, V_MIN, V_MAX, VOLTAGE, DQDV, BUCKETS, STEP, MAX_STEPS]
+    """
+    registry = {'MODELS': [], 'START': [], 'END': [], 'BUCKET_START': [], 'V_MIN': [], 'V_MAX': []}
+    voltages, dqdvs, bucket_tables = [], [], []
+    position, bucket_position, max_steps = 0, 0, 1
+    for model, path in curve_files.items():
+        curve = pd.read_csv(path).sort_values('Voltage')
+        voltage, dqdv = curve.Voltage.to_numpy(np.float64), curve.dQdV.to_numpy(np.float64)
+        buckets, steps = bucket_curve(voltage)
+        for key, value in zip(registry, [model, position, position + len(voltage), bucket_position,
+                                         voltage[0], voltage[-1]]):
+            registry[key].append(value)
+        voltages.append(voltage)
+        dqdvs.append(dqdv)
+        bucket_tables.append(buckets + position)
+        position += len(voltage)
+        bucket_position += len(buckets)
+        max_steps = max(max_steps, steps)
+    print(f'dQdV curves loaded: {registry["MODELS"]}')
+    registry = {key: (np.array(values) if key != 'MODELS' else values) for key, values in registry.items()}
+    registry.update(VOLTAGE=np.concatenate(voltages) if voltages else np.empty(0),
+                    DQDV=np.concatenate(dqdvs) if dqdvs else np.empty(0),
+                    BUCKETS=np.concatenate(bucket_tables) if bucket_tables else np.empty(0, dtype=np.int64),
+                    STEP=GRID_STEP, MAX_STEPS=max_steps)
+    return registry
+
+
+def lookup_dqdv(curves: dict, models: pd.Series, voltages: pd.Series) -> np.ndarray:
+    """
+    Input: curve registry, cell model per cell and voltage per cell
+    Function: finds the dQdV of every cell on its model's curve in one vectorized pass
+    Output: dQdV per cell (OUT_OF_RANGE outside the curve, NaN for models without a curve or voltage)
+    """
+    model_index = pd.Categorical(models, categories=curves['MODELS']).codes
+    known = model_index >= 0
+    dqdv = np.full(len(model_index), np.nan)
+    if not known.any():
+        return dqdv
+    model_index = model_index[known]
+    v = np.asarray(voltages, dtype=np.float64)[known]
+    v_min, v_max = curves['V_MIN'][model_index], curves['V_MAX'][model_index]
+    in_range = (v >= v_min) & (v <= v_max)  # False for NaN voltages
+    bucket_count = np.diff(np.append(curves['BUCKET_START'], len(curves['BUCKETS'])))[model_index]
+    bucket = np.clip(np.floor(np.where(in_range, (v - v_min) / curves['STEP'], 0)).astype(np.int64), 0,
+                     bucket_count - 1)
+    segment = curves['BUCKETS'][curves['BUCKET_START'][model_index] + bucket]
+    last_segment = curves['END'][model_index] - 2
+    x = curves['VOLTAGE']
+    for _ in range(curves['MAX_STEPS']):
+        advance = (segment < last_segment) & (v > x[segment + 1])
+        if not advance.any():
+            break
+        segment = segment + advance
+    x0, x1 = x[segment], x[segment + 1]
+    y0, y1 = curves['DQDV'][segment], curves['DQDV'][segment + 1]
+    values = y0 + (v - x0) * np.divide(y1 - y0, x1 - x0, out=np.zeros_like(v), where=x1 != x0)
+    dqdv[known] = np.where(in_range, values, np.where(np.isnan(v), np.nan, OUT_OF_RANGE))
+    return dqdv
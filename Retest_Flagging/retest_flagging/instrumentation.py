@@ -0,0 +1,131 @@
+"""
+Instrumentation Module
+This program records where a flagging run spends its time. Every lot gets a trace with one span per pipeline stage
+holding the wall time, number of database queries, rows fetched and peak memory of the stage. Finished traces are
+written to a JSON run report.
+
+Notes:
+Queries and rows are counted by the read functions (db_pool.read_sql, bulk_lookup.read_sql_cells,
+stream_fetch.stream_sql, formation_mirror.read_mirror) and belong to the innermost open span. The trace follows the
+lot into query_executor threads through contextvars.
+A stage's wall time includes the stages nested in it (e.g. compile_data includes getOffsets).
+Peak memory is only measured when TRACE_MEMORY is set (tracemalloc slows allocations down). tracemalloc is process
+wide, with several lots running at once the peak includes the other lots' allocations, and a nested span resets the
+peak of the span around it.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import json
+import time
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+TRACE_MEMORY = False
+_trace = contextvars.ContextVar('trace', default=None)
+_stage = contextvars.ContextVar('stage', default=None)
+_trace_lock = threading.Lock()
+_finished = []
+
+
+def start_trace(lot: str) -> dict:
+    """
+    Input: lot number
+    Function: starts a trace for the lot in the current context, spans opened afterwards are recorded in it
+    Output: lot trace
+    """
+    if TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    trace = {'LOT_NO': lot, 'START': datetime.now().isoformat(), 'END': None, 'WALL_TIME': None, 'STAGES': {}}
+    _trace.set(trace)
+    return trace
+
+
+def end_trace(status: str = None) -> dict:
+    """
+    Input: final lot status
+    Function: closes the trace of the current context and keeps it for the run report
+    Output: lot trace (None if no trace is open)
+    """
+    trace = _trace.get()
+    if trace is None:
+        return None
+    trace['END'] = datetime.now().isoformat()
+    trace['WALL_TIME'] = round((datetime.fromisoformat(trace['END'])
+                                - datetime.fromisoformat(trace['START'])).total_seconds(), 3)
+    trace['STATUS'] = status
+    _trace.set(None)
+    with _trace_lock:
+        _finished.append(trace)
+    return trace
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Input: stage name
+    Function: times the enclosed code and attributes the queries run inside it to the stage, a stage entered more than
+              once accumulates
+    Output: None
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    with _trace_lock:
+        record = trace['STAGES'].setdefault(stage, {'CALLS': 0, 'WALL_TIME': 0.0, 'QUERIES': 0, 'ROWS': 0,
+                                                    'MIRROR_READS': 0, 'MIRROR_ROWS': 0, 'PEAK_MB': None})
+        record['CALLS'] += 1
+    token = _stage.set(stage)
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stage.reset(token)
+        with _trace_lock:
+            record['WALL_TIME'] = round(record['WALL_TIME'] + elapsed, 3)
+            if tracemalloc.is_tracing():
+                peak = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+                record['PEAK_MB'] = max(record['PEAK_MB'] or 0, peak)
+
+
+def record_query(rows: int, source: str = 'db'):
+    """
+    Input: rows returned and where they were read from ('db' or 'mirror')
+    Function: adds a read to the innermost open span of the current trace
+    Output: None
+    """
+    trace = _trace.get()
+    stage = _stage.get()
+    if trace is None or stage is None:
+        return
+    with _trace_lock:
+        record = trace['STAGES'][stage]
+        if source == 'mirror':
+            record['MIRROR_READS'] += 1
+            record['MIRROR_ROWS'] += rows
+        else:
+            record['QUERIES'] += 1
+            record['ROWS'] += rows
+
+
+def write_run_report(path: str) -> list[dict]:
+    """
+    Input: report file path
+    Function: writes every trace finished since the last report to a JSON file
+    Output: written lot traces
+    """
+    with _trace_lock:
+        traces = list(_finished)
+        _finished.clear()
+    with open(path, 'w') as f:
+        json.dump({'CREATED': datetime.now().isoformat(), 'LOTS': traces}, f, indent=2)
+    print(f'run report saved to {path}')
+    return traces
@@ -0,0 +1,70 @@
+"""
+Partition Router Module
+This program decides which database holds each monthly formation/assembly table. The MES database keeps the tables
+of the last MES_MONTHS months (current month included), older tables are only on the cold database. A request that
+covers several months is split into one sub-query per tier, the sub-queries run at the same time through
+query_executor and their results are merged, so a lot is never sent to a single database for months it does not hold.
+
+Notes:
+Tables are routed by month only, use query_tier for a query that has to join tables of several months in one
+statement (e.g. the offset windows), it goes to the tier of the newest month. The cold database does not hold the
+recent months, a join sent there would come back without their rows, while an older month that has already left the
+MES database fails the query instead of returning partial data.
+
+Version Updates:
+v1.0 - Initial release
+v1.1 - query_tier routes by the newest month instead of sending every join with a cold month to the cold database
+"""
+
+import pandas as pd
+from datetime import datetime
+from retest_flagging.query_executor import run_queries
+
+MES_MONTHS = 12
+
+
+def month_tier(yymm: str, now: datetime = None) -> str:
+    """
+    Input: table month (yymm) and reference time (current time if None)
+    Function: determines which database holds the monthly table
+    Output: 'mes' if the table is within the last MES_MONTHS months, 'cold' otherwise
+    """
+    now = now or datetime.now()
+    age = 12 * (now.year % 100 - int(yymm[:2])) + (now.month - int(yymm[2:4]))
+    return 'mes' if age < MES_MONTHS else 'cold'
+
+
+def split_months(months: list[str]) -> dict:
+    """
+    Input: table months
+    Function: groups the months by the database that holds them, keeping their order
+    Output: database tier ('mes' or 'cold') -> table months
+    """
+    now = datetime.now()
+    tiers = {}
+    for yymm in months:
+        tiers.setdefault(month_tier(yymm, now), []).append(yymm)
+    return tiers
+
+
+def query_tier(months: list[str]) -> str:
+    """
+    Input: table months joined in one query
+    Function: picks the database for a query that cannot be split by month, the newest month decides (see Notes)
+    Output: database tier ('mes' or 'cold') of the newest month
+    """
+    return month_tier(max(months))
+
+
+def run_partitioned(fxn, build_jobs, months: list[str]) -> pd.DataFrame():
+    """
+    Input: query function (called as fxn(job, tier=tier), see query_executor), function building the jobs of one tier
+           (called as build_jobs(tier, tier_months), returns a list of jobs) and table months
+    Function: splits the months by tier, runs every tier's jobs at the same time and merges the results
+    Output: merged query results (empty if there are no months)
+    """
+    jobs = [(tier, job) for tier, tier_months in split_months(months).items() for job in build_jobs(tier, tier_months)]
+    results = run_queries(fxn, jobs)
+    if len(results) == 0:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True)
@@ -0,0 +1,116 @@
+"""
+Query Executor Module
+This program runs database queries for the MES and cold databases at the same time on threads. The Oracle client
+releases the GIL while a query runs, so threads overlap the database round trips without the process-spawn cost of a
+multiprocessing pool, and a lot that spans both tiers takes about as long as the slower tier instead of the sum.
+
+Notes:
+Each tier has its own worker threads (TIER_LIMITS) shared by every caller in the process. Jobs are handed to a tier
+only while fewer than TIER_LIMITS + QUEUE_DEPTH of them are waiting or running, submitting more blocks until a slot
+frees up (backpressure). Database calls failing with a transient error (lost or refused connection, timeout) are
+retried MAX_RETRIES times, other errors (e.g. ORA-00942 for a missing month table) are raised at once. Results are
+returned in job order.
+
+Version Updates:
+v1.0 - Initial release
+v1.1 - Only transient connection errors are retried
+"""
+
+import re
+import time
+import threading
+import contextvars
+import cx_Oracle
+from concurrent.futures import ThreadPoolExecutor
+from pandas.io.sql import DatabaseError
+
+TIER_LIMITS = {'mes': 8, 'cold': 4}  # concurrent queries per database, must not exceed db_pool.POOL_MAX
+QUEUE_DEPTH = 4  # jobs allowed to wait per tier before submitting blocks
+MAX_RETRIES = 2
+RETRY_DELAY = 2  # seconds, doubled on every retry
+RETRY_ERRORS = (cx_Oracle.DatabaseError, DatabaseError)
+# ORA codes worth retrying: end-of-file on communication channel (3113), not connected (3114), connection lost contact
+# (3135), connect timeout (12170), connection closed (12537), no listener (12541), packet writer failure (12571)
+TRANSIENT_CODES = {3113, 3114, 3135, 12170, 12537, 12541, 12571}
+_executors = {}
+_slots = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor(tier: str) -> (ThreadPoolExecutor, threading.BoundedSemaphore):
+    """
+    Input: database tier ('mes' or 'cold')
+    Function: returns the process-wide worker threads and submission slots for the tier, creating them on first use
+    Output: thread pool and slot semaphore
+    """
+    with _executor_lock:
+        if tier not in _executors:
+            _executors[tier] = ThreadPoolExecutor(max_workers=TIER_LIMITS[tier], thread_name_prefix=f'{tier}_query')
+            _slots[tier] = threading.BoundedSemaphore(TIER_LIMITS[tier] + QUEUE_DEPTH)
+        return _executors[tier], _slots[tier]
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Input: database error
+    Function: checks the error and the errors it was raised from (pd.read_sql wraps the cx_Oracle error) for a
+              connection error that may succeed when retried
+    Output: boolean indicator if the query should be retried
+    """
+    while error is not None:
+        if isinstance(error, cx_Oracle.OperationalError):
+            return True
+        code = getattr(error.args[0], 'code', None) if error.args else None
+        if code is None:
+            match = re.search(r'ORA-(\d{5})', str(error))
+            code = int(match.group(1)) if match else None
+        if code in TRANSIENT_CODES:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def run_with_retry(fxn, job, tier: str):
+    """
+    Input: query function (called as fxn(job, tier=tier)), job and database tier
+    Function: runs the query, retrying transient database errors with an increasing delay
+    Output: query function result
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fxn(job, tier=tier)
+        except RETRY_ERRORS as e:
+            if attempt == MAX_RETRIES or not is_transient(e):
+                raise
+            print(f'{tier} query failed ({e}), retry {attempt + 1}/{MAX_RETRIES}')
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def run_queries(fxn, jobs: list[tuple]) -> list:
+    """
+    Input: query function (called as fxn(job, tier=tier)) and list of (tier, job)
+    Function: runs every job on its tier's threads, all tiers at the same time
+    Output: query function results in job order
+    """
+    results = [None] * len(jobs)
+    context = contextvars.copy_context()  # instrumentation trace of the caller
+    futures = [None] * len(jobs)
+
+    def submit_tier(tier: str, indexes: list[int]):
+        executor, slots = get_executor(tier)
+        for i in indexes:
+            slots.acquire()  # blocks while the tier is saturated
+            futures[i] = executor.submit(context.copy().run, run_with_retry, fxn, jobs[i][1], tier)
+            futures[i].add_done_callback(lambda f: slots.release())
+
+    tiers = {}
+    for i, (tier, job) in enumerate(jobs):
+        tiers.setdefault(tier, []).append(i)
+    submitters = [threading.Thread(target=submit_tier, args=(tier, indexes)) for tier, indexes in tiers.items()]
+    for submitter in submitters:
+        submitter.start()
+    for submitter in submitters:
+        submitter.join()
+    for i, future in enumerate(futures):
+        results[i] = future.result()
+    return results
@@ -0,0 +1,84 @@
+"""
+Stream Fetch Module
+This program fetches large query results in chunks straight into preallocated, typed numpy column buffers instead of
+letting pd.read_sql build the whole result as python rows first. Cursor arraysize and prefetch are tuned for the wide
+formation tables and every fetch reports its throughput.
+
+Notes:
+Columns listed in dtypes are stored with that numpy dtype (None becomes NaN/NaT), all other columns are stored as
+objects and inferred once at the end.
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import time
+import numpy as np
+import pandas as pd
+import cx_Oracle
+from retest_flagging.instrumentation import record_query
+from retest_flagging.db_replay import fetch
+from retest_flagging.db_pool import connection
+
+FETCH_ARRAYSIZE = 10000
+PREFETCH_ROWS = FETCH_ARRAYSIZE + 1  # lets small results finish in one round trip
+
+
+def stream_sql(query: str, con: cx_Oracle.Connection, dtypes: dict = None, params: dict = None,
+               size_hint: int = 0) -> pd.DataFrame():
+    """
+    Input: sql query, database connection, numpy dtype per column, bind parameters and expected row count
+    Function: fetches the query FETCH_ARRAYSIZE rows at a time into typed column buffers, growing them when needed
+    Output: query results
+    """
+    start = time.time()
+    data = fetch(query, params, lambda: fetch_buffers(query, con, dtypes or {}, params, size_hint))
+    elapsed = time.time() - start
+    record_query(len(data))
+    print(f'fetched {len(data)} rows in {elapsed:.2f}s ({len(data) / max(elapsed, 1e-6):.0f} rows/s)')
+    return data
+
+
+def fetch_buffers(query: str, con: cx_Oracle.Connection, dtypes: dict, params: dict,
+                  size_hint: int) -> pd.DataFrame():
+    """
+    Input: sql query, database connection, numpy dtype per column, bind parameters and expected row count
+    Function: runs the cursor fetch loop of stream_sql
+    Output: query results
+    """
+    cursor = con.cursor()
+    cursor.arraysize = FETCH_ARRAYSIZE
+    cursor.prefetchrows = PREFETCH_ROWS
+    cursor.execute(query, params or {})
+    columns = [d[0] for d in cursor.description]
+    capacity = max(size_hint, FETCH_ARRAYSIZE)
+    buffers = [np.empty(capacity, dtype=dtypes.get(column, object)) for column in columns]
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        if row_count + len(rows) > capacity:
+            capacity = max(2 * capacity, row_count + len(rows))
+            for i, buffer in enumerate(buffers):
+                grown = np.empty(capacity, dtype=buffer.dtype)
+                grown[:row_count] = buffer[:row_count]
+                buffers[i] = grown
+        for buffer, values in zip(buffers, zip(*rows)):
+            buffer[row_count:row_count + len(rows)] = values
+        row_count += len(rows)
+    cursor.close()
+    data = pd.DataFrame({column: buffer[:row_count] for column, buffer in zip(columns, buffers)})
+    return data.infer_objects()
+
+
+def pool_stream_query(job: tuple, db: dict, tier: str) -> pd.DataFrame():
+    """
+    Input: (sql query, numpy dtype per column, bind parameters), database credentials and database tier ('mes' or
+           'cold')
+    Function: runs stream_sql on a pooled session
+    Output: query results
+    """
+    query, dtypes, params = job
+    with connection(db, tier) as con:
+        return stream_sql(query, con, dtypes=dtypes, params=params)
@@ -0,0 +1,117 @@
+"""
+Summary Store Module
+This program keeps the dQ summary and pchart rows of every flagged lot in a local SQLite file. Rows are written with
+upsert-by-lot semantics (re-flagging a lot replaces its rows) inside one transaction, so lots flagged at the same time
+never overwrite each other's results and the history is never rewritten as a whole. CSV files are exported on demand.
+
+Notes:
+Column names match the CSV files the summary and pcharts were written to before (dq_summary.csv, *_dq_pchart.csv).
+
+Version Updates:
+v1.0 - Initial release
+"""
+
+import os
+import sqlite3
+import pandas as pd
+
+SUMMARY_COLUMNS = ['Lot', 'Missing Cell Data', 'Cell Age Min', 'Cell Age Max', 'dV Model OK', 'dV Model Voltage NGs',
+                   'dV Model dV NGs', 'dV Model Total NGs', 'dQ Model OK', 'dQ Model NG', 'Total Cells',
+                   'dV Model Yield', 'dQ Model Yield']
+PCHART_COLUMNS = ['V1_LOT_NO', 'V1_LOT_CLASSIFICATION', 'V1_LINE_NO', 'V1_INSPECTION_DATE', 'V1_OK', 'V1_NG',
+                  'V1_OTHER_NG', 'V1_VISUAL_NG', 'V1_ELECTROLYTE_LEAK', 'V2_LOT_NO', 'V2_LOT_CLASSIFICATION',
+                  'V2_LINE_NO', 'V2_INSPECTION_DATE', 'V2_OK', 'V2_NG', 'DV_NG', 'V2_OTHER_NG', 'V2_VISUAL_NG',
+                  'V2_ELECTROLYTE_LEAK', 'V2_NG_SUM', 'V2_NG_RATE (%)', 'V2_ALARM_THRESHOLD', 'V2_ABNORMAL_QUALITY',
+                  'RE_DV_INSPECTION', 'OCV_JUDGMENT']
+# table -> (lot key column, columns)
+TABLES = {'DQ_SUMMARY': ('Lot', SUMMARY_COLUMNS),
+          'DQ_PCHART': ('V1_LOT_NO', PCHART_COLUMNS)}
+
+
+def quote(column: str) -> str:
+    """
+    Input: column name
+    Function: quotes a column name for sqlite (names contain spaces and brackets)
+    Output: quoted column name
+    """
+    return '"' + column.replace('"', '""') + '"'
+
+
+def open_store(path: str) -> sqlite3.Connection:
+    """
+    Input: local store file path
+    Function: opens (and creates if needed) the summary store
+    Output: sqlite connection
+    """
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    con = sqlite3.connect(path, timeout=30)
+    for table, (key, columns) in TABLES.items():
+        con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(quote(c) for c in columns)}, UPDATED TEXT)")
+        con.execute(f'CREATE INDEX IF NOT EXISTS {table}_LOT ON {table} ({quote(key)})')
+    return con
+
+
+def upsert_lot(path: str, table: str, lot: str, rows: pd.DataFrame()):
+    """
+    Input: local store file path, table name, lot number and the lot's rows
+    Function: replaces all rows of the lot in one transaction
+    Output: None
+    """
+    key, columns = TABLES[table]
+    rows = rows.reindex(columns=columns).astype(object)
+    rows = rows.where(rows.notna(), None)
+    # numpy scalars are converted to python values, sqlite cannot bind them
+    values = [tuple(v.item() if hasattr(v, 'item') else v for v in row) + (pd.Timestamp.now().isoformat(),)
+              for row in rows.itertuples(index=False)]
+    con = open_store(path)
+    with con:
+        con.execute(f'DELETE FROM {table} WHERE {quote(key)} = ?', (lot,))
+        con.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * (len(columns) + 1))})", values)
+    con.close()
+
+
+def read_table(path: str, table: str, lots: list[str] = None) -> pd.DataFrame():
+    """
+    Input: local store file path, table name and lots to read (all lots if None)
+    Function: reads stored summary or pchart rows
+    Output: stored rows
+            index: [Default]
+            columns: [SUMMARY_COLUMNS or PCHART_COLUMNS]
+    """
+    key, columns = TABLES[table]
+    query = f"SELECT {', '.join(quote(c) for c in columns)} FROM {table}"
+    params = ()
+    if lots is not None:
+        query += f" WHERE {quote(key)} IN ({', '.join('?' * len(lots))})"
+        params = tuple(lots)
+    con = open_store(path)
+    data = pd.read_sql(query + ' ORDER BY rowid', con, params=params)
+    con.close()
+    return data
+
+
+def export_csv(path: str, table: str, csv_path: str, lots: list[str] = None) -> pd.DataFrame():
+    """
+    Input: local store file path, table name, csv file path and lots to export (all lots if None)
+    Function: writes stored rows to a csv file in the layout of the original csv outputs
+    Output: exported rows
+    """
+    data = read_table(path, table, lots)
+    if table == 'DQ_SUMMARY':
+        data.set_index('Lot').to_csv(csv_path)
+    else:
+        data.to_csv(csv_path, index=False)
+    return data
+
+
+def import_csv(path: str, table: str, csv_path: str):
+    """
+    Input: local store file path, table name and csv file path
+    Function: loads rows of an existing csv output (e.g. dq_summary.csv written before the store existed)
+    Output: None
+    """
+    key, columns = TABLES[table]
+    data = pd.read_csv(csv_path)
+    for lot, rows in data.groupby(key, sort=False):
+        upsert_lot(path, table, lot, rows)
@@ -0,0 +1,56 @@
+"""
+Cell ID decoding parity tests
+decode_yymm and decode_model in cell_id.py must give the same values as the original per-row dictionary lookups,
+cell IDs with characters that are not part of the code map (e.g. I, O, 0) decode to a missing value instead of
+raising.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from retest_flagging.cell_id import cell_id_dict, model_dict, decode_yymm, decode_model
+
+# code characters plus characters the code map leaves out
+CHARACTERS = list(cell_id_dict) + ['0', 'I', 'O', 'a', '-']
+
+
+def values(decoded: pd.Series) -> list:
+    return [None if pd.isna(value) else value for value in decoded]
+
+
+def legacy_yymm(cell_id) -> str:
+    if not isinstance(cell_id, str) or cell_id[4] not in cell_id_dict or cell_id[5] not in cell_id_dict:
+        return None
+    return cell_id_dict[cell_id[4]] + cell_id_dict[cell_id[5]]
+
+
+def legacy_model(cell_id) -> str:
+    if not isinstance(cell_id, str):
+        return None
+    return model_dict.get(cell_id[15])
+
+
+@pytest.fixture(scope='module')
+def cell_ids() -> pd.Series:
+    rng = np.random.default_rng(20221208)
+    ids = [''.join(row) for row in rng.choice(CHARACTERS, size=(20000, 16))]
+    # every year/month character pair and every model character appears at least once
+    ids += [f'G123{year}{month}1xxxxxxxx1' for year in CHARACTERS for month in CHARACTERS]
+    ids += [f'G123AA1xxxxxxxx{model}' for model in CHARACTERS]
+    return pd.Series(ids + [None], index=np.arange(len(ids) + 1) * 2)  # non-default index is kept
+
+
+def test_yymm_parity(cell_ids):
+    yymm = decode_yymm(cell_ids)
+    assert list(yymm.index) == list(cell_ids.index)
+    assert values(yymm) == [legacy_yymm(cell_id) for cell_id in cell_ids]
+
+
+def test_model_parity(cell_ids):
+    assert values(decode_model(cell_ids)) == [legacy_model(cell_id) for cell_id in cell_ids]
+
+
+def test_yymm_values():
+    assert values(decode_yymm(pd.Series(['G123SA1xxxxxxxx1', 'G12391xxxxxxxxx1', 'G123IA1xxxxxxxx1']))) == \
+        ['2610', '0901', None]
@@ -0,0 +1,64 @@
+"""
+dQdV curve lookup parity tests
+lookup_dqdv in dq_curve.py must give the same dQdV (up to rounding) as the original per-model np.interp(voltage,
+Voltage, dQdV, left=1e-9, right=1e-9), including voltages on the curve points, on the ends of the curve and outside it,
+NaN voltages and models without a curve.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from retest_flagging.dq_curve import load_curves, lookup_dqdv, GRID_STEP
+
+
+def make_curve(rng, start: float, end: float, points: int) -> pd.DataFrame():
+    voltage = np.unique(rng.uniform(start, end, points).round(6))
+    # a cluster of points closer together than one grid step
+    voltage = np.unique(np.concatenate([voltage, voltage[points // 2] + GRID_STEP * np.linspace(0.1, 0.9, 7)]))
+    return pd.DataFrame({'Voltage': voltage, 'dQdV': rng.uniform(0, 50, len(voltage))})
+
+
+@pytest.fixture(scope='module')
+def curves(tmp_path_factory) -> dict:
+    rng = np.random.default_rng(20221208)
+    directory = tmp_path_factory.mktemp('dq_curves')
+    frames = {'BR': make_curve(rng, 3.40, 3.60, 400), 'L1': make_curve(rng, 3.45, 3.52, 60)}
+    files = {}
+    for model, frame in frames.items():
+        files[model] = directory / f'{model}.csv'
+        frame.sample(frac=1, random_state=1).to_csv(files[model], index=False)  # load_curves sorts by voltage
+    return {'frames': frames, 'registry': load_curves(files)}
+
+
+@pytest.fixture(scope='module')
+def cell_data(curves) -> pd.DataFrame():
+    rng = np.random.default_rng(20221208)
+    size = 20000
+    data = pd.DataFrame({'CELL_MODEL': rng.choice(np.array(['BR', 'L1', 'DR', None], dtype=object), size),
+                         'VOLTAGE': rng.uniform(3.35, 3.65, size)})
+    data.loc[rng.choice(size, 200, replace=False), 'VOLTAGE'] = np.nan
+    # every curve point (ends included) of every model
+    points = [{'CELL_MODEL': model, 'VOLTAGE': voltage} for model, frame in curves['frames'].items()
+              for voltage in frame.Voltage]
+    return pd.concat([data, pd.DataFrame(points)], ignore_index=True)
+
+
+def legacy_dqdv(frames: dict, x) -> float:
+    if x.CELL_MODEL not in frames:
+        return np.nan
+    curve = frames[x.CELL_MODEL]
+    return np.interp(x.VOLTAGE, xp=curve.Voltage, fp=curve.dQdV, left=1e-9, right=1e-9)
+
+
+def test_dqdv_parity(curves, cell_data):
+    expected = cell_data.apply(lambda x: legacy_dqdv(curves['frames'], x), axis=1).to_numpy(np.float64)
+    dqdv = lookup_dqdv(curves['registry'], cell_data.CELL_MODEL, cell_data.VOLTAGE)
+    # steep segments between points closer than a grid step differ from np.interp by rounding only
+    np.testing.assert_allclose(dqdv, expected, rtol=1e-9, atol=0)
+    assert list(np.isnan(dqdv)) == list(np.isnan(expected))
+
+
+def test_dqdv_without_curves():
+    registry = load_curves({})
+    assert np.isnan(lookup_dqdv(registry, pd.Series(['BR']), pd.Series([3.5]))).all()
@@ -0,0 +1,80 @@
+"""
+Judgment rule table parity tests
+The rule tables in judgment.py must give the same DEFECT_CODE, PROCESS_NG, DQ_CODE and DQ_NG as the original row-wise
+lambdas of compile_data (Flagging v2.1), including NaN inputs and values exactly on the spec limits.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from retest_flagging.config import volt_spec, ndv_spec, rshort_spec, dv_offset, dv_coefficient, model_number
+from judgment import judge, DEFECT_RULES, DQ_RULES, PROCESS_NG_CODES, DQ_NG_CODES, OK_CODE
+
+# the original single-curve setup: only model_number has a dQdV curve
+SPEC = {'volt_spec': volt_spec, 'ndv_spec': ndv_spec, 'rshort_spec': rshort_spec, 'model_number': model_number,
+        'dq_models': [model_number]}
+VALUES = {
+    'DVDT': [np.nan, -1.0, -0.001, 0.0, 0.00005, 0.0000501, 1.0],
+    'DV_CUTOFF': [np.nan, -np.inf, dv_coefficient / 10 + dv_offset, 0.0],
+    'CELL_MODEL': [model_number, 'L2', None],
+    'SITTING_TIME': [np.nan, 0.0, 0.5, 10.0],
+    'RETEST_V1': [np.nan, 0.0, volt_spec - 1e-9, volt_spec, 3.6],
+    'RETEST_V2': [np.nan, 0.0, volt_spec - 1e-9, volt_spec, 3.6],
+    'NORM_DV': [-999.99, ndv_spec - 1e-9, ndv_spec, 0.0],
+    'R_SHORT': [np.nan, -1.0, rshort_spec - 1e-6, rshort_spec, np.inf],
+}
+
+
+def legacy_defect_code(x) -> str:
+    return ('900W' if (x.DVDT > 0.00005 or x.DVDT < x.DV_CUTOFF or x.CELL_MODEL != model_number
+                       or x.SITTING_TIME == 0)
+            else '400V' if x.RETEST_V1 < x.VOLTAGE_CUTOFF
+            else '500W' if x.RETEST_V2 < x.VOLTAGE_CUTOFF
+            else 'N000')
+
+
+def legacy_dq_code(x) -> str:
+    return ('900Z' if (x.RETEST_V1 < volt_spec) | (x.RETEST_V2 < volt_spec)
+            else '900Y' if x.NORM_DV < ndv_spec
+            else '900X' if x.CELL_MODEL != model_number
+            else '900W' if x.R_SHORT < rshort_spec or x.DVDT > 0.00005
+            else 'N000')
+
+
+@pytest.fixture(scope='module')
+def cell_data() -> pd.DataFrame():
+    rng = np.random.default_rng(20221208)
+    size = 20000
+    data = pd.DataFrame({column: rng.choice(np.array(values, dtype=object), size) for column, values in VALUES.items()})
+    for column in VALUES:
+        if column != 'CELL_MODEL':
+            data[column] = data[column].astype(np.float64)
+    # every boundary value of every column appears next to otherwise passing cells as well
+    passing = {'DVDT': 0.0, 'DV_CUTOFF': -np.inf, 'CELL_MODEL': model_number, 'SITTING_TIME': 10.0, 'RETEST_V1': 3.6,
+               'RETEST_V2': 3.6, 'NORM_DV': 0.0, 'R_SHORT': np.inf}
+    single = pd.DataFrame([{**passing, column: value} for column, values in VALUES.items() for value in values])
+    data = pd.concat([data, single.astype(data.dtypes.to_dict())], ignore_index=True)
+    data['CELL_ID'] = [f'CELL{x:08d}' for x in range(len(data))]
+    data['VOLTAGE_CUTOFF'] = volt_spec
+    return data
+
+
+def test_defect_code_parity(cell_data):
+    expected = cell_data.apply(legacy_defect_code, axis=1)
+    codes = judge(cell_data, DEFECT_RULES, SPEC)
+    assert list(codes) == list(expected)
+    assert list(pd.Series(codes).isin(PROCESS_NG_CODES)) == [code in ['900W', '400V', '500W'] for code in expected]
+
+
+def test_dq_code_parity(cell_data):
+    expected = cell_data.apply(legacy_dq_code, axis=1)
+    codes = judge(cell_data, DQ_RULES, SPEC)
+    assert list(codes) == list(expected)
+    assert list(pd.Series(codes).isin(DQ_NG_CODES)) == [code in ['900W', '900Y', '900X', '900U', '900Z']
+                                                        for code in expected]
+
+
+def test_every_code_reached(cell_data):
+    assert set(judge(cell_data, DEFECT_RULES, SPEC)) == {'900W', '400V', '500W', OK_CODE}
+    assert set(judge(cell_data, DQ_RULES, SPEC)) == {'900Z', '900Y', '900X', '900W', OK_CODE}
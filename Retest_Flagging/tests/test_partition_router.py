@@ -0,0 +1,43 @@
+"""
+Partition router tests
+month_tier must send a table to the cold database once it is MES_MONTHS months old, across year boundaries as well,
+and query_tier must route a multi-month join by its newest month.
+"""
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('cx_Oracle')  # partition_router runs its queries through query_executor
+
+from retest_flagging.partition_router import MES_MONTHS, month_tier, split_months, query_tier  # noqa: E402
+
+NOW = datetime(2026, 10, 18)
+
+
+@pytest.mark.parametrize('yymm, tier', [('2611', 'mes'),  # not assembled yet, still MES
+                                        ('2610', 'mes'),
+                                        ('2511', 'mes'),  # MES_MONTHS - 1 months old
+                                        ('2510', 'cold'),  # MES_MONTHS months old
+                                        ('2401', 'cold')])
+def test_month_tier(yymm, tier):
+    assert MES_MONTHS == 12
+    assert month_tier(yymm, NOW) == tier
+
+
+def test_month_tier_year_boundary():
+    now = datetime(2027, 1, 5)
+    assert month_tier('2602', now) == 'mes'
+    assert month_tier('2601', now) == 'cold'
+    assert month_tier('2612', datetime(2026, 12, 31)) == 'mes'
+
+
+def test_split_months():
+    newest = datetime.now().strftime('%y%m')
+    assert split_months(['1001', newest, '1002']) == {'cold': ['1001', '1002'], 'mes': [newest]}
+
+
+def test_query_tier_newest_month():
+    newest = datetime.now().strftime('%y%m')
+    assert query_tier(['1001', newest]) == 'mes'
+    assert query_tier(['1001', '1002']) == 'cold'
@@ -22,10 +22,6 @@ if __name__ == '__main__':
     LOT_DIRECTORY = r'C:\Users\KW38770\Documents\WangK\Formation\Retest\Processing'
     MES_USER, MES_PW, MES_DSN = ['PENAENG', 'p6bru@aXE=am', '10.133.200.175/GEISDB.WORLD']
     COLD_USER, COLD_PW, COLD_DSN = ['kwang', 'XV7A6GneRC2a', '10.133.200.174:1521/colddb.america.gds.panasonic.com']
-    cell_id_dict = {'1': '01', '2': '02', '3': '03', '4': '04', '5': '05', '6': '06', '7': '07', '8': '08', '9': '09',
-                    'A': '10', 'B': '11', 'C': '12', 'D': '13', 'E': '14', 'F': '15', 'G': '16', 'H': '17', 'J': '18',
-                    'K': '19', 'L': '20', 'M': '21', 'N': '22', 'P': '23', 'Q': '24', 'R': '25', 'S': '26', 'T': '27',
-                    'U': '28', 'V': '29', 'W': '30', 'X': '31', 'Y': '32', 'Z': '33'}
 
     # 11/22/22 dVdt Transient Behavior Analysis
     lot_list = ['220615HZ1', '220522HZ1', '220519HZ1', '220515HZ1', '220508HZ1', '220505HZ1', '211201HZ1', '211107HZ1',
@@ -10,14 +10,26 @@ Notes:
 
 Version Updates:
 v1.0 -
+v1.1 - Assembly attributes read from the shared assembly cache (retest_flagging.assembly_cache), only cache misses
+       are queried
+v1.2 - Shared modules imported from the installed retest_flagging package (pip install -e Retest_Flagging) instead
+       of a sys.path entry, cells with unknown assembly months skipped
+v1.3 - Queries run on pooled sessions (retest_flagging.db_pool) instead of new connections, lot number bound
+v1.4 - Cache misses grouped by the database holding their assembly month (partition_router.month_tier) instead of
+       sending the whole lot to the cold database when any month is cold
 
 """
 
 import pandas as pd
-import cx_Oracle
-import configparser
 from datetime import datetime
 
+from retest_flagging.bulk_lookup import CELL_ID_JOIN, read_sql_cells
+from retest_flagging.db_pool import connection, read_sql
+from retest_flagging.cell_id import decode_yymm
+from retest_flagging.partition_router import month_tier
+from retest_flagging.assembly_cache import cached_assembly_data
+from retest_flagging.config import ASSEMBLY_CACHE
+
 
 def get_cell_ids(lot: str, cfg: dict) -> pd.DataFrame():
     """
@@ -27,73 +39,69 @@ def get_cell_ids(lot: str, cfg: dict) -> pd.DataFrame():
             index: [Default]
             columns: [CELL_ID]
     """
-    with cx_Oracle.connect(user=cfg['mes_user'], password=cfg['mes_pw'], dsn=cfg['mes_dsn']) as con:
-        cell_ids = pd.read_sql(f"""
+    with connection(cfg, 'mes') as con:
+        cell_ids = read_sql("""
         SELECT CELL_ID
         FROM GEIS.V_TRAY_INFO
-        WHERE LOT_NO = '{lot}'
-        AND CELL_ID LIKE 'G%'""", con)
+        WHERE LOT_NO = :lot
+        AND CELL_ID LIKE 'G%'""", con, params={'lot': lot})
     print(f'get cell ids done: {len(cell_ids)}')
     return cell_ids
 
 
-def check_assembly_date(cell_list: pd.DataFrame()) -> (list, bool):
-    """
-    Input: cell list for a given retest lot
-    Function: determine assembly year & month from cell ID characters
-    Output: list of assembly dates and boolean indicator if cold db is required
-    """
-    cell_id_dict = {'1': '01', '2': '02', '3': '03', '4': '04', '5': '05', '6': '06', '7': '07', '8': '08', '9': '09',
-                    'A': '10', 'B': '11', 'C': '12', 'D': '13', 'E': '14', 'F': '15', 'G': '16', 'H': '17', 'J': '18',
-                    'K': '19', 'L': '20', 'M': '21', 'N': '22', 'P': '23', 'Q': '24', 'R': '25', 'S': '26', 'T': '27',
-                    'U': '28', 'V': '29', 'W': '30', 'X': '31', 'Y': '32', 'Z': '33'}
-    cell_list['yymm'] = cell_list.apply(lambda x: cell_id_dict[x.CELL_ID[4]] + cell_id_dict[x.CELL_ID[5]], axis=1)
-    month_check_list = []
-    for date in cell_list.yymm.unique():
-        # condition checks return True if assembly date is older than 12 months, False otherwise
-        con1 = date[:2] == str(datetime.now().year)[-2:]
-        con2 = (int(date[:2]) == int(str(datetime.now().year)[-2:]) - 1) and (int(date[-2:]) > datetime.now().month)
-        month_check_list.append(not(con1 or con2))
-    return cell_list.yymm.unique(), any(month_check_list)
-
-
-def get_assembly_data(user: str,
-                      pw: str,
-                      dsn: str,
-                      yymm_list: list[str],
-                      cell_list: pd.DataFrame()) -> pd.DataFrame():
+def get_assembly_data(cfg: dict, tier: str, yymm_list: list[str], cell_list: pd.DataFrame()) -> pd.DataFrame():
     """
-    Input: database configuration settings, list of assembly year & month, and list of cell ids
+    Input: database configuration settings, database tier ('mes' or 'cold'), list of assembly year & month, and list
+           of cell ids
     Function: query database for jrd & separator data
     Output: assembly cell data
             index: [Default]
             column: [CELL_ID, SEPARATOR, AVG_JRD]
     """
     separator_dict = {'G': 'S4', 'M': 'S5', 'Q': 'S6', 'P': 'S7'}
-    cell_tuples = [tuple(cell_list.CELL_ID[i*999:(i+1)*999]) for i in range(((len(cell_list) // 999) + 1))]
+    cell_ids = list(cell_list.CELL_ID)
     assembly_data = pd.DataFrame()
-    with cx_Oracle.connect(user=user, password=pw, dsn=dsn) as con:
+    with connection(cfg, tier) as con:
         for yymm in yymm_list:
-            for i, cell_tuple in enumerate(cell_tuples):
-                print(f'{i}/{len(cell_tuples)} ({i*100/len(cell_tuples):.2f}%)', datetime.now())  # remove
-                separator_data = pd.read_sql(f"""
-                SELECT CELL_ID, S1_LOT_NO AS SEPARATOR
-                FROM GEIS.T_CELL_ENG_GAWW00_{yymm}
-                WHERE CELL_ID IN {cell_tuple}
-                """, con)
-                jrd_data = pd.read_sql(f"""
-                SELECT CELL_ID, DATA_01 AS AVG_JRD FROM GEIS.T_CELL_ENG_GAWA38_{yymm}
-                WHERE CELL_ID IN {cell_tuple}
-                """, con)
-                separator_data.SEPARATOR = separator_data.SEPARATOR.apply(lambda x: separator_dict[x[2]]
-                                                                          if x[2] in separator_dict.keys() else 'Other')
-                cell_data = pd.merge(separator_data, jrd_data, on='CELL_ID', how='outer')
-                assembly_data = pd.concat([assembly_data, cell_data], ignore_index=True)
+            print(f'assembly data {yymm}: {len(cell_ids)} cells', datetime.now())
+            separator_data = read_sql_cells(f"""
+            SELECT t.CELL_ID, t.S1_LOT_NO AS SEPARATOR
+            FROM GEIS.T_CELL_ENG_GAWW00_{yymm} t
+            {CELL_ID_JOIN}
+            """, con, cell_ids)
+            jrd_data = read_sql_cells(f"""
+            SELECT t.CELL_ID, t.DATA_01 AS AVG_JRD FROM GEIS.T_CELL_ENG_GAWA38_{yymm} t
+            {CELL_ID_JOIN}
+            """, con, cell_ids)
+            separator_data.SEPARATOR = separator_data.SEPARATOR.apply(lambda x: separator_dict[x[2]]
+                                                                      if x[2] in separator_dict.keys() else 'Other')
+            cell_data = pd.merge(separator_data, jrd_data, on='CELL_ID', how='outer')
+            assembly_data = pd.concat([assembly_data, cell_data], ignore_index=True)
     # capture missing data rows with left join on original cell list
     assembly_data = pd.merge(cell_list, assembly_data, on='CELL_ID', how='left')
     return assembly_data
 
 
+def get_cached_assembly_data(cfg: dict, cell_list: pd.DataFrame()) -> pd.DataFrame():
+    """
+    Input: database configuration settings and list of cell ids
+    Function: reads jrd & separator data from the assembly cache, cells not cached yet are queried from the database
+    Output: assembly cell data
+            index: [Default]
+            column: [CELL_ID, yymm, SEPARATOR, AVG_JRD]
+    """
+    def fetch(missing: pd.DataFrame()) -> pd.DataFrame():
+        # IDs with unknown date characters have no assembly month, every month is read from the database holding it
+        missing = missing.assign(yymm=decode_yymm(missing.CELL_ID)).dropna(subset=['yymm'])
+        data = [get_assembly_data(cfg, tier, list(tier_cells.yymm.unique()), tier_cells)
+                for tier, tier_cells in missing.groupby(missing.yymm.map(month_tier))]
+        return pd.concat(data, ignore_index=True) if data else pd.DataFrame(columns=['CELL_ID', 'SEPARATOR', 'AVG_JRD'])
+
+    cell_list['yymm'] = decode_yymm(cell_list.CELL_ID)
+    assembly_data = cached_assembly_data(ASSEMBLY_CACHE, cell_list.CELL_ID, fetch)
+    return pd.merge(cell_list, assembly_data, on='CELL_ID', how='left')
+
+
 def get_chargeback_table(lot: str, cfg: dict, cell_list: str) -> pd.DataFrame():
     # may not be needed after total summary table is generated?
     """
@@ -104,11 +112,7 @@ def get_chargeback_table(lot: str, cfg: dict, cell_list: str) -> pd.DataFrame():
             column: [SMALL, LARGE]
     """
     cell_list = get_cell_ids(lot, cfg)
-    yymm_list, cold_db_bool = check_assembly_date(cell_list)
-    user = cfg['cold_user'] if cold_db_bool else cfg['mes_user']
-    pw = cfg['cold_pw'] if cold_db_bool else cfg['mes_pw']
-    dsn = cfg['cold_dsn'] if cold_db_bool else cfg['mes_dsn']
-    assembly_data = get_assembly_data(user, pw, dsn, yymm_list, cell_list)
+    assembly_data = get_cached_assembly_data(cfg, cell_list)
     # cells with missing data will populate with NG data for extraction
     assembly_data = assembly_data.fillna(value={'SEPARATOR': 'S4', 'AVG_JRD': 20.11})
     assembly_data['JRD_SIZE'] = assembly_data.apply(lambda x: 'LARGE' if x.AVG_JRD > 20.10 else 'SMALL', axis=1)
@@ -125,11 +129,7 @@ def get_impingement_cells(lot: str, cfg: dict, cell_list: pd.DataFrame()) -> pd.
             column: [CELL_ID]
     """
     # cell_list = get_cell_ids(lot, cfg)
-    yymm_list, cold_db_bool = check_assembly_date(cell_list)
-    user = cfg['cold_user'] if cold_db_bool else cfg['mes_user']
-    pw = cfg['cold_pw'] if cold_db_bool else cfg['mes_pw']
-    dsn = cfg['cold_dsn'] if cold_db_bool else cfg['mes_dsn']
-    assembly_data = get_assembly_data(user, pw, dsn, yymm_list, cell_list)
+    assembly_data = get_cached_assembly_data(cfg, cell_list)
     # assembly_data.to_csv(rf'C:\Users\KW38770\Documents\WangK\Formation\Retest\Processing\{lot}\assembly_data.csv')
     # assembly_data.to_csv(rf'C:\Users\KW38770\Documents\WangK\Formation\Retest\v2.0 Development\Script Validation\assembly_data.csv')
     impingement_cells = assembly_data[(assembly_data.SEPARATOR == 'S4') | (assembly_data.AVG_JRD > 20.10)]